@@ -0,0 +1,258 @@
+"""
+At-rest compression for large or repetitive columns.
+Encoded values are BLOBs that start with a format byte. Plaintext TEXT values
+(rows written before the codec, and values too small to be worth it) are
+returned unchanged, so old and new rows can be mixed freely:
+
+    0x01 zlib (raw deflate)              0x03 zstd
+    0x02 zlib + dictionary <id: u32 LE>  0x04 zstd + dictionary <id: u32 LE>
+
+Per-sentence analysis JSON is small and repetitive, so it is compressed with
+a dictionary trained from stored analyses: first once there are enough of
+them, then again whenever they have grown enough to be worth a fresh sample.
+Dictionaries are kept in codec_dicts and never deleted, so every row stays
+decodable.
+"""
+
+import logging
+import struct
+import threading
+import time
+import zlib
+from typing import Optional, Union
+
+from app.config import STORAGE_CODEC_CONFIG
+from app.database import get_db
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+FORMAT_ZLIB = 1
+FORMAT_ZLIB_DICT = 2
+FORMAT_ZSTD = 3
+FORMAT_ZSTD_DICT = 4
+
+KIND_ANALYSIS = "analysis"
+KIND_CONTENT = "content"
+KIND_SCAFFOLDING = "scaffolding"
+
+# (table, column, kind) of every encoded column
+COLUMNS = [
+    ("sentences", "analysis_json", KIND_ANALYSIS),
+    ("chapters", "content", KIND_CONTENT),
+    ("texts", "scaffolding_data", KIND_SCAFFOLDING),
+]
+
+ZLIB_WBITS = -15  # raw deflate: no header/checksum, the format byte identifies it
+ZLIB_MAX_DICT = 32768
+ACTIVE_DICT_TTL = 60.0  # seconds before re-checking for a newer dictionary
+
+_dicts = {}   # dict id -> bytes
+_active = {}  # kind -> (dict id or None, checked_at)
+_local = threading.local()
+_migration: Optional[threading.Thread] = None
+
+
+def _use_zstd() -> bool:
+    return zstandard is not None and STORAGE_CODEC_CONFIG["codec"] == "zstd"
+
+
+def _dictionary(dict_id: int) -> bytes:
+    data = _dicts.get(dict_id)
+    if data is None:
+        with get_db() as conn:
+            row = conn.execute("SELECT data FROM codec_dicts WHERE id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"Missing compression dictionary {dict_id}")
+        data = _dicts[dict_id] = row["data"]
+    return data
+
+
+def active_dict_id(kind: str) -> Optional[int]:
+    cached = _active.get(kind)
+    if cached and time.monotonic() - cached[1] < ACTIVE_DICT_TTL:
+        return cached[0]
+    with get_db() as conn:
+        row = conn.execute(
+            "SELECT id FROM codec_dicts WHERE kind = ? ORDER BY id DESC LIMIT 1", (kind,)
+        ).fetchone()
+    dict_id = row["id"] if row else None
+    _active[kind] = (dict_id, time.monotonic())
+    return dict_id
+
+
+def _zstd(dict_id: Optional[int], compress: bool):
+    # zstandard (de)compressors are not safe to share between threads
+    cache = _local.__dict__.setdefault("compressors" if compress else "decompressors", {})
+    obj = cache.get(dict_id)
+    if obj is None:
+        dict_data = zstandard.ZstdCompressionDict(_dictionary(dict_id)) if dict_id else None
+        if compress:
+            obj = zstandard.ZstdCompressor(level=STORAGE_CODEC_CONFIG["zstd_level"], dict_data=dict_data,
+                                           write_checksum=False, write_dict_id=False)
+        else:
+            obj = zstandard.ZstdDecompressor(dict_data=dict_data)
+        cache[dict_id] = obj
+    return obj
+
+
+def encode(value: Optional[str], kind: str) -> Optional[Union[str, bytes]]:
+    """Compress a column value for storage; returns it unchanged when not worth it"""
+    if value is None or not STORAGE_CODEC_CONFIG["enabled"] or len(value) < STORAGE_CODEC_CONFIG["min_size"]:
+        return value
+    raw = value.encode("utf-8")
+    dict_id = active_dict_id(kind) if kind == KIND_ANALYSIS else None
+    if _use_zstd():
+        header = bytes([FORMAT_ZSTD_DICT]) + struct.pack("<I", dict_id) if dict_id else bytes([FORMAT_ZSTD])
+        blob = header + _zstd(dict_id, compress=True).compress(raw)
+    else:
+        if dict_id:
+            header = bytes([FORMAT_ZLIB_DICT]) + struct.pack("<I", dict_id)
+            c = zlib.compressobj(STORAGE_CODEC_CONFIG["zlib_level"], zlib.DEFLATED, ZLIB_WBITS,
+                                 zdict=_dictionary(dict_id)[-ZLIB_MAX_DICT:])
+        else:
+            header = bytes([FORMAT_ZLIB])
+            c = zlib.compressobj(STORAGE_CODEC_CONFIG["zlib_level"], zlib.DEFLATED, ZLIB_WBITS)
+        blob = header + c.compress(raw) + c.flush()
+    return blob if len(blob) < len(raw) else value
+
+
+def decode(value: Optional[Union[str, bytes]]) -> Optional[str]:
+    """Column value as stored (plaintext or any encoded format) -> str"""
+    if value is None or isinstance(value, str):
+        return value
+    fmt = value[0]
+    if fmt == FORMAT_ZSTD:
+        return _zstd(None, compress=False).decompress(value[1:]).decode("utf-8")
+    if fmt == FORMAT_ZSTD_DICT:
+        (dict_id,) = struct.unpack_from("<I", value, 1)
+        return _zstd(dict_id, compress=False).decompress(value[5:]).decode("utf-8")
+    if fmt == FORMAT_ZLIB:
+        return zlib.decompress(value[1:], ZLIB_WBITS).decode("utf-8")
+    if fmt == FORMAT_ZLIB_DICT:
+        (dict_id,) = struct.unpack_from("<I", value, 1)
+        d = zlib.decompressobj(ZLIB_WBITS, zdict=_dictionary(dict_id)[-ZLIB_MAX_DICT:])
+        return (d.decompress(value[5:]) + d.flush()).decode("utf-8")
+    raise ValueError(f"Unknown storage format {fmt}")
+
+
+def _analysis_count() -> int:
+    with get_db() as conn:
+        return conn.execute("SELECT COUNT(*) FROM sentences WHERE analysis_json IS NOT NULL").fetchone()[0]
+
+
+def train_dictionary(kind: str = KIND_ANALYSIS) -> Optional[int]:
+    """Train and store a dictionary from a sample of stored analyses; returns its id"""
+    count = _analysis_count()
+    with get_db() as conn:
+        rows = conn.execute(
+            "SELECT analysis_json FROM sentences WHERE analysis_json IS NOT NULL ORDER BY RANDOM() LIMIT ?",
+            (STORAGE_CODEC_CONFIG["dict_max_samples"],)
+        ).fetchall()
+    samples = [decode(r["analysis_json"]).encode("utf-8") for r in rows]
+    if len(samples) < STORAGE_CODEC_CONFIG["dict_min_samples"]:
+        return None
+
+    if zstandard is not None:
+        data = zstandard.train_dictionary(STORAGE_CODEC_CONFIG["dict_size"], samples).as_bytes()
+        codec = "zstd"
+    else:
+        # Without a trainer, a preset dictionary of raw samples still captures the shared keys
+        data = b"".join(samples)[-STORAGE_CODEC_CONFIG["dict_size"]:]
+        codec = "zlib"
+    with get_db() as conn:
+        cursor = conn.execute(
+            "INSERT INTO codec_dicts (kind, codec, data, trained_on) VALUES (?, ?, ?, ?)", (kind, codec, data, count)
+        )
+        dict_id = cursor.lastrowid
+    _dicts[dict_id] = data
+    _active[kind] = (dict_id, time.monotonic())
+    logger.info(f"Trained {codec} dictionary {dict_id} for {kind} from {len(samples)} samples ({len(data)} bytes)")
+    return dict_id
+
+
+def retrain_if_due(kind: str = KIND_ANALYSIS) -> Optional[int]:
+    """
+    Train the first dictionary once dict_min_samples analyses are stored, and
+    a new one each time they reach dict_retrain_growth times the count the
+    active one was trained on; returns the new dictionary's id, if any
+    """
+    count = _analysis_count()
+    if count < STORAGE_CODEC_CONFIG["dict_min_samples"]:
+        return None
+    dict_id = active_dict_id(kind)
+    if dict_id is not None:
+        with get_db() as conn:
+            trained_on = conn.execute("SELECT trained_on FROM codec_dicts WHERE id = ?",
+                                      (dict_id,)).fetchone()["trained_on"]
+        # Dictionaries from before trained_on was recorded are retrained once
+        if trained_on and count < trained_on * STORAGE_CODEC_CONFIG["dict_retrain_growth"]:
+            return None
+    return train_dictionary(kind)
+
+
+def _pending_predicate(column: str, kind: str) -> str:
+    plaintext = f"(typeof({column}) = 'text' AND length({column}) >= {int(STORAGE_CODEC_CONFIG['min_size'])})"
+    if kind == KIND_ANALYSIS and active_dict_id(kind):
+        # Analyses compressed before the dictionary existed are re-encoded with it
+        return f"({plaintext} OR (typeof({column}) = 'blob' AND substr({column}, 1, 1) IN (x'01', x'03')))"
+    return plaintext
+
+
+def migrate_column(table: str, column: str, kind: str) -> int:
+    """Re-encode old rows of one column in small batches; returns rows rewritten"""
+    predicate = _pending_predicate(column, kind)
+    total = 0
+    last_id = 0
+    while True:
+        with get_db() as conn:
+            rows = conn.execute(
+                f"SELECT id, {column} AS value FROM {table} WHERE id > ? AND {predicate} ORDER BY id LIMIT ?",
+                (last_id, STORAGE_CODEC_CONFIG["migrate_batch"])
+            ).fetchall()
+            if not rows:
+                return total
+            # "IS ?" skips rows a request rewrote since they were read
+            conn.executemany(
+                f"UPDATE {table} SET {column} = ? WHERE id = ? AND {column} IS ?",
+                [(encode(decode(r["value"]), kind), r["id"], r["value"]) for r in rows]
+            )
+        last_id = rows[-1]["id"]
+        total += len(rows)
+        time.sleep(STORAGE_CODEC_CONFIG["migrate_pause"])
+
+
+def migrate():
+    if not STORAGE_CODEC_CONFIG["enabled"]:
+        return
+    try:
+        retrain_if_due(KIND_ANALYSIS)
+        for table, column, kind in COLUMNS:
+            count = migrate_column(table, column, kind)
+            if count:
+                logger.info(f"Compressed {count} rows of {table}.{column}")
+    except Exception as e:
+        logger.error(f"Storage codec migration failed: {e}")
+
+
+def _loop():
+    migrate()
+    # New analyses are encoded as they are written; only the dictionary needs revisiting
+    while True:
+        time.sleep(STORAGE_CODEC_CONFIG["dict_check_interval"])
+        try:
+            retrain_if_due(KIND_ANALYSIS)
+        except Exception as e:
+            logger.error(f"Storage codec dictionary training failed: {e}")
+
+
+def start_background_migration():
+    """Compress plaintext rows, then keep the analysis dictionary fresh, without blocking startup or requests"""
+    global _migration
+    if STORAGE_CODEC_CONFIG["enabled"] and (_migration is None or not _migration.is_alive()):
+        _migration = threading.Thread(target=_loop, name="codec-migration", daemon=True)
+        _migration.start()
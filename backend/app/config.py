@@ -4,16 +4,47 @@ import os
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24 * 7  # 7 days
+# Accounts allowed to use /admin endpoints (comma-separated emails)
+ADMIN_EMAILS = {e.strip().lower() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+# scrypt for stored passwords; legacy salted SHA-256 hashes are upgraded on login
+PASSWORD_HASH_CONFIG = {
+    "n": int(os.getenv("PASSWORD_SCRYPT_N", str(2 ** 15))),  # CPU/memory cost: 128 * n * r bytes (32 MiB)
+    "r": 8,
+    "p": 1,
+    # Threads hashing at once; a login burst queues here instead of on the event loop
+    "workers": int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1)))),
+    "max_waiting": int(os.getenv("PASSWORD_HASH_MAX_WAITING", "64")),  # more logins/registrations get 503
+}
+
+# ============ Storage ============
+STORAGE_CONFIG = {
+    "backend": os.getenv("STORAGE_BACKEND", "sqlite"),  # sqlite (one process) | postgres (many workers/nodes)
+    # Relative to backend/, not the working directory
+    "sqlite_path": os.getenv("DATABASE_PATH", os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                           "reading_copilot_v3.db")),
+    # Seconds a write waits for the file lock; imports commit chapter by chapter,
+    # so concurrent ones queue behind each other for longer than SQLite's default 5
+    "sqlite_busy_timeout": float(os.getenv("SQLITE_BUSY_TIMEOUT", "30")),
+    "postgres_dsn": os.getenv("DATABASE_URL", "postgresql://localhost/reading_copilot"),
+    "pool_min": int(os.getenv("DB_POOL_MIN", "2")),    # asyncpg connections per worker
+    "pool_max": int(os.getenv("DB_POOL_MAX", "10")),
+    "command_timeout": 30,                              # seconds per statement
+}
+# At-rest compression and file maintenance work on the SQLite file itself and
+# are off with postgres (TOAST and autovacuum do that job there)
+SQLITE_STORAGE = STORAGE_CONFIG["backend"] == "sqlite"
 
 # ============ AI 配置 ============
 AI_CONFIG = {
     "aliyun": {
         "api_key": os.getenv("ALIYUN_API_KEY", "sk-beca0b70649540348826dd433986fe54"),
-        "model": "qwen-plus"
+        "model": "qwen-plus",
+        "base_url": os.getenv("ALIYUN_BASE_URL", "https://dashscope.aliyuncs.com"),
     },
     "google": {
         "api_key": os.getenv("GOOGLE_API_KEY", ""),
-        "model": "gemini-2.5-flash-lite"
+        "model": "gemini-2.5-flash-lite",
+        "base_url": os.getenv("GOOGLE_BASE_URL", "https://generativelanguage.googleapis.com"),
     }
 }
 
@@ -24,3 +55,188 @@ VOICES = {
     "male": "en-US-GuyNeural",
     "female_us": "en-US-JennyNeural",
 }
+
+# edge-tts websocket endpoint override (e.g. the benchmark stub); empty uses the library default
+EDGE_TTS_WSS_URL = os.getenv("EDGE_TTS_WSS_URL", "")
+
+# ============ Audiobook Rendering ============
+AUDIOBOOK_CONFIG = {
+    # Per-sentence MP3 segments, named by hash of voice + sentence (shared by all texts)
+    "segment_dir": os.getenv("AUDIO_SEGMENT_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                               "audio_segments")),
+    "workers": int(os.getenv("AUDIOBOOK_WORKERS", "4")),  # concurrent edge-tts syntheses, all renders together
+    "max_renders": int(os.getenv("AUDIOBOOK_MAX_RENDERS", "8")),  # texts rendering at once; more get 429
+    "retries": 2,                    # extra attempts per sentence before it is skipped
+    "bitrate": 48000,                # edge-tts default output (audio-24khz-48kbitrate-mono-mp3), for durations
+    # Playlist target duration: fixed for a text, at least this, more if a sentence could take
+    # longer to speak at the slow rates below (English TTS runs ~15 chars/s, ~2.5 words/s)
+    "target_duration": 10,
+    "min_chars_per_second": 8,
+    "min_words_per_second": 1.5,
+    "job_ttl": 3600,                 # seconds a finished render's status is kept in memory
+    "max_cached_renders": 64,        # renders kept in memory (each lists a whole text's segments)
+    # Least recently used segments are deleted past this size (segments of cached renders are kept)
+    "segment_max_mb": int(os.getenv("AUDIO_SEGMENT_MAX_MB", "4096")),
+    "sweep_interval": 3600,          # seconds between segment store sweeps
+    "url_ttl": 6 * 3600,             # signed playlist/segment URLs (for players that can't send a token)
+}
+
+# ============ AI Provider Router ============
+AI_ROUTER_CONFIG = {
+    "hedge_enabled": os.getenv("AI_HEDGE_ENABLED", "1") == "1",
+    "hedge_default_delay": float(os.getenv("AI_HEDGE_DEFAULT_DELAY", "3.0")),  # seconds, before stats warm up
+    "hedge_min_delay": 0.3,        # never hedge earlier than this
+    "window_size": 200,            # rolling samples kept per provider
+    "min_samples": 20,             # samples needed before trusting p95
+    "unhealthy_error_rate": 0.5,   # demote a provider above this error rate
+}
+
+# ============ AI Admission Control ============
+ADMISSION_CONFIG = {
+    "user_rate_per_minute": int(os.getenv("AI_USER_RATE_PER_MINUTE", "30")),
+    "user_burst": int(os.getenv("AI_USER_BURST", "10")),
+    "provider_concurrency": {
+        "aliyun": int(os.getenv("ALIYUN_MAX_CONCURRENCY", "16")),
+        "google": int(os.getenv("GOOGLE_MAX_CONCURRENCY", "16")),
+    },
+    "max_queue": 64,       # waiters per provider before rejecting outright
+    "max_wait": 10.0,      # seconds a request may wait for an upstream slot
+}
+
+# ============ Resumable AI Streams ============
+STREAM_RESUME_CONFIG = {
+    "buffer_events": 4096,   # events retained per stream for replay
+    "ttl": 300,              # seconds a finished stream stays replayable
+    "max_sessions": 2000,
+}
+
+# ============ Batched Sentence Analysis ============
+ANALYSIS_BATCH_CONFIG = {
+    "max_batch_tokens": 1500,  # estimated tokens of sentence text packed into one call
+    "max_items": 12,           # sentences per call
+    "linger": 0.05,            # seconds to wait for more sentences before flushing
+}
+
+# ============ Lookahead Analysis Prefetch ============
+PREFETCH_CONFIG = {
+    "enabled": os.getenv("AI_PREFETCH_ENABLED", "1") == "1",
+    "lookahead": int(os.getenv("AI_PREFETCH_LOOKAHEAD", "8")),   # sentences after the reading position
+    "user_budget_per_hour": int(os.getenv("AI_PREFETCH_BUDGET", "120")),  # sentences per user per hour
+    "provider": os.getenv("AI_PREFETCH_PROVIDER", "aliyun"),     # uses server-side keys only
+}
+
+# ============ Sentence Retrieval Index ============
+RETRIEVAL_CONFIG = {
+    # Relative to backend/, not the working directory
+    "index_dir": os.getenv("RETRIEVAL_INDEX_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                                               "retrieval_index")),
+    "dims": 384,               # hashed feature dimensions per sentence vector
+    "default_k": 5,
+    "max_context_chars": 2000, # cap on retrieved text attached to a chat prompt
+}
+
+# ============ Fuzzy Translation Memory ============
+TRANSLATION_MEMORY_CONFIG = {
+    "enabled": os.getenv("TRANSLATION_MEMORY_ENABLED", "1") == "1",
+    "num_perm": 64,          # MinHash permutations
+    "bands": 16,             # LSH bands (num_perm / bands rows each)
+    "reuse_threshold": 0.80, # estimated Jaccard needed to reuse a stored analysis
+    "min_chars": 20,         # shorter sentences are too context-dependent to reuse
+    "max_candidates": 20,
+}
+
+# ============ CEFR Lexicon ============
+LEXICON_CONFIG = {
+    "enabled": os.getenv("LEXICON_ENABLED", "1") == "1",
+    "data_dir": os.getenv("LEXICON_DIR", os.path.join(os.path.dirname(__file__), "data", "lexicon")),
+    "min_level": 2,          # A1 words are never pre-selected as vocabulary
+    "unknown_level": 6,      # lowercase words missing from the lexicon count as C2
+}
+
+# ============ Chapter Storage ============
+CHAPTER_CONFIG = {
+    "min_chapter_chars": 500,     # shorter detected chapters (e.g. contents entries) merge forward
+    "max_chapter_chars": 100000,  # longer chapters/undivided texts are split at paragraph breaks
+    "preview_chars": 300,         # kept on the texts row for the library view
+}
+
+# ============ At-rest Compression ============
+STORAGE_CODEC_CONFIG = {
+    "enabled": os.getenv("STORAGE_CODEC_ENABLED", "1") == "1" and SQLITE_STORAGE,
+    "codec": os.getenv("STORAGE_CODEC", "zstd"),  # zstd (needs zstandard, else falls back) | zlib
+    "zstd_level": 6,
+    "zlib_level": 6,
+    "min_size": 64,             # smaller values stay plaintext
+    "dict_size": 16384,         # trained dictionary for per-sentence analysis JSON
+    "dict_min_samples": 500,    # analyses needed before a dictionary is trained
+    "dict_max_samples": 5000,
+    "dict_retrain_growth": 2.0,     # retrain once stored analyses reach this multiple of the last training set
+    "dict_check_interval": 3600,    # seconds between checks for (re)training
+    "migrate_batch": 500,       # rows re-encoded per background transaction
+    "migrate_pause": 0.05,      # seconds between batches, leaves room for request writes
+}
+
+# ============ Database Maintenance ============
+MAINTENANCE_CONFIG = {
+    "enabled": os.getenv("DB_MAINTENANCE_ENABLED", "1") == "1" and SQLITE_STORAGE,
+    "interval": int(os.getenv("DB_MAINTENANCE_INTERVAL", "300")),  # seconds between maintenance passes
+    "orphan_batch": 2000,         # rows deleted per orphan-cleanup transaction
+    "vacuum_step_pages": 256,     # pages freed per incremental_vacuum call (1 MiB at 4 KiB pages)
+    "vacuum_max_pages": 65536,    # pages freed per pass, the rest waits for the next pass
+    "vacuum_keep_pages": 64,      # free pages left for upcoming inserts
+    "step_pause": 0.05,           # seconds between batches/steps, leaves room for request writes
+    "optimize_interval": 6 * 3600,  # seconds between PRAGMA optimize runs
+    "analysis_limit": 400,        # rows sampled per index by ANALYZE
+    # Switching an existing database to incremental auto_vacuum takes one full VACUUM, which locks
+    # it for the duration; off by default, run `python -m app.services.maintenance convert` instead
+    "auto_convert": os.getenv("DB_AUTO_VACUUM_CONVERT", "0") == "1",
+    "convert_max_mb": 256,        # with auto_convert, larger databases still need the convert command
+}
+
+# ============ Book Import ============
+IMPORT_CONFIG = {
+    "max_file_mb": int(os.getenv("IMPORT_MAX_FILE_MB", "100")),  # uploaded .epub/.txt size
+    "max_document_mb": 32,        # uncompressed size of one EPUB spine document
+    "max_chars": 100000000,       # total book text, same cap as PDF extraction
+}
+
+# ============ Metrics ============
+METRICS_CONFIG = {
+    "enabled": os.getenv("METRICS_ENABLED", "1") == "1",
+    "token": os.getenv("METRICS_TOKEN", ""),  # if set, GET /metrics needs "Authorization: Bearer <token>"
+    "loop_lag_interval": 0.5,                 # seconds between event loop lag samples
+}
+
+# ============ Logging ============
+LOGGING_CONFIG = {
+    "level": os.getenv("LOG_LEVEL", "INFO"),
+    "file": os.getenv("LOG_FILE", "server_debug.log"),        # empty: console only
+    "file_format": os.getenv("LOG_FILE_FORMAT", "json"),      # json (one object per line) | text
+    "sampling": os.getenv("LOG_SAMPLING", ""),                # "logger.prefix=rate,..." for records below WARNING
+    "max_message_chars": int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000")),  # longer messages are cut and hashed
+    "queue_size": 10000,                                      # records waiting for the writer; more are dropped
+}
+
+# ============ Request Profiling ============
+PROFILING_CONFIG = {
+    "enabled": os.getenv("PROFILING_ENABLED", "1") == "1",  # admins can turn profiling on at runtime
+    "ring_size": 20,          # reports kept
+    "sample_interval": 0.005, # seconds between stack samples
+    "max_stacks": 5000,       # distinct folded stacks per report
+    "max_sql": 2000,          # statements kept per report (the rest are only counted)
+    "arm_ttl": 600,           # seconds an armed X-Profile token stays valid
+}
+
+# ============ Frontend ============
+FRONTEND_CONFIG = {
+    "enabled": os.getenv("SERVE_FRONTEND", "0") == "1",  # serve the built React app from this process
+    "dist_dir": os.getenv("FRONTEND_DIST", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__)))), "src-react", "dist")),
+    "precompress": os.getenv("FRONTEND_PRECOMPRESS", "1") == "1",  # write missing .br/.gz at startup
+    "min_compress_bytes": 1024,         # smaller files are only served as they are
+    "memory_max_bytes": 1024 * 1024,    # files (per encoding) up to this size are served from memory
+    "chunk_bytes": 256 * 1024,          # read size for larger files when the server can't sendfile
+    "immutable_max_age": 365 * 24 * 3600,  # content-hashed assets under assets/
+    # Never answered with index.html: unknown API paths keep their 404/405 and slash redirects
+    "api_prefixes": ("/auth", "/texts", "/ai", "/sentences", "/tts", "/pdf", "/admin", "/metrics", "/health"),
+}
@@ -1,19 +1,80 @@
 """
 Database models and initialization for AI Reading Co-pilot
-Uses SQLite for lightweight local storage
+Uses SQLite for lightweight local storage (the default storage backend, see
+app/storage; the PostgreSQL backend creates its own schema)
 """
 
 import sqlite3
 import os
+import time
 from datetime import datetime
 from contextlib import contextmanager
+from app import metrics, profiling
+from app.config import METRICS_CONFIG, PROFILING_CONFIG, SQLITE_STORAGE, STORAGE_CONFIG
 
-DATABASE_PATH = "reading_copilot_v3.db"
+DATABASE_PATH = STORAGE_CONFIG["sqlite_path"]
+
+def _observe(statement, seconds):
+    metrics.observe_query(seconds, statement=statement is not None)
+    profiling.observe_query(statement, seconds)
+
+class TimedCursor(sqlite3.Cursor):
+    """Reports statement and fetch time to app.metrics and app.profiling"""
+
+    def execute(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, *args)
+        finally:
+            _observe(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, *args):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, *args)
+        finally:
+            _observe(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            _observe(None, time.perf_counter() - started)
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args)
+        finally:
+            _observe(None, time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            _observe(None, time.perf_counter() - started)
+
+class TimedConnection(sqlite3.Connection):
+    # Connection.execute does not go through cursor(), so both are overridden
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
 
 def get_db_connection():
     """Get a database connection with row factory"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    timed = METRICS_CONFIG["enabled"] or PROFILING_CONFIG["enabled"]
+    conn = sqlite3.connect(DATABASE_PATH, timeout=STORAGE_CONFIG["sqlite_busy_timeout"],
+                           factory=TimedConnection if timed else sqlite3.Connection)
     conn.row_factory = sqlite3.Row
+    # Off by default in SQLite; without it ON DELETE CASCADE does nothing
+    conn.execute("PRAGMA foreign_keys = ON")
     return conn
 
 @contextmanager
@@ -33,6 +94,10 @@ def init_database():
     """Initialize database tables"""
     with get_db() as conn:
         cursor = conn.cursor()
+
+        # Only takes effect on a new (empty) database; existing ones are
+        # converted by app/services/maintenance.py
+        cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
         
         # Users table
         cursor.execute('''
@@ -51,12 +116,16 @@ def init_database():
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER NOT NULL,
                 title TEXT NOT NULL,
-                content TEXT NOT NULL,
-                scaffolding_data TEXT,  -- AI processed data as JSON
+                content TEXT NOT NULL,  -- legacy; now empty, see chapters
+                preview TEXT,
+                char_count INTEGER,
+                chapter_count INTEGER,
+                scaffolding_data TEXT,  -- AI processed data as JSON (may be a codec BLOB)
                 reading_mode TEXT DEFAULT 'flow', -- flow | learn
                 scaffold_level INTEGER DEFAULT 2,   -- 1, 2, 3
                 vocab_level TEXT DEFAULT 'B1',      -- A1-C2
                 current_paragraph_id INTEGER,       -- ID of last active paragraph
+                importing INTEGER DEFAULT 0,        -- 1 while an import is still writing its chapters
                 created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
                 FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
@@ -89,6 +158,20 @@ def init_database():
         except sqlite3.OperationalError:
             pass
 
+        # Migration: content moves to chapters; texts keeps metadata only
+        # (chapter_count stays NULL until a legacy text has been migrated)
+        for column in ('preview TEXT', 'char_count INTEGER', 'chapter_count INTEGER'):
+            try:
+                cursor.execute(f'ALTER TABLE texts ADD COLUMN {column}')
+            except sqlite3.OperationalError:
+                pass
+
+        # Migration: imports commit chapter by chapter; the text stays hidden until done
+        try:
+            cursor.execute('ALTER TABLE texts ADD COLUMN importing INTEGER DEFAULT 0')
+        except sqlite3.OperationalError:
+            pass
+
         # Migration: Add credits column to users if it doesn't exist
         try:
             cursor.execute('ALTER TABLE users ADD COLUMN credits INTEGER DEFAULT 100')
@@ -97,20 +180,55 @@ def init_database():
         except sqlite3.OperationalError:
             pass
 
+        # Chapters table: contiguous slices of a text's content
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chapters (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                text_id INTEGER NOT NULL,
+                chapter_index INTEGER NOT NULL,
+                title TEXT,
+                content TEXT NOT NULL,  -- may be a codec BLOB, see app/codec.py
+                char_count INTEGER NOT NULL,
+                sentence_start INTEGER NOT NULL, -- sentence_index of its first sentence
+                sentence_count INTEGER NOT NULL,
+                FOREIGN KEY (text_id) REFERENCES texts (id) ON DELETE CASCADE
+            )
+        ''')
+
         # Sentences table (Replaced Paragraphs table)
-        # Flat model: Text -> Sentences
+        # Model: Text -> Chapters -> Sentences (sentence_index is global within the text)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sentences (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 text_id INTEGER NOT NULL,
+                chapter_id INTEGER,
                 sentence_index INTEGER NOT NULL, -- Global order in text
                 content TEXT NOT NULL,
                 translation TEXT,
-                analysis_json TEXT, -- Stores keywords, insights as JSON
+                analysis_json TEXT, -- Stores keywords, insights as JSON (may be a codec BLOB)
+                vocab_json TEXT,    -- Lexicon vocabulary candidates [{word, lemma, diff, zipf}]
+                vocab_max INTEGER,  -- Hardest candidate level (1-6), 0 if none
                 FOREIGN KEY (text_id) REFERENCES texts (id) ON DELETE CASCADE
             )
         ''')
         
+        # Migration: sentences belong to a chapter
+        try:
+            cursor.execute('ALTER TABLE sentences ADD COLUMN chapter_id INTEGER')
+        except sqlite3.OperationalError:
+            pass
+
+        # Migration: CEFR vocabulary candidates from the offline lexicon
+        try:
+            cursor.execute('ALTER TABLE sentences ADD COLUMN vocab_json TEXT')
+        except sqlite3.OperationalError:
+            pass
+
+        try:
+            cursor.execute('ALTER TABLE sentences ADD COLUMN vocab_max INTEGER')
+        except sqlite3.OperationalError:
+            pass
+
         # Create index for faster user lookups
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_texts_user_id ON texts (user_id)
@@ -118,9 +236,58 @@ def init_database():
         cursor.execute('''
             CREATE INDEX IF NOT EXISTS idx_sentences_text_id ON sentences (text_id)
         ''')
-        
+        # Ordered range scans (reading position lookahead)
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sentences_text_order ON sentences (text_id, sentence_index)
+        ''')
+
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_chapters_text_order ON chapters (text_id, chapter_index)
+        ''')
+        cursor.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sentences_chapter ON sentences (chapter_id, sentence_index)
+        ''')
+
+        # Compression dictionaries for app/codec.py (kept forever: rows reference them by id)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS codec_dicts (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                trained_on INTEGER,  -- stored analyses when it was trained (retrain as they grow)
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        try:
+            cursor.execute('ALTER TABLE codec_dicts ADD COLUMN trained_on INTEGER')
+        except sqlite3.OperationalError:
+            pass
+
+        # Translation memory: MinHash signatures and LSH band postings per sentence
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tm_signatures (
+                sentence_id INTEGER PRIMARY KEY,
+                signature BLOB NOT NULL,
+                FOREIGN KEY (sentence_id) REFERENCES sentences (id) ON DELETE CASCADE
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS tm_bands (
+                band_key INTEGER NOT NULL,
+                sentence_id INTEGER NOT NULL,
+                PRIMARY KEY (band_key, sentence_id)
+            ) WITHOUT ROWID
+        ''')
+        # No foreign key on tm_bands.sentence_id, on purpose: an ON DELETE CASCADE
+        # would look up the postings of every deleted sentence, which needs a second
+        # (sentence_id) index on the largest TM table, written on every insert, while
+        # lookups only ever go by band_key. Orphaned postings are harmless, since
+        # lookups join tm_signatures (which does cascade), and maintenance.sweep_bands
+        # deletes them a slice at a time.
+
         print(f"✅ Database initialized successfully: {DATABASE_PATH}")
 
 # Initialize on import
-if not os.path.exists(DATABASE_PATH):
+if SQLITE_STORAGE and not os.path.exists(DATABASE_PATH):
     init_database()
@@ -0,0 +1,196 @@
+"""
+Logging pipeline.
+The root logger has a single handler that puts records on a bounded queue; a
+listener thread formats and writes them to the console and server_debug.log,
+so formatting and disk writes stay off the event loop. On the way in,
+records below WARNING are sampled per category (logger name prefix, e.g.
+LOG_SAMPLING="app.services.ai.payload=0.1"), and every record is stamped with
+the id of the request that logged it. On the way out, messages longer than
+max_message_chars are cut, keeping their length and a hash of the full text.
+If the queue is full, records are dropped rather than waited on.
+"""
+
+import atexit
+import contextvars
+import copy
+import hashlib
+import json
+import logging
+import queue
+import random
+import re
+import uuid
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from app import metrics
+from app.config import LOGGING_CONFIG
+
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+_valid_request_id = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+_listener: Optional[QueueListener] = None
+
+# Attributes every LogRecord has; anything else came in through extra=
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id"}
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+def parse_sampling(spec: str) -> Dict[str, float]:
+    """"app.services.ai.payload=0.1,app.routers.texts=0.5" -> {prefix: rate}"""
+    rates = {}
+    for part in spec.split(","):
+        if "=" in part:
+            name, rate = part.split("=", 1)
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+class _Sampler(logging.Filter):
+    """Keeps a fraction of records below WARNING per logger name prefix (longest prefix wins)"""
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._by_logger: Dict[str, float] = {}
+
+    def rate(self, name: str) -> float:
+        rate = self._by_logger.get(name)
+        if rate is None:
+            matches = [p for p in self.rates if name == p or name.startswith(p + ".")]
+            rate = self.rates[max(matches, key=len)] if matches else 1.0
+            self._by_logger[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge the arguments here; formatting happens on the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOG_DROPPED.inc()
+
+
+class _TruncatingListener(QueueListener):
+    """Writes queued records on its own thread, cutting long messages once for every handler"""
+
+    def __init__(self, records: queue.Queue, *handlers, max_chars: int):
+        super().__init__(records, *handlers, respect_handler_level=True)
+        self.max_chars = max_chars
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        message = record.getMessage()
+        if len(message) > self.max_chars:
+            digest = hashlib.sha1(message.encode("utf-8", "replace")).hexdigest()[:12]
+            record.msg = f"{message[:self.max_chars]}… [{len(message)} chars, sha1 {digest}]"
+            record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; extra= fields are included as keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s"
+
+
+def setup_logging():
+    """Route the root logger through the queue; safe to call more than once"""
+    global _listener
+    if _listener is not None:
+        return
+    handlers = [logging.StreamHandler()]
+    handlers[0].setFormatter(logging.Formatter(TEXT_FORMAT, defaults={"request_id": "-"}))
+    if LOGGING_CONFIG["file"]:
+        file_handler = logging.FileHandler(LOGGING_CONFIG["file"], encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter() if LOGGING_CONFIG["file_format"] == "json"
+                                  else logging.Formatter(TEXT_FORMAT, defaults={"request_id": "-"}))
+        handlers.append(file_handler)
+
+    records = queue.Queue(LOGGING_CONFIG["queue_size"])
+    queue_handler = _NonBlockingQueueHandler(records)
+    queue_handler.addFilter(_Sampler(parse_sampling(LOGGING_CONFIG["sampling"])))
+    queue_handler.addFilter(_RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOGGING_CONFIG["level"])
+
+    _listener = _TruncatingListener(records, *handlers, max_chars=LOGGING_CONFIG["max_message_chars"])
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out what is still queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class RequestIdMiddleware:
+    """ASGI middleware: takes X-Request-ID from the client (or makes one) and echoes it back"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        request_id = dict(scope["headers"]).get(b"x-request-id", b"").decode("latin-1")
+        if not _valid_request_id.match(request_id):
+            request_id = uuid.uuid4().hex[:16]
+        token = _request_id.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", request_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            _request_id.reset(token)
@@ -1,23 +1,30 @@
 from fastapi import FastAPI
+from starlette.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from app.database import init_database
+from app.codec import start_background_migration
 from app.services.nlp import init_spacy
-from app.routers import auth, texts, sentences, ai, tts, pdf
+from app.services.chapters import discard_interrupted_imports, migrate_legacy_texts
+from app.services.maintenance import start_background_maintenance
+from app.services.audiobook import start_segment_sweeper
+from app.metrics import MetricsMiddleware, start_loop_lag_monitor
+from app.logs import RequestIdMiddleware, setup_logging
+from app.profiling import ProfilingMiddleware
+from app.storage import get_storage
+from app.services import frontend as frontend_files
+from app.config import METRICS_CONFIG, PROFILING_CONFIG, FRONTEND_CONFIG, SQLITE_STORAGE
+from app.routers import auth, texts, sentences, ai, tts, audio, pdf, metrics, profiling, frontend
 import logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("server_debug.log"),
-        logging.StreamHandler()
-    ]
-)
+# Configure logging (queued, written by a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Initialize
-init_database()
+# Initialize (the postgres backend creates its schema on startup)
+if SQLITE_STORAGE:
+    init_database()
+    discard_interrupted_imports()
+    migrate_legacy_texts()
 init_spacy()
 
 app = FastAPI(title="AI Reading Co-pilot API")
@@ -29,7 +36,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Stream-Id", "X-Request-ID"],
 )
+if PROFILING_CONFIG["enabled"]:
+    app.add_middleware(ProfilingMiddleware, router_app=app)
+if METRICS_CONFIG["enabled"]:
+    app.add_middleware(MetricsMiddleware)
+app.add_middleware(RequestIdMiddleware)
 
 # Routes
 app.include_router(auth.router)
@@ -37,8 +50,46 @@ app.include_router(texts.router)
 app.include_router(sentences.router)
 app.include_router(ai.router)
 app.include_router(tts.router)
+app.include_router(audio.router)
 app.include_router(pdf.router)
+app.include_router(metrics.router)
+app.include_router(profiling.router)
+
+@app.on_event("startup")
+async def open_storage():
+    await get_storage().open()
+
+@app.on_event("shutdown")
+async def close_storage():
+    await get_storage().close()
+
+@app.on_event("startup")
+async def compress_old_rows():
+    start_background_migration()
+
+@app.on_event("startup")
+async def maintain_database():
+    start_background_maintenance()
 
-@app.get("/")
+@app.on_event("startup")
+async def sweep_audio_segments():
+    start_segment_sweeper()
+
+@app.on_event("startup")
+async def watch_event_loop():
+    start_loop_lag_monitor()
+
+@app.on_event("startup")
+async def load_frontend():
+    if FRONTEND_CONFIG["enabled"]:
+        await run_in_threadpool(frontend_files.load)
+
+@app.get("/health")
 async def health_check():
     return {"status": "ok", "service": "AI Reading Co-pilot API"}
+
+if FRONTEND_CONFIG["enabled"]:
+    # Catch-all for the React app: must come after every API route
+    app.include_router(frontend.router)
+else:
+    app.add_api_route("/", health_check, methods=["GET"])
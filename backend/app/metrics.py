@@ -0,0 +1,239 @@
+"""
+Prometheus metrics, rendered in the text exposition format at GET /metrics.
+
+A small registry instead of prometheus_client: counters, gauges and
+histograms with labels, safe to update from the threadpool. What is measured:
+
+    http_request_duration_seconds   per route template, method and status (SSE: until the stream ends)
+    db_query_duration_seconds       every SQLite execute/executemany, request vs background
+    db_queries_per_request          statements per request, per route
+    db_time_per_request_seconds     SQLite time per request (execute plus fetch), per route
+    ai_ttft_seconds                 upstream time to first streamed chunk, per provider
+    ai_duration_seconds             upstream call/stream duration, per provider, mode and outcome
+    ai_stream_chunk_rate            chunks per second after the first, per provider
+    tts_synthesis_seconds           edge-tts synthesis per request
+    credits_deducted_total          credits charged, per reason
+    event_loop_lag_seconds          how late a periodic timer fires on the event loop
+"""
+
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+from app.config import METRICS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+INF = 'le="+Inf"'
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> Tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def _label_text(self, key: Tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines += self._samples()
+        return "\n".join(lines)
+
+    def _samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{self._label_text(k)} {_number(v)}" for k, v in sorted(self._values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple, list] = {}  # key -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    def _samples(self):
+        lines = []
+        for key, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{self._label_text(key, le)} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._label_text(key, INF)} {series[-1]}")
+            lines.append(f"{self.name}_sum{self._label_text(key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{self._label_text(key)} {series[-1]}")
+        return lines
+
+
+HTTP_DURATION = Histogram("http_request_duration_seconds", "HTTP request latency by route template",
+                          ("method", "route", "status"))
+DB_QUERY = Histogram("db_query_duration_seconds", "SQLite execute/executemany time",
+                     ("context",), QUERY_BUCKETS)
+DB_QUERIES_PER_REQUEST = Histogram("db_queries_per_request", "SQLite statements per request",
+                                   ("route",), COUNT_BUCKETS)
+DB_TIME_PER_REQUEST = Histogram("db_time_per_request_seconds", "SQLite time per request",
+                                ("route",), LATENCY_BUCKETS)
+AI_TTFT = Histogram("ai_ttft_seconds", "Upstream time to first streamed chunk", ("provider",))
+AI_DURATION = Histogram("ai_duration_seconds", "Upstream call or stream duration",
+                        ("provider", "mode", "outcome"))
+AI_CHUNK_RATE = Histogram("ai_stream_chunk_rate", "Streamed chunks per second after the first",
+                          ("provider",), RATE_BUCKETS)
+AI_CHUNKS = Counter("ai_stream_chunks_total", "Streamed chunks received", ("provider",))
+TTS_SYNTHESIS = Histogram("tts_synthesis_seconds", "edge-tts synthesis time per request", ("outcome",))
+TTS_BYTES = Counter("tts_audio_bytes_total", "Audio bytes synthesized")
+AUDIOBOOK_SEGMENTS = Counter("audiobook_segments_total", "Audiobook sentence segments by outcome", ("outcome",))
+CREDITS = Counter("credits_deducted_total", "Credits charged to users", ("reason",))
+LOOP_LAG = Histogram("event_loop_lag_seconds", "Delay of a periodic event loop timer", (), LAG_BUCKETS)
+LOOP_LAG_LAST = Gauge("event_loop_lag_last_seconds", "Most recent event loop lag sample")
+LOG_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _registry) + "\n"
+
+
+# ---- SQLite, per request ----
+
+class _DbUsage:
+    __slots__ = ("queries", "seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# Set by the middleware; threadpool calls run in a copy of the request's
+# context, so queries made there land on the same object
+_request_db: contextvars.ContextVar[Optional[_DbUsage]] = contextvars.ContextVar("request_db", default=None)
+
+
+def observe_query(seconds: float, statement: bool = True):
+    """Called by the database layer; statement=False is fetch time, counted per request only"""
+    usage = _request_db.get()
+    if usage is not None:
+        usage.seconds += seconds
+        usage.queries += statement
+    if statement:
+        DB_QUERY.observe(seconds, context="request" if usage is not None else "background")
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request by route template, until the last body chunk"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+        usage = _DbUsage()
+        token = _request_db.set(usage)
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_db.reset(token)
+            # The template, not the path, so ids do not multiply the series
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_DURATION.observe(time.perf_counter() - started, method=scope["method"], route=route,
+                                  status=status)
+            DB_QUERIES_PER_REQUEST.observe(usage.queries, route=route)
+            DB_TIME_PER_REQUEST.observe(usage.seconds, route=route)
+
+
+# ---- Event loop lag ----
+
+_lag_task: Optional[asyncio.Task] = None
+
+
+async def _watch_loop_lag():
+    interval = METRICS_CONFIG["loop_lag_interval"]
+    while True:
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.monotonic() - started - interval)
+        LOOP_LAG.observe(lag)
+        LOOP_LAG_LAST.set(lag)
+
+
+def start_loop_lag_monitor():
+    global _lag_task
+    if METRICS_CONFIG["enabled"] and (_lag_task is None or _lag_task.done()):
+        _lag_task = asyncio.get_running_loop().create_task(_watch_loop_lag())
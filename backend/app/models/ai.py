@@ -1,11 +1,13 @@
 from typing import Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class AIChatRequest(BaseModel):
     system_prompt: str
     user_query: str
     provider: str = "aliyun"  # 'aliyun' or 'google'
     api_key: Optional[str] = None
+    text_id: Optional[int] = None      # attach retrieved passages from this text
+    context_k: Optional[int] = Field(None, ge=1, le=50)  # number of passages (default from RETRIEVAL_CONFIG)
 
 class TTSRequest(BaseModel):
     text: str
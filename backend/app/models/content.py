@@ -21,6 +21,9 @@ class TextResponse(BaseModel):
     scaffold_level: int = 2
     vocab_level: str = "B1"
     current_paragraph_id: Optional[int] = None
+    chapter_count: int = 1
+    char_count: int = 0
+    current_chapter: Optional[int] = None  # chapter_index holding current_paragraph_id
     created_at: str
     updated_at: str
 
@@ -30,6 +33,17 @@ class TextProgressUpdate(BaseModel):
     vocab_level: Optional[str] = None
     current_paragraph_id: Optional[int] = None
 
+# Chapters
+class ChapterInfo(BaseModel):
+    index: int
+    title: Optional[str]
+    char_count: int
+    sentence_start: int
+    sentence_count: int
+
+class ChapterResponse(ChapterInfo):
+    content: str
+
 # Sentences
 class SentenceResponse(BaseModel):
     id: int
@@ -42,3 +56,42 @@ class SentenceResponse(BaseModel):
 class SentenceUpdate(BaseModel):
     translation: Optional[str] = None
     analysis: Optional[dict] = None
+
+class SentenceBulkItem(BaseModel):
+    id: int
+    translation: Optional[str] = None
+    analysis: Optional[dict] = None
+
+class SentenceBulkUpdate(BaseModel):
+    items: List[SentenceBulkItem]
+
+class SentenceBulkItemResult(BaseModel):
+    id: int
+    status: str  # updated | not_found | skipped
+
+class SentenceBulkResponse(BaseModel):
+    text_id: int
+    updated: int
+    results: List[SentenceBulkItemResult]
+
+class SentenceAnalyzeRequest(BaseModel):
+    sentence_ids: List[int]
+    provider: str = "aliyun"
+    api_key: Optional[str] = None
+    force: bool = False  # re-analyze sentences that already have analysis
+
+class SentenceSearchHit(BaseModel):
+    id: int
+    sentence_index: int
+    content: str
+    score: float
+
+class AudioRenderStatus(BaseModel):
+    text_id: int
+    voice: str
+    state: str  # rendering | complete | partial (stopped with sentences left; POST again to resume)
+    total: int
+    rendered: int
+    failed: int
+    duration: float  # seconds of audio rendered so far
+    playlist_url: str
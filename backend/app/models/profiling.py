@@ -0,0 +1,11 @@
+from typing import Literal, Optional
+from pydantic import BaseModel, Field
+
+class ProfileRule(BaseModel):
+    route: str                            # route template, e.g. "/texts/{text_id}/sentences"
+    rate: float = Field(ge=0, le=1)       # fraction of requests to profile; 0 removes the rule
+    mode: Literal["sample", "cprofile"] = "sample"
+    limit: Optional[int] = Field(None, ge=1)  # remove the rule after this many profiles
+
+class ProfileArm(BaseModel):
+    mode: Literal["sample", "cprofile"] = "sample"
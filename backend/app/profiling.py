@@ -0,0 +1,261 @@
+"""
+On-demand request profiling.
+An admin either sets a sample rate for a route template (PUT
+/admin/profiling/routes) or arms a one-time token and sends it in the
+X-Profile header of the request to look at. That request then runs under a
+stack sampler (folded stacks of every thread, ready for flamegraph.pl or
+speedscope) or cProfile (event loop thread only, so threadpool work shows up
+as time waiting), with every SQLite statement and its time recorded. Both
+profilers see the whole process, so one request is profiled at a time. Reports are kept
+in a bounded ring and read back through /admin/profiling/reports.
+
+With no rule and no armed token the middleware is a single check, and the
+SQL hook is one context variable lookup per statement.
+"""
+
+import cProfile
+import contextvars
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Dict, Optional
+
+from app.config import PROFILING_CONFIG
+
+MODES = ("sample", "cprofile")
+HEADER = b"x-profile"
+# A thread whose innermost Python frame is in one of these is waiting, not working
+IDLE_FILES = {"selectors.py", "threading.py", "queue.py"}
+
+_rules: Dict[str, dict] = {}     # route template -> {"rate", "mode", "remaining"}
+_tokens: Dict[str, dict] = {}    # armed token -> {"mode", "expires"}
+_reports = deque(maxlen=PROFILING_CONFIG["ring_size"])
+_ids = itertools.count(1)
+_busy = threading.Lock()         # one profile at a time: both profilers are process-wide
+_sql: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("profile_sql", default=None)
+
+
+# ---- Control (admin endpoints) ----
+
+def set_rule(route: str, rate: float, mode: str = "sample", limit: Optional[int] = None):
+    """Profile a fraction of requests to a route template; rate 0 removes the rule"""
+    if rate <= 0:
+        _rules.pop(route, None)
+    else:
+        _rules[route] = {"rate": min(rate, 1.0), "mode": mode, "remaining": limit}
+
+
+def arm(mode: str = "sample") -> str:
+    """One-time token for the X-Profile header"""
+    now = time.time()
+    for token, armed in list(_tokens.items()):
+        if armed["expires"] < now:
+            _tokens.pop(token, None)
+    token = secrets.token_urlsafe(16)
+    _tokens[token] = {"mode": mode, "expires": now + PROFILING_CONFIG["arm_ttl"]}
+    return token
+
+
+def status() -> dict:
+    return {
+        "rules": dict(_rules),
+        "armed": len(_tokens),
+        "reports": [{k: r[k] for k in ("id", "method", "route", "path", "status", "mode", "duration_ms",
+                                        "sql_count", "sql_ms", "started_at")} for r in reversed(_reports)],
+    }
+
+
+def get_report(report_id: int) -> Optional[dict]:
+    return next((r for r in _reports if r["id"] == report_id), None)
+
+
+def clear_reports():
+    _reports.clear()
+
+
+# ---- SQL hook (called by the database layer) ----
+
+def observe_query(statement: Optional[str], seconds: float):
+    """statement=None is fetch time, added to the previous statement"""
+    statements = _sql.get()
+    if statements is None:
+        return
+    if statement is None:
+        if statements:
+            statements[-1][1] += seconds
+    elif len(statements) < PROFILING_CONFIG["max_sql"]:
+        statements.append([" ".join(statement.split())[:500], seconds])
+    else:
+        statements.append(None)  # counted, not kept
+
+
+def _sql_report(statements: list) -> dict:
+    kept = [s for s in statements if s is not None]
+    by_statement = {}
+    for text, seconds in kept:
+        entry = by_statement.setdefault(text, {"sql": text, "count": 0, "ms": 0.0})
+        entry["count"] += 1
+        entry["ms"] += seconds * 1000
+    top = sorted(by_statement.values(), key=lambda e: -e["ms"])[:50]
+    return {
+        "sql_count": len(statements),
+        "sql_ms": round(sum(s for _, s in kept) * 1000, 2),
+        "sql": [{"sql": text, "ms": round(seconds * 1000, 3)} for text, seconds in kept],
+        "sql_top": [{**e, "ms": round(e["ms"], 3)} for e in top],
+    }
+
+
+# ---- Profilers ----
+
+class StackSampler:
+    """Samples every thread's Python stack on an interval into folded-stack counts"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        limit = PROFILING_CONFIG["max_stacks"]
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == me or os.path.basename(frame.f_code.co_filename) in IDLE_FILES:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{getattr(code, 'co_qualname', code.co_name)} "
+                                 f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                if ident not in names:
+                    names = {t.ident: t.name for t in threading.enumerate()}
+                key = ";".join([names.get(ident, str(ident))] + stack[::-1])
+                if key in self.stacks or len(self.stacks) < limit:
+                    self.stacks[key] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> dict:
+        self._stop.set()
+        self._thread.join()
+        return {
+            "samples": self.samples,
+            "interval_ms": self.interval * 1000,
+            "folded": "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()),
+        }
+
+
+class _CProfile:
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self) -> dict:
+        self.profile.disable()
+        out = io.StringIO()
+        pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(60)
+        self.profile.create_stats()
+        return {"pstats": out.getvalue(), "pstats_dump": marshal.dumps(self.profile.stats)}
+
+
+# ---- Middleware ----
+
+def _route_of(app, scope) -> Optional[str]:
+    from starlette.routing import Match
+    for route in getattr(app, "routes", []):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return None
+
+
+def _choose(app, scope) -> Optional[tuple]:
+    """(mode, route, reason) if this request should be profiled"""
+    if _tokens:
+        header = dict(scope["headers"]).get(HEADER)
+        armed = _tokens.pop(header.decode("latin-1"), None) if header else None
+        if armed and armed["expires"] >= time.time():
+            return armed["mode"], _route_of(app, scope), "header"
+    if _rules:
+        route = _route_of(app, scope)
+        rule = _rules.get(route)
+        if rule and random.random() < rule["rate"]:
+            if rule["remaining"] is not None:
+                rule["remaining"] -= 1
+                if rule["remaining"] <= 0:
+                    _rules.pop(route, None)
+            return rule["mode"], route, "sampled"
+    return None
+
+
+class ProfilingMiddleware:
+    """ASGI middleware; router_app is the FastAPI instance whose route templates rules refer to"""
+
+    def __init__(self, app, router_app):
+        self.app = app
+        self.router_app = router_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (_rules or _tokens) or not _busy.acquire(blocking=False):
+            return await self.app(scope, receive, send)
+        # Chosen while holding _busy, so an armed token or sampling budget is only spent on a profile
+        try:
+            chosen = _choose(self.router_app, scope)
+        except BaseException:
+            _busy.release()
+            raise
+        if chosen is None:
+            _busy.release()
+            return await self.app(scope, receive, send)
+        mode, route, reason = chosen
+        profiler = _CProfile() if mode == "cprofile" else StackSampler(PROFILING_CONFIG["sample_interval"])
+        statements = []
+        token = _sql.set(statements)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started_at = time.time()
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            result = profiler.stop()
+            duration = time.perf_counter() - started
+            _sql.reset(token)
+            _busy.release()
+            _reports.append({
+                "id": next(_ids),
+                "method": scope["method"],
+                "route": route or "unmatched",
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status,
+                "mode": mode,
+                "reason": reason,
+                "started_at": started_at,
+                "duration_ms": round(duration * 1000, 2),
+                **_sql_report(statements),
+                **result,
+            })
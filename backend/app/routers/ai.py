@@ -1,101 +1,170 @@
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header
 from sse_starlette.sse import EventSourceResponse
-from app.config import AI_CONFIG
 from app.models.ai import AIChatRequest
-from app.services.ai import call_aliyun, call_google, stream_aliyun, stream_google
-from app.routers.auth import get_current_user
-from app.database import get_db
+from app.services.ai_router import plan_providers, routed_call, routed_stream, get_provider_stats
+from app.services.admission import AdmissionRejected, check_rate, get_gate, admission_stats
+from app.services.streams import StreamGone, start_stream, get_stream
+from app.services.retrieval import retrieve_context
+from app.config import RETRIEVAL_CONFIG
+from app.routers.auth import get_admin_user, get_current_user
+from app.storage import InsufficientCredits, get_storage
+from app import metrics
 import logging
 
 router = APIRouter(prefix="/ai", tags=["AI"])
 logger = logging.getLogger(__name__)
 
-def check_and_deduct_credits(user_id: int) -> int:
-    """Check if user has credits and deduct 1. Returns remaining credits."""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT credits FROM users WHERE id = ?", (user_id,))
-        result = cursor.fetchone()
-        if not result:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        credits = result["credits"] or 0
-        if credits <= 0:
-            raise HTTPException(
-                status_code=402, 
-                detail="Insufficient credits. Please recharge to continue using AI features."
-            )
-        
-        new_credits = credits - 1
-        cursor.execute(
-            "UPDATE users SET credits = ? WHERE id = ?",
-            (new_credits, user_id)
+async def check_and_deduct_credits(user_id: int, amount: int = 1, reason: str = "chat") -> int:
+    """Check if user has enough credits and deduct amount (default 1). Returns remaining credits."""
+    try:
+        new_credits = await get_storage().deduct_credits(user_id, amount)
+    except InsufficientCredits:
+        raise HTTPException(
+            status_code=402, 
+            detail="Insufficient credits. Please recharge to continue using AI features."
         )
-        return new_credits
+    if new_credits is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    metrics.CREDITS.inc(amount, reason=reason)
+    return new_credits
+
+def resolve_provider_plan(request: AIChatRequest):
+    """Providers to try for this request, requested provider first"""
+    try:
+        plan = plan_providers(request.provider, request.api_key)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not plan:
+        raise HTTPException(status_code=400, detail=f"{request.provider} API key is not configured")
+    return plan
+
+async def build_system_prompt(request: AIChatRequest, user_id: int) -> str:
+    """Append the most relevant passages of request.text_id (if any) to the system prompt"""
+    if request.text_id is None:
+        return request.system_prompt
+    if not await get_storage().owns_text(request.text_id, user_id):
+        raise HTTPException(status_code=404, detail="Text not found")
+    k = request.context_k or RETRIEVAL_CONFIG["default_k"]
+    hits = await retrieve_context(request.text_id, request.user_query, k)
+    if not hits:
+        return request.system_prompt
+    passages = "\n".join(f"- {h['content']}" for h in hits)
+    return f"{request.system_prompt}\n\nRelevant passages from the book:\n{passages}"
+
+def rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def admit(user_id: int, plan):
+    """Apply the user's rate limit and wait (bounded) for an upstream slot on the first provider"""
+    try:
+        check_rate(user_id)
+        return await get_gate(plan[0][0]).acquire(user_id)
+    except AdmissionRejected as e:
+        logger.info(f"User {user_id} rejected by admission control: {e}")
+        raise rejected(e)
+
+def stream_response(session, after: int) -> EventSourceResponse:
+    async def generate():
+        try:
+            async for event_id, data in session.follow(after):
+                yield {"id": str(event_id), "data": data}
+        except StreamGone as e:
+            yield {"data": f"[ERROR]{str(e)}"}
+
+    return EventSourceResponse(generate(), headers={"X-Stream-Id": session.id})
 
 @router.post("/chat")
 async def ai_chat(request: AIChatRequest, user = Depends(get_current_user)):
     """Proxy AI requests (non-streaming)"""
     logger.info(f"AI Chat Proxy: {request.provider}")
     
+    plan = resolve_provider_plan(request)
+    system_prompt = await build_system_prompt(request, user["id"])
+    slot = await admit(user["id"], plan)
+
     # Check and deduct credits
-    remaining_credits = check_and_deduct_credits(user["id"])
+    try:
+        remaining_credits = await check_and_deduct_credits(user["id"])
+    except HTTPException:
+        slot.release()
+        raise
     logger.info(f"User {user['id']} used 1 credit, remaining: {remaining_credits}")
-    
-    provider = request.provider
-    api_key = request.api_key or AI_CONFIG.get(provider, {}).get("api_key", "")
-    
-    if not api_key:
-        raise HTTPException(status_code=400, detail=f"{provider} API key is not configured")
-    
+
     try:
-        if provider == "aliyun":
-            result = await call_aliyun(api_key, request.system_prompt, request.user_query)
-        elif provider == "google":
-            result = await call_google(api_key, request.system_prompt, request.user_query)
-        else:
-            raise HTTPException(status_code=400, detail=f"Unknown provider: {provider}")
-        
+        served_by, result = await routed_call(
+            plan, system_prompt, request.user_query,
+            user_id=user["id"], primary_slot=slot
+        )
+
         # Add remaining credits to response
         if isinstance(result, dict):
             result["_remaining_credits"] = remaining_credits
+            result["_provider"] = served_by
         return result
+    except AdmissionRejected as e:
+        raise rejected(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/chat/stream")
 async def ai_chat_stream(request: AIChatRequest, user = Depends(get_current_user)):
     """Streaming AI chat"""
+    plan = resolve_provider_plan(request)
+    system_prompt = await build_system_prompt(request, user["id"])
+    slot = await admit(user["id"], plan)
+
     # Check and deduct credits
-    remaining_credits = check_and_deduct_credits(user["id"])
+    try:
+        remaining_credits = await check_and_deduct_credits(user["id"], reason="chat_stream")
+    except HTTPException:
+        slot.release()
+        raise
     logger.info(f"User {user['id']} used 1 credit for stream, remaining: {remaining_credits}")
-    
-    provider = request.provider
-    api_key = request.api_key or AI_CONFIG.get(provider, {}).get("api_key", "")
-    
-    if not api_key:
-        raise HTTPException(status_code=400, detail=f"{provider} API key is not configured")
-    
-    async def generate():
-        try:
-            if provider == "aliyun":
-                async for chunk in stream_aliyun(api_key, request.system_prompt, request.user_query):
-                    yield {"data": chunk}
-            elif provider == "google":
-                async for chunk in stream_google(api_key, request.system_prompt, request.user_query):
-                    yield {"data": chunk}
-            yield {"data": "[DONE]"}
-        except Exception as e:
-            yield {"data": f"[ERROR]{str(e)}"}
-    
-    return EventSourceResponse(generate())
+
+    def produce():
+        return (
+            chunk async for _, chunk in routed_stream(
+                plan, system_prompt, request.user_query,
+                user_id=user["id"], primary_slot=slot
+            )
+        )
+
+    # Upstream runs in the background so a dropped client can resume
+    session = start_stream(user["id"], produce, on_finish=slot.release)
+    return stream_response(session, 0)
+
+@router.get("/chat/stream/{stream_id}")
+async def resume_chat_stream(
+    stream_id: str,
+    last_event_id: Optional[str] = Header(None),
+    user = Depends(get_current_user)
+):
+    """Resume a stream after a disconnect: replays events after Last-Event-ID, then follows live"""
+    session = get_stream(stream_id, user["id"])
+    if not session:
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    try:
+        after = int(last_event_id) if last_event_id else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
+    if not session.can_resume(after):
+        raise HTTPException(status_code=410, detail="Stream events are no longer buffered")
+    logger.info(f"User {user['id']} resuming stream {stream_id} after event {after}")
+    return stream_response(session, after)
 
 @router.get("/credits")
 async def get_credits(user = Depends(get_current_user)):
     """Get current user's credit balance"""
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT credits FROM users WHERE id = ?", (user["id"],))
-        result = cursor.fetchone()
-        return {"credits": result["credits"] if result else 0}
+    current = await get_storage().get_user(user["id"])
+    return {"credits": current["credits"] if current else 0}
+
+@router.get("/providers")
+async def get_providers(user = Depends(get_admin_user)):
+    """Rolling latency and error stats per AI provider"""
+    return get_provider_stats()
 
+@router.get("/admission")
+async def get_admission(user = Depends(get_admin_user)):
+    """Live upstream concurrency and queue depth per provider"""
+    return admission_stats()
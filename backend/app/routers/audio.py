@@ -0,0 +1,100 @@
+import hashlib
+import hmac
+import os
+import re
+import time
+from typing import Optional
+from urllib.parse import urlencode
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import FileResponse, Response
+from fastapi.security import HTTPAuthorizationCredentials
+from app.models.content import AudioRenderStatus
+from app.routers.auth import get_current_user, security
+from app.services.audiobook import AudioRender, RenderLimitReached, get_render, segment_path, start_render
+from app.storage import get_storage
+from app.config import AUDIOBOOK_CONFIG, SECRET_KEY, VOICES
+
+router = APIRouter(prefix="/texts", tags=["Audio"])
+
+_segment_re = re.compile(r"[0-9a-f]{40}\.mp3")
+
+def _signature(user_id: int, text_id: int, voice: str, expires: int) -> str:
+    message = f"audio:{user_id}:{text_id}:{voice}:{expires}".encode()
+    return hmac.new(SECRET_KEY.encode(), message, hashlib.sha256).hexdigest()
+
+def signed_query(user_id: int, text_id: int, voice: str) -> str:
+    """
+    Query string granting access to a text's playlist and segments until it
+    expires, for players (native HLS, <audio>) that can't send a Bearer token
+    """
+    expires = int(time.time()) + AUDIOBOOK_CONFIG["url_ttl"]
+    return urlencode({"voice": voice, "user": user_id, "expires": expires,
+                      "sig": _signature(user_id, text_id, voice, expires)})
+
+async def audio_user(
+    text_id: int,
+    voice: str = Query("narrator"),
+    user: Optional[int] = Query(None),
+    expires: Optional[int] = Query(None),
+    sig: Optional[str] = Query(None),
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> int:
+    """The caller's user id, from a signed URL or the Bearer token"""
+    if sig is None:
+        return (await get_current_user(credentials))["id"]
+    if user is None or expires is None or expires < time.time() \
+            or not hmac.compare_digest(sig, _signature(user, text_id, voice, expires)):
+        raise HTTPException(status_code=401, detail="Invalid or expired audio link")
+    return user
+
+async def check_audio_request(text_id: int, voice: str, user_id: int):
+    if voice not in VOICES:
+        raise HTTPException(status_code=400, detail=f"Unknown voice: {voice}")
+    if not await get_storage().owns_text(text_id, user_id):
+        raise HTTPException(status_code=404, detail="Text not found")
+
+def to_status(render: AudioRender, user_id: int) -> AudioRenderStatus:
+    return AudioRenderStatus(
+        **render.status(),
+        playlist_url=f"/texts/{render.text_id}/audio/playlist.m3u8?"
+                     f"{signed_query(user_id, render.text_id, render.voice)}"
+    )
+
+@router.post("/{text_id}/audio", response_model=AudioRenderStatus, status_code=202)
+async def render_text_audio(text_id: int, voice: str = Query("narrator"), user = Depends(get_current_user)):
+    """Start or resume rendering the whole text, one MP3 segment per sentence"""
+    await check_audio_request(text_id, voice, user["id"])
+    try:
+        render = await start_render(text_id, voice)
+    except RenderLimitReached as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "60"})
+    return to_status(render, user["id"])
+
+@router.get("/{text_id}/audio", response_model=AudioRenderStatus)
+async def get_text_audio(text_id: int, voice: str = Query("narrator"), user = Depends(get_current_user)):
+    """Render status; playlist_url is signed, so it plays without the Bearer token"""
+    await check_audio_request(text_id, voice, user["id"])
+    return to_status(await get_render(text_id, voice), user["id"])
+
+@router.get("/{text_id}/audio/playlist.m3u8")
+async def get_text_audio_playlist(text_id: int, voice: str = Query("narrator"), user_id: int = Depends(audio_user)):
+    """HLS playlist of the segments rendered so far; reload it while the render runs"""
+    await check_audio_request(text_id, voice, user_id)
+    render = await get_render(text_id, voice)
+    return Response(render.playlist("&" + signed_query(user_id, text_id, voice)),
+                    media_type="application/vnd.apple.mpegurl", headers={"Cache-Control": "no-cache"})
+
+@router.get("/{text_id}/audio/segments/{name}")
+async def get_text_audio_segment(text_id: int, name: str, voice: str = Query("narrator"),
+                                 user_id: int = Depends(audio_user)):
+    await check_audio_request(text_id, voice, user_id)
+    key = name[:-len(".mp3")]
+    # Segments are shared between texts: only serve the ones this text is made of
+    if not _segment_re.fullmatch(name) or key not in (await get_render(text_id, voice)).keys:
+        raise HTTPException(status_code=404, detail="Segment not found")
+    path = segment_path(key)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Segment not found")
+    # Named by content: a segment never changes
+    return FileResponse(path, media_type="audio/mpeg",
+                        headers={"Cache-Control": "private, max-age=31536000, immutable"})
@@ -1,8 +1,12 @@
 from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from app.database import get_db
+from app.config import ADMIN_EMAILS
+from app.storage import get_storage
 from app.models.auth import UserRegister, UserLogin, TokenResponse, UserResponse
-from app.services.auth import hash_password, verify_password, create_access_token, verify_token
+from app.services.auth import (
+    PasswordHashBusy, hash_password, verify_password, needs_rehash, verify_missing_user, run_kdf,
+    create_access_token, verify_token
+)
 import logging
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
@@ -17,65 +21,73 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     if not user_id:
         raise HTTPException(status_code=401, detail="Invalid or expired token")
     
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return dict(user)
+    user = await get_storage().get_user(user_id)
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return user
+
+async def get_admin_user(user = Depends(get_current_user)):
+    if user["email"].lower() not in ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+async def kdf(func, *args):
+    """Password hashing off the event loop; 503 when too many are queued"""
+    try:
+        return await run_kdf(func, *args)
+    except PasswordHashBusy as e:
+        logger.warning(f"Rejecting auth request: {e}")
+        raise HTTPException(status_code=503, detail="Too many sign-ins right now, try again shortly",
+                            headers={"Retry-After": "1"})
 
 @router.post("/register", response_model=TokenResponse)
 async def register(data: UserRegister):
     logger.info(f"Register attempt for email: {data.email}")
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM users WHERE email = ?", (data.email,))
-        if cursor.fetchone():
-            raise HTTPException(status_code=400, detail="Email already registered")
-        
-        password_hash = hash_password(data.password)
-        cursor.execute(
-            "INSERT INTO users (email, password_hash) VALUES (?, ?)",
-            (data.email, password_hash)
-        )
-        user_id = cursor.lastrowid
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = dict(cursor.fetchone())
-        
-        token = create_access_token(user_id)
-        return TokenResponse(
-            access_token=token,
-            user=UserResponse(
-                id=user["id"],
-                email=user["email"],
-                credits=user.get("credits", 100),
-                created_at=str(user["created_at"])
-            )
+    storage = get_storage()
+    if await storage.get_user_by_email(data.email):
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    password_hash = await kdf(hash_password, data.password)
+    user = await storage.create_user(data.email, password_hash)
+    if not user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    token = create_access_token(user["id"])
+    return TokenResponse(
+        access_token=token,
+        user=UserResponse(
+            id=user["id"],
+            email=user["email"],
+            credits=user.get("credits", 100),
+            created_at=str(user["created_at"])
         )
+    )
 
 @router.post("/login", response_model=TokenResponse)
 async def login(data: UserLogin):
     logger.info(f"Login attempt for email: {data.email}")
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM users WHERE email = ?", (data.email,))
-        user = cursor.fetchone()
-        
-        if not user or not verify_password(data.password, user["password_hash"]):
-            raise HTTPException(status_code=401, detail="Invalid email or password")
-        
-        user = dict(user)
-        token = create_access_token(user["id"])
-        return TokenResponse(
-            access_token=token,
-            user=UserResponse(
-                id=user["id"],
-                email=user["email"],
-                credits=user.get("credits", 100),
-                created_at=str(user["created_at"])
-            )
+    storage = get_storage()
+    user = await storage.get_user_by_email(data.email)
+    if not user:
+        await kdf(verify_missing_user, data.password)
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if not await kdf(verify_password, data.password, user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    if needs_rehash(user["password_hash"]):
+        # Legacy SHA-256 (or older scrypt cost): the password is known now, store it properly
+        await storage.set_password_hash(user["id"], await kdf(hash_password, data.password))
+        logger.info(f"Upgraded password hash for user {user['id']}")
+    
+    token = create_access_token(user["id"])
+    return TokenResponse(
+        access_token=token,
+        user=UserResponse(
+            id=user["id"],
+            email=user["email"],
+            credits=user.get("credits", 100),
+            created_at=str(user["created_at"])
         )
+    )
 
 @router.get("/me", response_model=UserResponse)
 async def get_me(user = Depends(get_current_user)):
@@ -90,18 +102,10 @@ async def get_me(user = Depends(get_current_user)):
 async def recharge_credits(user = Depends(get_current_user)):
     """Recharge user credits (mock implementation - adds 1000 credits)"""
     logger.info(f"Recharge credits for user {user['id']}")
-    with get_db() as conn:
-        cursor = conn.cursor()
-        new_credits = user.get("credits", 0) + 1000
-        cursor.execute(
-            "UPDATE users SET credits = ? WHERE id = ?",
-            (new_credits, user["id"])
-        )
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user["id"],))
-        updated_user = dict(cursor.fetchone())
-        return UserResponse(
-            id=updated_user["id"],
-            email=updated_user["email"],
-            credits=updated_user.get("credits", 100),
-            created_at=str(updated_user["created_at"])
-        )
+    updated_user = await get_storage().add_credits(user["id"], 1000)
+    return UserResponse(
+        id=updated_user["id"],
+        email=updated_user["email"],
+        credits=updated_user.get("credits", 100),
+        created_at=str(updated_user["created_at"])
+    )
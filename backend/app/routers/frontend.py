@@ -0,0 +1,170 @@
+import os
+import re
+from typing import Dict, Optional, Tuple
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from app.services.frontend import ENCODINGS, Asset, Variant, lookup
+from app.config import FRONTEND_CONFIG
+
+_range_re = re.compile(r"bytes=(\d*)-(\d*)")
+_ZEROCOPY = "http.response.zerocopysend"
+
+
+class FrontendRoute(APIRoute):
+    """
+    The catch-all doesn't match API paths at all, so e.g. GET /auth/login is
+    still a 405 and /texts/ still redirects to /texts instead of getting the app
+    """
+
+    def matches(self, scope):
+        path = scope.get("path", "")
+        if any(path == prefix or path.startswith(prefix + "/") for prefix in FRONTEND_CONFIG["api_prefixes"]):
+            return Match.NONE, {}
+        return super().matches(scope)
+
+
+# Included last: only paths no API route claimed end up here
+router = APIRouter(tags=["Frontend"], route_class=FrontendRoute)
+
+
+class AssetResponse(Response):
+    """
+    Sends bytes start..end of a file variant: from memory when it was kept
+    there, otherwise straight from disk (zero-copy when the server offers the
+    ASGI zerocopysend extension, pread chunks in the threadpool when not).
+    """
+
+    def __init__(self, variant: Optional[Variant], status_code: int, headers: Dict[str, str],
+                 start: int = 0, end: int = -1):
+        self.variant = variant  # None: headers only (HEAD, 304, 416)
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.background = None
+        self.body = b""
+        self.init_headers(headers)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        variant, start, count = self.variant, self.start, self.end - self.start + 1
+        if variant is None or count <= 0:
+            await send({"type": "http.response.body", "body": b""})
+        elif variant.data is not None:
+            await send({"type": "http.response.body", "body": variant.data[start:start + count]})
+        elif _ZEROCOPY in scope.get("extensions", {}):
+            with open(variant.path, "rb") as f:
+                await send({"type": _ZEROCOPY, "file": f, "offset": start, "count": count})
+        else:
+            fd = os.open(variant.path, os.O_RDONLY)
+            try:
+                chunk_bytes = FRONTEND_CONFIG["chunk_bytes"]
+                while count > 0:
+                    chunk = await run_in_threadpool(os.pread, fd, min(chunk_bytes, count), start)
+                    if not chunk:
+                        break  # file shrank under us; the client sees a short body
+                    start += len(chunk)
+                    count -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": count > 0})
+                if count > 0:
+                    await send({"type": "http.response.body", "body": b""})
+            finally:
+                os.close(fd)
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.strip().lower()] = q
+    return accepted
+
+
+def choose_variant(asset: Asset, header: str) -> Variant:
+    """The smallest encoding the client accepts (br before gzip), else identity"""
+    accepted = accepted_encodings(header)
+    for encoding in ENCODINGS.values():
+        if encoding in asset.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return asset.variants[encoding]
+    return asset.identity
+
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match uses the weak comparison"""
+    if header.strip() == "*":
+        return True
+    return any(re.sub(r"^W/", "", tag.strip()) == etag for tag in header.split(","))
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (start, end) inclusive for a single byte range; None to ignore the header
+    (malformed or several ranges: send the whole file); (-1, -1) when it
+    can't be satisfied
+    """
+    match = _range_re.fullmatch(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        suffix = int(last)
+        return (max(size - suffix, 0), size - 1) if suffix and size else (-1, -1)
+    start = int(first)
+    end = int(last) if last else size - 1
+    if end < start and last:
+        return None
+    if start >= size:
+        return (-1, -1)
+    return start, min(end, size - 1)
+
+
+@router.api_route("/{path:path}", methods=["GET", "HEAD"], include_in_schema=False)
+async def serve_frontend(path: str, request: Request):
+    asset = lookup(path)
+    if asset is None:
+        return Response(status_code=404)
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and if_range and if_range.strip() != asset.identity.etag:
+        range_header = None  # the client's partial copy is stale: send it all
+    # Ranges are served on the identity bytes, where offsets mean the same for everyone
+    variant = asset.identity if range_header else choose_variant(asset, request.headers.get("accept-encoding", ""))
+
+    headers = {
+        "Cache-Control": f"public, max-age={FRONTEND_CONFIG['immutable_max_age']}, immutable"
+                         if asset.immutable else "no-cache",
+        "ETag": variant.etag,
+        "Accept-Ranges": "bytes",
+    }
+    if len(asset.variants) > 1:
+        headers["Vary"] = "Accept-Encoding"
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag_matches(if_none_match, variant.etag):
+        return AssetResponse(None, 304, headers)
+
+    headers["Content-Type"] = asset.content_type
+    if variant.encoding:
+        headers["Content-Encoding"] = variant.encoding
+    start, end, status = 0, variant.size - 1, 200
+    if range_header:
+        byte_range = parse_range(range_header, variant.size)
+        if byte_range == (-1, -1):
+            headers["Content-Range"] = f"bytes */{variant.size}"
+            headers["Content-Length"] = "0"
+            return AssetResponse(None, 416, headers)
+        if byte_range:
+            start, end = byte_range
+            status = 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{variant.size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return AssetResponse(variant if request.method == "GET" else None, status, headers, start, end)
@@ -0,0 +1,18 @@
+import hmac
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import PlainTextResponse
+from app import metrics
+from app.config import METRICS_CONFIG
+
+router = APIRouter(tags=["Metrics"])
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    """Prometheus text exposition format"""
+    if not METRICS_CONFIG["enabled"]:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = METRICS_CONFIG["token"]
+    if token and not hmac.compare_digest(authorization or "", f"Bearer {token}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
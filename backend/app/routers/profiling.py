@@ -0,0 +1,67 @@
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import PlainTextResponse, Response
+from app import profiling
+from app.config import PROFILING_CONFIG
+from app.models.profiling import ProfileRule, ProfileArm
+from app.routers.auth import get_admin_user
+import logging
+
+router = APIRouter(prefix="/admin/profiling", tags=["Admin"])
+logger = logging.getLogger(__name__)
+
+def require_enabled():
+    if not PROFILING_CONFIG["enabled"]:
+        raise HTTPException(status_code=404, detail="Profiling is disabled")
+
+def find_report(report_id: int) -> dict:
+    report = profiling.get_report(report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Report not found (the ring keeps the latest "
+                                                    f"{PROFILING_CONFIG['ring_size']})")
+    return report
+
+@router.get("", dependencies=[Depends(require_enabled)])
+async def get_profiling_status(user = Depends(get_admin_user)):
+    """Active route rules, armed tokens and the reports in the ring"""
+    return profiling.status()
+
+@router.put("/routes", dependencies=[Depends(require_enabled)])
+async def set_profiling_rule(rule: ProfileRule, user = Depends(get_admin_user)):
+    """Profile a fraction of requests to a route template (rate 0 stops)"""
+    logger.info(f"Admin {user['id']} set profiling rule {rule.route} rate={rule.rate} mode={rule.mode}")
+    profiling.set_rule(rule.route, rule.rate, rule.mode, rule.limit)
+    return profiling.status()["rules"]
+
+@router.post("/arm", dependencies=[Depends(require_enabled)])
+async def arm_profiling(data: ProfileArm, user = Depends(get_admin_user)):
+    """One-time token: the next request carrying it in X-Profile is profiled"""
+    logger.info(f"Admin {user['id']} armed a {data.mode} profile")
+    return {"header": "X-Profile", "token": profiling.arm(data.mode),
+            "expires_in": PROFILING_CONFIG["arm_ttl"]}
+
+@router.get("/reports/{report_id}", dependencies=[Depends(require_enabled)])
+async def get_profiling_report(report_id: int, user = Depends(get_admin_user)):
+    """Report with SQL statements and timings; stacks via /folded, cProfile data via /pstats"""
+    return {k: v for k, v in find_report(report_id).items() if k not in ("folded", "pstats_dump")}
+
+@router.get("/reports/{report_id}/folded", response_class=PlainTextResponse,
+            dependencies=[Depends(require_enabled)])
+async def get_profiling_folded(report_id: int, user = Depends(get_admin_user)):
+    """Folded stacks (flamegraph.pl, speedscope, inferno) of a sampled report"""
+    report = find_report(report_id)
+    if "folded" not in report:
+        raise HTTPException(status_code=400, detail="Report was recorded with cProfile; use /pstats")
+    return PlainTextResponse(report["folded"])
+
+@router.get("/reports/{report_id}/pstats", dependencies=[Depends(require_enabled)])
+async def get_profiling_pstats(report_id: int, user = Depends(get_admin_user)):
+    """cProfile stats file (pstats/snakeviz/flameprof) of a cProfile report"""
+    report = find_report(report_id)
+    if "pstats_dump" not in report:
+        raise HTTPException(status_code=400, detail="Report was recorded by the sampler; use /folded")
+    return Response(report["pstats_dump"], media_type="application/octet-stream",
+                    headers={"Content-Disposition": f'attachment; filename="profile-{report_id}.prof"'})
+
+@router.delete("/reports", status_code=204, dependencies=[Depends(require_enabled)])
+async def clear_profiling_reports(user = Depends(get_admin_user)):
+    profiling.clear_reports()
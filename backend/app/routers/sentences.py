@@ -1,87 +1,149 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, Depends
-from app.database import get_db
-from app.models.content import SentenceResponse, SentenceUpdate
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query
+from app.models.content import (
+    SentenceResponse, SentenceUpdate,
+    SentenceBulkUpdate, SentenceBulkResponse, SentenceBulkItemResult,
+    SentenceAnalyzeRequest, SentenceSearchHit
+)
 from app.routers.auth import get_current_user
+from app.routers.ai import check_and_deduct_credits, resolve_provider_plan, rejected
+from app.services.admission import AdmissionRejected, check_rate
+from app.services.analysis import analysis_batcher
+from app.services.lexicon import candidates_for
+from app.services.retrieval import retrieve_context
+from app.services import translation_memory
+from app.storage import get_storage
+from app.config import ANALYSIS_BATCH_CONFIG, RETRIEVAL_CONFIG
+import asyncio
 import logging
 import json
+import math
 
 router = APIRouter(prefix="", tags=["Sentences"])
 logger = logging.getLogger(__name__)
 
 @router.get("/texts/{text_id}/sentences", response_model=List[SentenceResponse])
-async def get_text_sentences(text_id: int, user = Depends(get_current_user)):
-    logger.info(f"Fetching sentences for text {text_id}")
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM texts WHERE id = ? AND user_id = ?", (text_id, user["id"]))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Text not found")
-            
-        cursor.execute(
-            "SELECT * FROM sentences WHERE text_id = ? ORDER BY sentence_index ASC",
-            (text_id,)
-        )
-        rows = cursor.fetchall()
-        result = []
-        for r in rows:
-            r = dict(r)
-            analysis = None
-            if r["analysis_json"]:
-                try:
-                    analysis = json.loads(r["analysis_json"])
-                except:
-                    pass
-            result.append(SentenceResponse(
-                id=r["id"],
-                text_id=r["text_id"],
-                sentence_index=r["sentence_index"],
-                content=r["content"],
-                translation=r["translation"],
-                analysis=analysis
-            ))
-        return result
+async def get_text_sentences(
+    text_id: int,
+    chapter: Optional[int] = Query(None, ge=0, description="Only this chapter_index"),
+    user = Depends(get_current_user)
+):
+    logger.info(f"Fetching sentences for text {text_id}" + (f" chapter {chapter}" if chapter is not None else ""))
+    storage = get_storage()
+    if not await storage.owns_text(text_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Text not found")
+    return [row_to_sentence(r) for r in await storage.list_sentences(text_id, chapter)]
+
+@router.put("/texts/{text_id}/sentences", response_model=SentenceBulkResponse)
+async def update_text_sentences(text_id: int, data: SentenceBulkUpdate, user = Depends(get_current_user)):
+    """Bulk update translations/analyses for many sentences of one text in a single transaction"""
+    logger.info(f"Bulk updating {len(data.items)} sentences for text {text_id}")
+    storage = get_storage()
+    if not await storage.owns_text(text_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Text not found")
+
+    updates = [(item.id, item.translation,
+                json.dumps(item.analysis) if item.analysis is not None else None)
+               for item in data.items]
+    # Only ids that actually belong to this text are written
+    existing = set(await storage.update_sentences(text_id, updates))
+
+    results = []
+    updated = 0
+    for item in data.items:
+        if item.id not in existing:
+            results.append(SentenceBulkItemResult(id=item.id, status="not_found"))
+        elif item.translation is None and item.analysis is None:
+            results.append(SentenceBulkItemResult(id=item.id, status="skipped"))
+        else:
+            results.append(SentenceBulkItemResult(id=item.id, status="updated"))
+            updated += 1
+
+    return SentenceBulkResponse(text_id=text_id, updated=updated, results=results)
 
 @router.put("/sentences/{sent_id}", response_model=SentenceResponse)
 async def update_sentence(sent_id: int, data: SentenceUpdate, user = Depends(get_current_user)):
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT p.* FROM sentences p
-            JOIN texts t ON p.text_id = t.id
-            WHERE p.id = ? AND t.user_id = ?
-        ''', (sent_id, user["id"]))
-        
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Sentence not found")
-            
-        updates = []
-        params = []
-        if data.translation is not None:
-            updates.append("translation = ?"); params.append(data.translation)
-        if data.analysis is not None:
-            updates.append("analysis_json = ?"); params.append(json.dumps(data.analysis))
-            
-        if updates:
-            params.append(sent_id)
-            cursor.execute(f"UPDATE sentences SET {', '.join(updates)} WHERE id = ?", params)
-            
-        conn.commit()
-        cursor.execute("SELECT * FROM sentences WHERE id = ?", (sent_id,))
-        r = dict(cursor.fetchone())
-        
-        analysis = None
-        if r["analysis_json"]:
-            try:
-                analysis = json.loads(r["analysis_json"])
-            except:
-                pass
-                
-        return SentenceResponse(
-            id=r["id"],
-            text_id=r["text_id"],
-            sentence_index=r["sentence_index"],
-            content=r["content"],
-            translation=r["translation"],
-            analysis=analysis
+    r = await get_storage().update_sentence(
+        sent_id, user["id"],
+        translation=data.translation,
+        analysis_json=json.dumps(data.analysis) if data.analysis is not None else None
+    )
+    if not r:
+        raise HTTPException(status_code=404, detail="Sentence not found")
+    return row_to_sentence(r)
+
+def row_to_sentence(r: dict) -> SentenceResponse:
+    analysis = None
+    if r["analysis_json"]:
+        try:
+            analysis = json.loads(r["analysis_json"])
+        except json.JSONDecodeError:
+            pass
+    return SentenceResponse(
+        id=r["id"],
+        text_id=r["text_id"],
+        sentence_index=r["sentence_index"],
+        content=r["content"],
+        translation=r["translation"],
+        analysis=analysis
+    )
+
+@router.post("/sentences/analyze", response_model=List[SentenceResponse])
+async def analyze_sentences(data: SentenceAnalyzeRequest, user = Depends(get_current_user)):
+    """
+    Analyze and persist sentences server-side.
+    Concurrent requests are packed into shared multi-sentence LLM calls,
+    so credits are charged per packed call rather than per sentence.
+    """
+    storage = get_storage()
+    rows = await storage.get_owned_sentences(data.sentence_ids, user["id"])
+    if not rows:
+        raise HTTPException(status_code=404, detail="Sentences not found")
+
+    todo = [r for r in rows.values() if data.force or not r["translation"] or not r["analysis_json"]]
+    if todo and not data.force:
+        # Near-duplicates of already analyzed sentences are filled without an LLM call
+        todo = await translation_memory.reuse_from_memory(todo)
+    if todo:
+        plan = resolve_provider_plan(data)
+        try:
+            check_rate(user["id"])
+        except AdmissionRejected as e:
+            raise rejected(e)
+        # Sentences already queued or running (e.g. prefetched) are joined, not paid for again
+        billable = [r for r in todo if not analysis_batcher.is_inflight(r["id"])]
+        cost = math.ceil(len(billable) / ANALYSIS_BATCH_CONFIG["max_items"])
+        if cost:
+            remaining_credits = await check_and_deduct_credits(user["id"], cost, reason="analysis")
+            logger.info(f"User {user['id']} analyzing {len(todo)} sentences for {cost} credits, remaining: {remaining_credits}")
+
+        outcomes = await asyncio.gather(
+            *(analysis_batcher.analyze(r["id"], r["content"], plan,
+                                       vocab=candidates_for(r["vocab_json"], r["vocab_level"]))
+              for r in todo),
+            return_exceptions=True
         )
+        errors = [o for o in outcomes if isinstance(o, Exception)]
+        if errors:
+            logger.warning(f"{len(errors)}/{len(todo)} sentence analyses failed: {errors[0]}")
+            if len(errors) == len(todo):
+                if isinstance(errors[0], AdmissionRejected):
+                    raise rejected(errors[0])
+                raise HTTPException(status_code=500, detail=str(errors[0]))
+
+    rows = await storage.get_owned_sentences(data.sentence_ids, user["id"])
+
+    return [row_to_sentence(rows[sid]) for sid in dict.fromkeys(data.sentence_ids) if sid in rows]
+
+@router.get("/texts/{text_id}/sentences/search", response_model=List[SentenceSearchHit])
+async def search_text_sentences(
+    text_id: int,
+    q: str = Query(..., min_length=1),
+    k: int = Query(RETRIEVAL_CONFIG["default_k"], ge=1, le=50),
+    user = Depends(get_current_user)
+):
+    """Top-k sentences of a text relevant to a query (local vector index)"""
+    if not await get_storage().owns_text(text_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Text not found")
+    hits = await retrieve_context(text_id, q, k)
+    return [SentenceSearchHit(**h) for h in hits]
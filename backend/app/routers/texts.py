@@ -1,223 +1,188 @@
-from typing import List
-from fastapi import APIRouter, HTTPException, Depends
-from app.database import get_db
-from app.models.content import TextCreate, TextUpdate, TextResponse, TextProgressUpdate
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from app.config import IMPORT_CONFIG
+from app.models.content import (
+    TextCreate, TextUpdate, TextResponse, TextProgressUpdate, ChapterInfo, ChapterResponse
+)
 from app.routers.auth import get_current_user
-from app.services.nlp import sentencize
+from app.services.chapters import content_chapters
+from app.services.importers import BookImportError, open_book
+from app.services.bundles import BundleError, export_bundle, import_bundle
+from app.services.prefetch import schedule_prefetch
+from app.services.lexicon import annotate_text
+from app.services.maintenance import request_reclaim
+from app.services.retrieval import build_index, drop_index
+from app.services import translation_memory
+from app.storage import get_storage
 import logging
 import json
-import re
 
 router = APIRouter(prefix="/texts", tags=["Texts"])
 logger = logging.getLogger(__name__)
 
+def to_text_response(t: dict, current_chapter: Optional[int] = None) -> TextResponse:
+    scaffolding_data = None
+    if t.get("scaffolding_data"):
+        try:
+            scaffolding_data = json.loads(t["scaffolding_data"])
+        except:
+            pass
+    return TextResponse(
+        id=t["id"],
+        title=t["title"],
+        content=t["preview"] or "",
+        reading_mode=t["reading_mode"] or "flow",
+        scaffold_level=t["scaffold_level"] or 2,
+        vocab_level=t["vocab_level"] or "B1",
+        current_paragraph_id=t["current_paragraph_id"],
+        chapter_count=t["chapter_count"] or 1,
+        char_count=t["char_count"] or 0,
+        current_chapter=t.get("current_chapter") if current_chapter is None else current_chapter,
+        scaffolding_data=scaffolding_data,
+        created_at=str(t["created_at"]),
+        updated_at=str(t["updated_at"])
+    )
+
+async def fetch_text(text_id: int, user_id: int) -> dict:
+    t = await get_storage().get_text(text_id, user_id)
+    if not t:
+        raise HTTPException(status_code=404, detail="Text not found")
+    return t
+
+async def check_text(text_id: int, user_id: int):
+    if not await get_storage().owns_text(text_id, user_id):
+        raise HTTPException(status_code=404, detail="Text not found")
+
+def index_in_background(background_tasks: BackgroundTasks, text_id: int):
+    # Embed sentences and mark lexicon vocabulary off the request path
+    background_tasks.add_task(build_index, text_id)
+    background_tasks.add_task(annotate_text, text_id)
+
 @router.get("", response_model=List[TextResponse])
 async def list_texts(user = Depends(get_current_user)):
     logger.info(f"Listing texts for User {user['id']}")
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM texts WHERE user_id = ? ORDER BY updated_at DESC",
-            (user["id"],)
-        )
-        texts = cursor.fetchall()
-        result = []
-        for t in texts:
-            t = dict(t)
-            result.append(TextResponse(
-                id=t["id"],
-                title=t["title"],
-                content=t["content"],
-                reading_mode=t["reading_mode"] or "flow",
-                scaffold_level=t["scaffold_level"] or 2,
-                vocab_level=t["vocab_level"] or "B1",
-                current_paragraph_id=t["current_paragraph_id"],
-                created_at=str(t["created_at"]),
-                updated_at=str(t["updated_at"])
-            ))
-        return result
+    return [to_text_response(t) for t in await get_storage().list_texts(user["id"])]
 
 @router.post("", response_model=TextResponse, status_code=201)
-async def create_text(data: TextCreate, user = Depends(get_current_user)):
+async def create_text(data: TextCreate, background_tasks: BackgroundTasks, user = Depends(get_current_user)):
     logger.info(f"User {user['id']} creating text: {data.title}")
-    
-    with get_db() as conn:
-        cursor = conn.cursor()
-        scaffolding_json = json.dumps(data.scaffolding_data) if data.scaffolding_data else None
-        
-        cursor.execute(
-            "INSERT INTO texts (user_id, title, content, scaffolding_data) VALUES (?, ?, ?, ?)",
-            (user["id"], data.title, data.content, scaffolding_json)
-        )
-        text_id = cursor.lastrowid
-        
-        # Sentencize
-        sentences = sentencize(data.content)
-        if not sentences:
-            sentences = [p.strip() for p in re.split(r'\n+', data.content) if p.strip()]
-
-        if sentences:
-            sent_values = [(text_id, i, s) for i, s in enumerate(sentences)]
-            cursor.executemany(
-                "INSERT INTO sentences (text_id, sentence_index, content) VALUES (?, ?, ?)",
-                sent_values
-            )
-        
-        cursor.execute("SELECT * FROM texts WHERE id = ?", (text_id,))
-        t = dict(cursor.fetchone())
-        
-        scaffolding_data = None
-        if t.get("scaffolding_data"):
-            try:
-                scaffolding_data = json.loads(t["scaffolding_data"])
-            except:
-                pass
-        
-        return TextResponse(
-            id=t["id"],
-            title=t["title"],
-            content=t["content"],
-            reading_mode=t["reading_mode"] or "flow",
-            scaffold_level=t["scaffold_level"] or 2,
-            vocab_level=t["vocab_level"] or "B1",
-            current_paragraph_id=t["current_paragraph_id"],
-            scaffolding_data=scaffolding_data,
-            created_at=str(t["created_at"]),
-            updated_at=str(t["updated_at"])
-        )
+
+    # Detect chapters and sentencize each one
+    scaffolding_json = json.dumps(data.scaffolding_data) if data.scaffolding_data else None
+    text_id, sentence_count = await get_storage().create_text(
+        user["id"], data.title, content_chapters(data.content), scaffolding_json
+    )
+    if sentence_count:
+        index_in_background(background_tasks, text_id)
+
+    return to_text_response(await fetch_text(text_id, user["id"]), current_chapter=0)
+
+@router.post("/import", response_model=TextResponse, status_code=201)
+async def import_text(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                      title: Optional[str] = Form(None), user = Depends(get_current_user)):
+    """Create a text from an .epub or .txt upload, parsed a chapter at a time"""
+    logger.info(f"User {user['id']} importing {file.filename}")
+
+    # The upload is spooled to disk by the server, only its size is checked here
+    file.file.seek(0, 2)
+    size = file.file.tell()
+    file.file.seek(0)
+    if size > IMPORT_CONFIG["max_file_mb"] * 2 ** 20:
+        raise HTTPException(status_code=400, detail=f"File too large (max {IMPORT_CONFIG['max_file_mb']}MB)")
+
+    try:
+        book_title, chapters = await run_in_threadpool(open_book, file.filename, file.file,
+                                                       title.strip() if title else None)
+        text_id, sentence_count = await get_storage().create_text(user["id"], book_title, chapters)
+    except BookImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info(f"Imported {file.filename} as text {text_id} ({sentence_count} sentences)")
+
+    index_in_background(background_tasks, text_id)
+    return to_text_response(await fetch_text(text_id, user["id"]), current_chapter=0)
+
+@router.post("/import-bundle", response_model=TextResponse, status_code=201)
+async def import_text_bundle(background_tasks: BackgroundTasks, file: UploadFile = File(...),
+                             title: Optional[str] = Form(None), user = Depends(get_current_user)):
+    """Restore a text exported with GET /texts/{id}/export (plain or gzipped NDJSON)"""
+    logger.info(f"User {user['id']} importing bundle {file.filename}")
+    try:
+        text_id = await import_bundle(user["id"], file.file, title.strip() if title else None)
+    except BundleError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # Imported analyses become reusable for near-duplicate sentences too
+    background_tasks.add_task(build_index, text_id)
+    background_tasks.add_task(translation_memory.index_text, text_id)
+    return to_text_response(await fetch_text(text_id, user["id"]), current_chapter=0)
 
 @router.get("/{text_id}", response_model=TextResponse)
 async def get_text(text_id: int, user = Depends(get_current_user)):
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT * FROM texts WHERE id = ? AND user_id = ?",
-            (text_id, user["id"])
-        )
-        t = cursor.fetchone()
-        if not t:
-            raise HTTPException(status_code=404, detail="Text not found")
-        
-        t = dict(t)
-        scaffolding_data = None
-        if t.get("scaffolding_data"):
-            try:
-                scaffolding_data = json.loads(t["scaffolding_data"])
-            except:
-                pass
-                
-        return TextResponse(
-            id=t["id"],
-            title=t["title"],
-            content=t["content"],
-            reading_mode=t["reading_mode"] or "flow",
-            scaffold_level=t["scaffold_level"] or 2,
-            vocab_level=t["vocab_level"] or "B1",
-            current_paragraph_id=t["current_paragraph_id"],
-            scaffolding_data=scaffolding_data,
-            created_at=str(t["created_at"]),
-            updated_at=str(t["updated_at"])
-        )
+    return to_text_response(await fetch_text(text_id, user["id"]))
 
 @router.put("/{text_id}", response_model=TextResponse)
-async def update_text(text_id: int, data: TextUpdate, user = Depends(get_current_user)):
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM texts WHERE id = ? AND user_id = ?", (text_id, user["id"]))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Text not found")
-        
-        updates = []
-        params = []
-        if data.title is not None:
-            updates.append("title = ?"); params.append(data.title)
-        if data.content is not None:
-            updates.append("content = ?"); params.append(data.content)
-        if data.scaffolding_data is not None:
-            updates.append("scaffolding_data = ?"); params.append(json.dumps(data.scaffolding_data))
-        
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(text_id)
-            cursor.execute(f"UPDATE texts SET {', '.join(updates)} WHERE id = ?", params)
-        
-        cursor.execute("SELECT * FROM texts WHERE id = ?", (text_id,))
-        t = dict(cursor.fetchone())
-        
-        scaffolding = None
-        if t["scaffolding_data"]:
-            try:
-                scaffolding = json.loads(t["scaffolding_data"])
-            except:
-                pass
-        
-        return TextResponse(
-            id=t["id"],
-            title=t["title"],
-            content=t["content"],
-            reading_mode=t["reading_mode"] or "flow",
-            scaffold_level=t["scaffold_level"] or 2,
-            vocab_level=t["vocab_level"] or "B1",
-            current_paragraph_id=t["current_paragraph_id"],
-            scaffolding_data=scaffolding,
-            created_at=str(t["created_at"]),
-            updated_at=str(t["updated_at"])
-        )
+async def update_text(text_id: int, data: TextUpdate, background_tasks: BackgroundTasks,
+                      user = Depends(get_current_user)):
+    await check_text(text_id, user["id"])
+
+    # New content replaces the chapters and sentences (and their analyses)
+    await get_storage().update_text(
+        text_id,
+        title=data.title,
+        scaffolding_data=json.dumps(data.scaffolding_data) if data.scaffolding_data is not None else None,
+        chapters=content_chapters(data.content) if data.content is not None else None
+    )
+    if data.content is not None:
+        index_in_background(background_tasks, text_id)
+
+    return to_text_response(await fetch_text(text_id, user["id"]))
 
 @router.patch("/{text_id}/progress", response_model=TextResponse)
 async def update_text_progress(text_id: int, data: TextProgressUpdate, user = Depends(get_current_user)):
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM texts WHERE id = ? AND user_id = ?", (text_id, user["id"]))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Text not found")
-        
-        updates = []
-        params = []
-        if data.reading_mode is not None:
-            updates.append("reading_mode = ?"); params.append(data.reading_mode)
-        if data.scaffold_level is not None:
-            updates.append("scaffold_level = ?"); params.append(data.scaffold_level)
-        if data.vocab_level is not None:
-            updates.append("vocab_level = ?"); params.append(data.vocab_level)
-        if data.current_paragraph_id is not None:
-            updates.append("current_paragraph_id = ?"); params.append(data.current_paragraph_id)
-        
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(text_id)
-            cursor.execute(f"UPDATE texts SET {', '.join(updates)} WHERE id = ?", params)
-            conn.commit()
-        
-        # Return updated text
-        cursor.execute("SELECT * FROM texts WHERE id = ?", (text_id,))
-        t = dict(cursor.fetchone())
-        
-        scaffolding = None
-        if t["scaffolding_data"]:
-            try:
-                scaffolding = json.loads(t["scaffolding_data"])
-            except:
-                pass
-        
-        return TextResponse(
-            id=t["id"],
-            title=t["title"],
-            content=t["content"],
-            reading_mode=t["reading_mode"] or "flow",
-            scaffold_level=t["scaffold_level"] or 2,
-            vocab_level=t["vocab_level"] or "B1",
-            current_paragraph_id=t["current_paragraph_id"],
-            scaffolding_data=scaffolding,
-            created_at=str(t["created_at"]),
-            updated_at=str(t["updated_at"])
-        )
+    await check_text(text_id, user["id"])
+    await get_storage().update_progress(text_id, {k: v for k, v in vars(data).items() if v is not None})
+
+    # Warm up analysis for what the reader will see next
+    if data.current_paragraph_id is not None:
+        schedule_prefetch(user["id"], text_id, data.current_paragraph_id)
+
+    # Return updated text
+    return to_text_response(await fetch_text(text_id, user["id"]))
+
+@router.get("/{text_id}/chapters", response_model=List[ChapterInfo])
+async def list_chapters(text_id: int, user = Depends(get_current_user)):
+    await check_text(text_id, user["id"])
+    return [ChapterInfo(index=c["chapter_index"], title=c["title"], char_count=c["char_count"],
+                        sentence_start=c["sentence_start"], sentence_count=c["sentence_count"])
+            for c in await get_storage().list_chapters(text_id)]
+
+@router.get("/{text_id}/chapters/{chapter_index}", response_model=ChapterResponse)
+async def get_chapter(text_id: int, chapter_index: int, user = Depends(get_current_user)):
+    await check_text(text_id, user["id"])
+    c = await get_storage().get_chapter(text_id, chapter_index)
+    if not c:
+        raise HTTPException(status_code=404, detail="Chapter not found")
+    return ChapterResponse(index=c["chapter_index"], title=c["title"], char_count=c["char_count"],
+                           sentence_start=c["sentence_start"], sentence_count=c["sentence_count"],
+                           content=c["content"])
+
+@router.get("/{text_id}/export")
+async def export_text(text_id: int, compress: bool = False, user = Depends(get_current_user)):
+    """Stream the text, its chapters, sentences and analyses as an NDJSON bundle"""
+    await check_text(text_id, user["id"])
+    filename = f"text-{text_id}.ndjson" + (".gz" if compress else "")
+    return StreamingResponse(
+        export_bundle(text_id, user["id"], compress),
+        media_type="application/gzip" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @router.delete("/{text_id}", status_code=204)
 async def delete_text(text_id: int, user = Depends(get_current_user)):
-    with get_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT id FROM texts WHERE id = ? AND user_id = ?", (text_id, user["id"]))
-        if not cursor.fetchone():
-            raise HTTPException(status_code=404, detail="Text not found")
-        cursor.execute("DELETE FROM texts WHERE id = ?", (text_id,))
+    if not await get_storage().delete_text(text_id, user["id"]):
+        raise HTTPException(status_code=404, detail="Text not found")
+    drop_index(text_id)
+    # Hand the freed pages back to the filesystem in the background
+    request_reclaim()
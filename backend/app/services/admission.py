@@ -0,0 +1,195 @@
+"""
+Admission control for AI endpoints.
+- Per-user token bucket limits how fast one user can start AI requests.
+- Per-provider gate caps concurrent upstream calls and queues the rest
+  fairly (round-robin across users) with a bounded wait.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+from app.config import ADMISSION_CONFIG
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted; retry_after is in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec: float, burst: int):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> float:
+        """Take one token. Returns 0 on success, else seconds until one is available."""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class Slot:
+    """One unit of upstream concurrency; release() is idempotent"""
+
+    def __init__(self, gate: "FairGate"):
+        self.gate = gate
+        self.acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.gate._release(time.monotonic() - self.acquired_at)
+
+
+class FairGate:
+    """Concurrency limit for one provider with a round-robin queue across users"""
+
+    def __init__(self, name: str, capacity: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = 0
+        self.queues: "OrderedDict[int, deque]" = OrderedDict()  # user_id -> waiters
+        self.admitted = 0
+        self.rejected = 0
+        self.avg_hold = 1.0  # EWMA of slot hold time, seconds
+
+    def try_acquire(self) -> Optional[Slot]:
+        if self.active < self.capacity and self.waiting == 0:
+            self.active += 1
+            self.admitted += 1
+            return Slot(self)
+        return None
+
+    def retry_after(self) -> float:
+        return self.avg_hold * (self.waiting + 1) / self.capacity
+
+    async def acquire(self, user_id: int) -> Slot:
+        slot = self.try_acquire()
+        if slot:
+            return slot
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(f"{self.name} is at capacity", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.queues.setdefault(user_id, deque()).append(waiter)
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.max_wait)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as we gave up: hand the slot back, or keep it on timeout
+                if not isinstance(e, asyncio.TimeoutError):
+                    Slot(self).release()
+                    raise
+            else:
+                waiter.cancel()
+                self._forget(user_id, waiter)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.rejected += 1
+                    raise AdmissionRejected(f"Timed out waiting for {self.name}", self.retry_after())
+                raise
+        self.admitted += 1
+        return Slot(self)
+
+    def _forget(self, user_id: int, waiter):
+        q = self.queues.get(user_id)
+        if q and waiter in q:
+            q.remove(waiter)
+            self.waiting -= 1
+            if not q:
+                del self.queues[user_id]
+
+    def _release(self, held: float):
+        self.avg_hold = 0.9 * self.avg_hold + 0.1 * held
+        # Hand the slot directly to the next user in round-robin order
+        while self.queues:
+            user_id, q = next(iter(self.queues.items()))
+            waiter = q.popleft()
+            self.waiting -= 1
+            if q:
+                self.queues.move_to_end(user_id)
+            else:
+                del self.queues[user_id]
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "queue_depth": self.waiting,
+            "queued_users": len(self.queues),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_hold_ms": round(self.avg_hold * 1000, 1),
+        }
+
+
+_buckets: Dict[int, TokenBucket] = {}
+_gates: Dict[str, FairGate] = {
+    name: FairGate(name, capacity, ADMISSION_CONFIG["max_queue"], ADMISSION_CONFIG["max_wait"])
+    for name, capacity in ADMISSION_CONFIG["provider_concurrency"].items()
+}
+_rate_limited = 0
+MAX_TRACKED_BUCKETS = 10000
+
+
+def check_rate(user_id: int):
+    """Take a token from the user's bucket or raise AdmissionRejected"""
+    global _rate_limited
+    bucket = _buckets.get(user_id)
+    if bucket is None:
+        if len(_buckets) >= MAX_TRACKED_BUCKETS:
+            # Full buckets carry no state worth keeping
+            for uid in [uid for uid, b in _buckets.items() if b.is_full()]:
+                del _buckets[uid]
+        bucket = _buckets[user_id] = TokenBucket(
+            ADMISSION_CONFIG["user_rate_per_minute"] / 60.0,
+            ADMISSION_CONFIG["user_burst"]
+        )
+    wait = bucket.take()
+    if wait:
+        _rate_limited += 1
+        raise AdmissionRejected("Too many AI requests, please slow down", wait)
+
+
+def get_gate(provider: str) -> FairGate:
+    gate = _gates.get(provider)
+    if gate is None:
+        gate = _gates[provider] = FairGate(
+            provider, 8, ADMISSION_CONFIG["max_queue"], ADMISSION_CONFIG["max_wait"]
+        )
+    return gate
+
+
+def admission_stats() -> dict:
+    return {
+        "providers": {name: gate.snapshot() for name, gate in _gates.items()},
+        "tracked_users": len(_buckets),
+        "rate_limited": _rate_limited,
+    }
@@ -4,11 +4,13 @@ import logging
 from app.config import AI_CONFIG
 
 logger = logging.getLogger(__name__)
+# Prompts and responses, sampled and truncated separately (LOG_SAMPLING="app.services.ai.payload=...")
+payload_logger = logging.getLogger(__name__ + ".payload")
 
 async def call_aliyun(api_key: str, system_prompt: str, user_query: str):
     """Call Alibaba Cloud DashScope API (non-streaming)"""
-    logger.info(f"[Aliyun Call] Prompt:\nSystem: {system_prompt}\nUser: {user_query}")
-    url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+    payload_logger.info("[Aliyun Call] Prompt:\nSystem: %s\nUser: %s", system_prompt, user_query)
+    url = f"{AI_CONFIG['aliyun']['base_url']}/api/v1/services/aigc/text-generation/generation"
     
     async with httpx.AsyncClient(timeout=60.0) as client:
         response = await client.post(
@@ -37,13 +39,13 @@ async def call_aliyun(api_key: str, system_prompt: str, user_query: str):
         
         data = response.json()
         content = data["output"]["choices"][0]["message"]["content"]
-        logger.info(f"[Aliyun Call] Response: {content}")
+        payload_logger.info("[Aliyun Call] Response: %s", content)
         return {"content": content}
 
 async def call_google(api_key: str, system_prompt: str, user_query: str):
     """Call Google Gemini API (non-streaming)"""
     model = AI_CONFIG["google"]["model"]
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    url = f"{AI_CONFIG['google']['base_url']}/v1beta/models/{model}:generateContent?key={api_key}"
     
     combined_prompt = f"{system_prompt}\n\nUser Query: {user_query}"
     
@@ -67,8 +69,8 @@ async def call_google(api_key: str, system_prompt: str, user_query: str):
 
 async def stream_aliyun(api_key: str, system_prompt: str, user_query: str):
     """Stream from Alibaba Cloud DashScope API"""
-    logger.info(f"[Aliyun Stream] Prompt: System={system_prompt[:50]}... User={user_query[:50]}...")
-    url = "https://dashscope.aliyuncs.com/api/v1/services/aigc/text-generation/generation"
+    payload_logger.info("[Aliyun Stream] Prompt: System=%s... User=%s...", system_prompt[:50], user_query[:50])
+    url = f"{AI_CONFIG['aliyun']['base_url']}/api/v1/services/aigc/text-generation/generation"
     
     async with httpx.AsyncClient(timeout=120.0) as client:
         async with client.stream(
@@ -98,24 +100,50 @@ async def stream_aliyun(api_key: str, system_prompt: str, user_query: str):
                 logger.error(f"[Aliyun Stream] Error: {error_text.decode()}")
                 raise Exception(f"Aliyun API error: {error_text.decode()}")
             
-            async for line in response.aiter_lines():
-                if line.startswith("data:"):
-                    data_str = line[5:].strip()
-                    if data_str:
-                        try:
-                            data = json.loads(data_str)
-                            if "output" in data and "choices" in data["output"]:
-                                content = data["output"]["choices"][0]["message"].get("content", "")
-                                if content:
-                                    logger.debug(f"[Aliyun Stream] Chunk: {content}")
-                                    yield content
-                        except json.JSONDecodeError:
-                            pass
+            async for data_str in iter_sse_data(response):
+                try:
+                    data = json.loads(data_str)
+                except json.JSONDecodeError:
+                    logger.warning(f"[Aliyun Stream] Skipping malformed event: {data_str[:200]}")
+                    continue
+                if "output" in data and "choices" in data["output"]:
+                    content = data["output"]["choices"][0]["message"].get("content", "")
+                    if content:
+                        payload_logger.debug("[Aliyun Stream] Chunk: %s", content)
+                        yield content
+
+async def iter_sse_data(response):
+    """
+    Yield the data payload of each SSE event from an httpx streaming response.
+    Works line by line, so each chunk costs O(chunk) regardless of how much
+    of the stream has already been read.
+    """
+    data_lines = []
+    async for line in response.aiter_lines():
+        if not line:
+            # Blank line terminates an event
+            if data_lines:
+                yield "\n".join(data_lines)
+                data_lines = []
+            continue
+        if line.startswith("data:"):
+            value = line[5:]
+            data_lines.append(value[1:] if value.startswith(" ") else value)
+    if data_lines:
+        yield "\n".join(data_lines)
+
+def extract_google_text(data: dict) -> str:
+    """Concatenate the text parts of the first candidate in a Gemini response chunk"""
+    candidates = data.get("candidates") or []
+    if not candidates:
+        return ""
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
 
 async def stream_google(api_key: str, system_prompt: str, user_query: str):
-    """Stream from Google Gemini API"""
+    """Stream from Google Gemini API (SSE endpoint)"""
     model = AI_CONFIG["google"]["model"]
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:streamGenerateContent?key={api_key}"
+    url = f"{AI_CONFIG['google']['base_url']}/v1beta/models/{model}:streamGenerateContent?alt=sse&key={api_key}"
     
     combined_prompt = f"{system_prompt}\n\nUser Query: {user_query}"
     
@@ -134,27 +162,16 @@ async def stream_google(api_key: str, system_prompt: str, user_query: str):
                 error_text = await response.aread()
                 raise Exception(f"Google API error: {error_text.decode()}")
             
-            buffer = ""
-            async for chunk in response.aiter_text():
-                buffer += chunk
+            async for data_str in iter_sse_data(response):
                 try:
-                    if buffer.strip().startswith("["):
-                        buffer = buffer.strip()[1:]
-                    
-                    parts = buffer.split("},{")
-                    for i, part in enumerate(parts[:-1]):
-                        if not part.startswith("{"):
-                            part = "{" + part
-                        if not part.endswith("}"):
-                            part = part + "}"
-                        try:
-                            data = json.loads(part)
-                            if "candidates" in data:
-                                text = data["candidates"][0]["content"]["parts"][0].get("text", "")
-                                if text:
-                                    yield text
-                        except:
-                            pass
-                    buffer = parts[-1] if parts else ""
-                except:
-                    pass
+                    data = json.loads(data_str)
+                except json.JSONDecodeError:
+                    logger.warning(f"[Google Stream] Skipping malformed event: {data_str[:200]}")
+                    continue
+                if "error" in data:
+                    error = data["error"]
+                    message = error.get("message", error) if isinstance(error, dict) else error
+                    raise Exception(f"Google API error: {message}")
+                text = extract_google_text(data)
+                if text:
+                    yield text
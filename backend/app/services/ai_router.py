@@ -0,0 +1,326 @@
+"""
+Provider router for AI calls.
+Tracks rolling latency/error stats per provider, hedges slow requests to the
+second provider and fails over when one provider errors.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from app import metrics
+from app.config import AI_CONFIG, AI_ROUTER_CONFIG
+from app.services.ai import call_aliyun, call_google, stream_aliyun, stream_google
+from app.services.admission import Slot, get_gate
+
+logger = logging.getLogger(__name__)
+
+PROVIDERS = {
+    "aliyun": {"call": call_aliyun, "stream": stream_aliyun},
+    "google": {"call": call_google, "stream": stream_google},
+}
+
+
+class ProviderStats:
+    """
+    Rolling latency and error window for one provider. Non-streaming calls
+    (whole response) and streams (first chunk) are timed in separate windows,
+    so each hedge delay is judged against its own kind of request.
+    """
+
+    def __init__(self, window_size: int):
+        self.latency = {"call": deque(maxlen=window_size), "stream": deque(maxlen=window_size)}
+        self.outcomes = deque(maxlen=window_size)  # True = ok, False = error
+
+    def record_success(self, mode: str, seconds: float):
+        self.latency[mode].append(seconds)
+        self.outcomes.append(True)
+
+    def record_error(self):
+        self.outcomes.append(False)
+
+    def p95(self, mode: str) -> Optional[float]:
+        samples = self.latency[mode]
+        if len(samples) < AI_ROUTER_CONFIG["min_samples"]:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def snapshot(self) -> dict:
+        call, ttft = self.p95("call"), self.p95("stream")
+        return {
+            "samples": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 4),
+            "p95_call_ms": round(call * 1000, 1) if call is not None else None,
+            "p95_ttft_ms": round(ttft * 1000, 1) if ttft is not None else None,
+        }
+
+
+_stats: Dict[str, ProviderStats] = {
+    name: ProviderStats(AI_ROUTER_CONFIG["window_size"]) for name in PROVIDERS
+}
+
+
+def get_provider_stats() -> dict:
+    return {name: s.snapshot() for name, s in _stats.items()}
+
+
+def _is_unhealthy(provider: str) -> bool:
+    s = _stats[provider]
+    return (len(s.outcomes) >= AI_ROUTER_CONFIG["min_samples"]
+            and s.error_rate() >= AI_ROUTER_CONFIG["unhealthy_error_rate"])
+
+
+def plan_providers(preferred: str, api_key: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Return [(provider, api_key), ...] in the order they should be tried.
+    The requested provider goes first unless it is currently unhealthy;
+    others are only included when the server has a key configured for them.
+    """
+    if preferred not in PROVIDERS:
+        raise ValueError(f"Unknown provider: {preferred}")
+
+    plan = []
+    primary_key = api_key or AI_CONFIG.get(preferred, {}).get("api_key", "")
+    if primary_key:
+        plan.append((preferred, primary_key))
+    for name in PROVIDERS:
+        if name == preferred:
+            continue
+        key = AI_CONFIG.get(name, {}).get("api_key", "")
+        if key:
+            plan.append((name, key))
+
+    # Demote unhealthy providers, keeping relative order otherwise
+    plan.sort(key=lambda p: _is_unhealthy(p[0]))
+    return plan
+
+
+def _hedge_delay(provider: str, mode: str) -> float:
+    p95 = _stats[provider].p95(mode)
+    if p95 is None:
+        return AI_ROUTER_CONFIG["hedge_default_delay"]
+    return max(AI_ROUTER_CONFIG["hedge_min_delay"], p95)
+
+
+async def _timed_call(provider: str, api_key: str, system_prompt: str, user_query: str):
+    started = time.monotonic()
+    try:
+        result = await PROVIDERS[provider]["call"](api_key, system_prompt, user_query)
+    except asyncio.CancelledError:
+        metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="call", outcome="cancelled")
+        raise
+    except Exception:
+        _stats[provider].record_error()
+        metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="call", outcome="error")
+        raise
+    _stats[provider].record_success("call", time.monotonic() - started)
+    metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="call", outcome="ok")
+    return provider, result
+
+
+async def _slot_for(provider: str, user_id: Optional[int], hedge: bool) -> Optional[Slot]:
+    """Hedges only use spare capacity; failovers wait in the provider's queue"""
+    gate = get_gate(provider)
+    if hedge:
+        return gate.try_acquire()
+    return await gate.acquire(user_id)
+
+
+async def routed_call(plan: List[Tuple[str, str]], system_prompt: str, user_query: str,
+                      user_id: Optional[int] = None, primary_slot: Optional[Slot] = None) -> Tuple[str, dict]:
+    """
+    Non-streaming call with hedging and failover. Returns (provider, result).
+    primary_slot is the admission slot already held for plan[0]; it is released here.
+    """
+    if not plan:
+        raise ValueError("No AI provider is configured")
+
+    pending = {}  # task -> provider
+    remaining = list(plan)
+    last_error = None
+    can_hedge = AI_ROUTER_CONFIG["hedge_enabled"]
+
+    def launch(slot: Optional[Slot]):
+        provider, key = remaining.pop(0)
+        task = asyncio.ensure_future(_timed_call(provider, key, system_prompt, user_query))
+        if slot:
+            task.add_done_callback(lambda _: slot.release())
+        pending[task] = provider
+        return provider
+
+    primary = launch(primary_slot)
+    try:
+        while pending:
+            timeout = None
+            if remaining and can_hedge and len(pending) == 1:
+                timeout = _hedge_delay(primary, "call")
+            done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                slot = await _slot_for(remaining[0][0], user_id, hedge=True)
+                if slot is None:
+                    logger.info(f"[AI Router] {primary} passed p95 latency but {remaining[0][0]} has no spare capacity")
+                    can_hedge = False
+                    continue
+                hedged = launch(slot)
+                logger.info(f"[AI Router] {primary} passed p95 latency, hedging to {hedged}")
+                continue
+
+            for task in done:
+                provider = pending.pop(task)
+                if task.exception() is None:
+                    return task.result()
+                last_error = task.exception()
+                logger.warning(f"[AI Router] {provider} failed: {last_error}")
+
+            # Fail over immediately if nothing else is in flight
+            if not pending and remaining:
+                primary = launch(await _slot_for(remaining[0][0], user_id, hedge=False))
+                logger.info(f"[AI Router] Failing over to {primary}")
+    finally:
+        # Cancel the losers and wait for them, so their slots are released before returning
+        for task in pending:
+            task.cancel()
+        for task in pending:
+            try:
+                await task
+            except BaseException:
+                pass
+
+    raise last_error
+
+
+async def routed_stream(plan: List[Tuple[str, str]], system_prompt: str, user_query: str,
+                        user_id: Optional[int] = None, primary_slot: Optional[Slot] = None):
+    """
+    Streaming call with hedging and failover on the first token.
+    Yields (provider, chunk). Once a provider has produced its first chunk it
+    owns the stream; a later failure is raised since the client has already
+    rendered partial output.
+    """
+    if not plan:
+        raise ValueError("No AI provider is configured")
+
+    streams = {}  # task -> (provider, generator, started)
+    slots = {}  # generator -> admission slot
+    remaining = list(plan)
+    last_error = None
+    can_hedge = AI_ROUTER_CONFIG["hedge_enabled"]
+
+    def launch(slot: Optional[Slot]):
+        provider, key = remaining.pop(0)
+        gen = PROVIDERS[provider]["stream"](key, system_prompt, user_query)
+        task = asyncio.ensure_future(gen.__anext__())
+        streams[task] = (provider, gen, time.monotonic())
+        if slot:
+            slots[gen] = slot
+        return provider
+
+    async def close(gen):
+        try:
+            await gen.aclose()
+        finally:
+            if gen in slots:
+                slots.pop(gen).release()
+
+    winner = None
+    first_chunk = None
+    try:
+        primary = launch(primary_slot)
+    except BaseException:
+        if primary_slot:
+            primary_slot.release()
+        raise
+    try:
+        while streams and winner is None:
+            timeout = None
+            if remaining and can_hedge and len(streams) == 1:
+                timeout = _hedge_delay(primary, "stream")
+            done, _ = await asyncio.wait(streams.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            if not done:
+                slot = await _slot_for(remaining[0][0], user_id, hedge=True)
+                if slot is None:
+                    logger.info(f"[AI Router] {primary} stream passed p95 TTFT but {remaining[0][0]} has no spare capacity")
+                    can_hedge = False
+                    continue
+                hedged = launch(slot)
+                logger.info(f"[AI Router] {primary} stream passed p95 TTFT, hedging to {hedged}")
+                continue
+
+            for task in done:
+                provider, gen, started = streams.pop(task)
+                error = task.exception()
+                if error is None and winner is None:
+                    _stats[provider].record_success("stream", time.monotonic() - started)
+                    metrics.AI_TTFT.observe(time.monotonic() - started, provider=provider)
+                    winner = (provider, gen, started)
+                    first_chunk = task.result()
+                elif error is None:
+                    metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="stream",
+                                                outcome="cancelled")
+                    await close(gen)
+                elif isinstance(error, StopAsyncIteration):
+                    # Finished without any output; treat as a success with nothing to say
+                    _stats[provider].record_success("stream", time.monotonic() - started)
+                    await close(gen)
+                    if winner is None and not streams:
+                        return
+                else:
+                    await close(gen)
+                    _stats[provider].record_error()
+                    metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="stream",
+                                                outcome="error")
+                    last_error = error
+                    logger.warning(f"[AI Router] {provider} stream failed: {error}")
+
+            if winner is None and not streams and remaining:
+                primary = launch(await _slot_for(remaining[0][0], user_id, hedge=False))
+                logger.info(f"[AI Router] Failing over stream to {primary}")
+    finally:
+        # Cancel and close the losers
+        for task, (provider, gen, started) in streams.items():
+            metrics.AI_DURATION.observe(time.monotonic() - started, provider=provider, mode="stream",
+                                        outcome="cancelled")
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
+            await close(gen)
+        if winner is None:
+            for slot in slots.values():
+                slot.release()
+
+    if winner is None:
+        raise last_error
+
+    provider, gen, started = winner
+    first_at = time.monotonic()
+    chunks = 1
+    outcome = "cancelled"
+    try:
+        yield provider, first_chunk
+        async for chunk in gen:
+            chunks += 1
+            yield provider, chunk
+        outcome = "ok"
+    except Exception:
+        _stats[provider].record_error()
+        outcome = "error"
+        raise
+    finally:
+        now = time.monotonic()
+        metrics.AI_DURATION.observe(now - started, provider=provider, mode="stream", outcome=outcome)
+        metrics.AI_CHUNKS.inc(chunks, provider=provider)
+        if chunks > 1 and now > first_at:
+            metrics.AI_CHUNK_RATE.observe((chunks - 1) / (now - first_at), provider=provider)
+        await close(gen)
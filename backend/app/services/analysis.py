@@ -0,0 +1,272 @@
+"""
+Batched sentence analysis.
+Pending sentence-analysis requests are collected for a short linger window,
+packed into one structured prompt up to a token budget and split back out per
+sentence id. Items the model drops or mangles are retried one at a time.
+Results are written straight to the sentences table (through app.storage). Sentences annotated by
+the CEFR lexicon carry their pre-selected vocabulary, so the model only
+explains those words instead of extracting vocabulary itself.
+"""
+
+import asyncio
+import json
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from app.config import ANALYSIS_BATCH_CONFIG
+from app.services.admission import AdmissionRejected, get_gate
+from app.services.ai_router import routed_call
+from app.services.prompts import ANALYSIS_SYSTEM, ANALYSIS_VOCAB_SYSTEM, BATCH_ANALYSIS_SYSTEM
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+PREFETCH = 1
+
+# Fairness key for batch traffic in the provider gates
+BATCH_LANE = "analysis-batch"
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 chars per token for English)"""
+    return len(text) // 4 + 1
+
+
+def parse_json_response(text: str):
+    """Parse a model response that may wrap its JSON in a code fence or prose"""
+    match = re.search(r"```(?:json)?\s*([\s\S]*?)\s*```", text)
+    if match:
+        text = match.group(1)
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        first, last = text.find("{"), text.rfind("}")
+        if first == -1 or last == -1:
+            raise
+        return json.loads(text[first:last + 1])
+
+
+def normalize_analysis(raw) -> Optional[dict]:
+    """Shape a model result like the frontend persists it, or None if unusable"""
+    if not isinstance(raw, dict) or not isinstance(raw.get("translation"), str):
+        return None
+    return {
+        "translation": raw["translation"],
+        "analysis": {
+            "knowledge": raw.get("knowledge") or [],
+            "insight": raw.get("insight"),
+            "xray": raw.get("xray"),
+            "companion": raw.get("companion"),
+        },
+    }
+
+
+class _Pending:
+    __slots__ = ("sentence_id", "text", "vocab", "priority", "tokens", "future")
+
+    def __init__(self, sentence_id: int, text: str, vocab: Optional[List[dict]],
+                 priority: int, future: asyncio.Future):
+        self.sentence_id = sentence_id
+        self.text = text
+        self.vocab = vocab
+        self.priority = priority
+        self.tokens = estimate_tokens(text) + (estimate_tokens(json.dumps(vocab)) if vocab else 0)
+        self.future = future
+
+    def item(self) -> dict:
+        item = {"id": self.sentence_id, "text": self.text}
+        if self.vocab is not None:
+            item["vocab"] = self.vocab
+        return item
+
+    def finish(self, normalized: dict) -> dict:
+        # No words above the reader's level: never keep vocabulary the model added anyway
+        if self.vocab == []:
+            normalized["analysis"]["knowledge"] = []
+        return normalized
+
+
+class AnalysisBatcher:
+    def __init__(self):
+        self._queues: Dict[Tuple, List[_Pending]] = {}  # provider plan -> pending items
+        self._flushers: Dict[Tuple, asyncio.Task] = {}
+        self._inflight: Dict[int, _Pending] = {}  # sentence id -> queued or running item
+        self._tasks = set()  # strong references: the loop only keeps weak ones
+        self.stats = {"items": 0, "upstream_calls": 0, "batched_calls": 0, "retries": 0,
+                      "failures": 0, "deduplicated": 0, "prefetch_dropped": 0}
+
+    async def analyze(self, sentence_id: int, text: str, plan: List[Tuple[str, str]],
+                      priority: int = INTERACTIVE, vocab: Optional[List[dict]] = None) -> dict:
+        """
+        Queue one sentence and wait for its normalized analysis.
+        vocab is the lexicon's pre-selected [{"word", "diff"}] list, or None to
+        let the model choose vocabulary.
+        """
+        while sentence_id in self._inflight:
+            # Join the request already in flight; promote it if it is still queued
+            existing = self._inflight[sentence_id]
+            self.stats["deduplicated"] += 1
+            existing.priority = min(existing.priority, priority)
+            try:
+                return await asyncio.shield(existing.future)
+            except AdmissionRejected:
+                # A prefetch we joined was dropped; interactive callers queue their own
+                if priority != INTERACTIVE:
+                    raise
+                if self._inflight.get(sentence_id) is existing:
+                    del self._inflight[sentence_id]
+
+        key = tuple(plan)
+        future = asyncio.get_running_loop().create_future()
+        pending = _Pending(sentence_id, text, vocab, priority, future)
+        self._inflight[sentence_id] = pending
+        future.add_done_callback(lambda f: self._settled(sentence_id, f))
+        self._queues.setdefault(key, []).append(pending)
+        if key not in self._flushers:
+            self._flushers[key] = self._spawn(self._flush_later(key))
+        # Shielded so one caller disconnecting doesn't cancel work others wait on
+        return await asyncio.shield(future)
+
+    def _settled(self, sentence_id: int, future: asyncio.Future):
+        self._inflight.pop(sentence_id, None)
+        if not future.cancelled():
+            future.exception()  # mark retrieved; waiters that left can't observe it
+
+    async def _flush_later(self, key: Tuple):
+        await asyncio.sleep(ANALYSIS_BATCH_CONFIG["linger"])
+        del self._flushers[key]
+        items = [p for p in self._queues.pop(key, []) if not p.future.done()]
+        # Interactive and prefetch items never share a call, so background
+        # work can't slow down or block a reader-facing request.
+        for priority in sorted({p.priority for p in items}):
+            group = [p for p in items if p.priority == priority]
+            for batch in self._pack(group):
+                self._spawn(self._run_batch(list(key), batch, background=priority != INTERACTIVE))
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _pack(self, items: List[_Pending]) -> List[List[_Pending]]:
+        batches, current, tokens = [], [], 0
+        for p in items:
+            if current and (tokens + p.tokens > ANALYSIS_BATCH_CONFIG["max_batch_tokens"]
+                            or len(current) >= ANALYSIS_BATCH_CONFIG["max_items"]):
+                batches.append(current)
+                current, tokens = [], 0
+            current.append(p)
+            tokens += p.tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def _call(self, plan, system_prompt: str, user_query: str, background: bool = False) -> str:
+        gate = get_gate(plan[0][0])
+        if background:
+            # Prefetch only runs on spare upstream capacity, never queues
+            slot = gate.try_acquire()
+            if slot is None:
+                raise AdmissionRejected("No spare capacity for prefetch", 1)
+        else:
+            slot = await gate.acquire(BATCH_LANE)
+        self.stats["upstream_calls"] += 1
+        _, result = await routed_call(plan, system_prompt, user_query, user_id=BATCH_LANE, primary_slot=slot)
+        return result["content"]
+
+    async def _run_batch(self, plan, batch: List[_Pending], background: bool = False):
+        self.stats["items"] += len(batch)
+        if len(batch) == 1:
+            await self._run_single(plan, batch[0], background)
+            return
+
+        self.stats["batched_calls"] += 1
+        payload = json.dumps([p.item() for p in batch], ensure_ascii=False)
+        by_id = {}
+        pending_by_id = {p.sentence_id: p for p in batch}
+        try:
+            content = await self._call(plan, BATCH_ANALYSIS_SYSTEM, payload, background)
+            parsed = parse_json_response(content)
+            results = parsed.get("results", []) if isinstance(parsed, dict) else parsed
+            for raw in results if isinstance(results, list) else []:
+                if not isinstance(raw, dict):
+                    continue
+                try:
+                    # Models often echo ids back as strings ("12")
+                    sentence_id = int(raw.get("id"))
+                except (TypeError, ValueError):
+                    continue
+                normalized = normalize_analysis(raw)
+                if normalized and sentence_id in pending_by_id:
+                    by_id[sentence_id] = pending_by_id[sentence_id].finish(normalized)
+        except (json.JSONDecodeError, AttributeError, KeyError, TypeError) as e:
+            logger.warning(f"[Analysis Batch] Unparseable batch of {len(batch)}: {e}")
+        except AdmissionRejected as e:
+            self.stats["prefetch_dropped"] += len(batch)
+            self._fail(batch, e)
+            return
+        except Exception as e:
+            logger.error(f"[Analysis Batch] Upstream failure for batch of {len(batch)}: {e}")
+            self._fail(batch, e)
+            return
+
+        done = [p for p in batch if p.sentence_id in by_id]
+        await self._save([(p, by_id[p.sentence_id]) for p in done])
+        for p in done:
+            if not p.future.done():
+                p.future.set_result(by_id[p.sentence_id])
+
+        retry = [p for p in batch if p.sentence_id not in by_id]
+        if retry:
+            logger.info(f"[Analysis Batch] Retrying {len(retry)}/{len(batch)} items individually")
+            self.stats["retries"] += len(retry)
+            await asyncio.gather(*(self._run_single(plan, p, background) for p in retry))
+
+    async def _run_single(self, plan, p: _Pending, background: bool = False):
+        try:
+            if p.vocab is None:
+                content = await self._call(plan, ANALYSIS_SYSTEM, p.text, background)
+            else:
+                query = f"{p.text}\n\nVOCAB: {json.dumps(p.vocab, ensure_ascii=False)}"
+                content = await self._call(plan, ANALYSIS_VOCAB_SYSTEM, query, background)
+            normalized = normalize_analysis(parse_json_response(content))
+            if normalized is None:
+                raise ValueError("Malformed analysis response")
+            normalized = p.finish(normalized)
+        except AdmissionRejected as e:
+            self.stats["prefetch_dropped"] += 1
+            self._fail([p], e)
+            return
+        except Exception as e:
+            logger.error(f"[Analysis] Sentence {p.sentence_id} failed: {e}")
+            self._fail([p], e)
+            return
+        await self._save([(p, normalized)])
+        if not p.future.done():
+            p.future.set_result(normalized)
+
+    def _fail(self, items: List[_Pending], error: Exception):
+        self.stats["failures"] += len(items)
+        for p in items:
+            if not p.future.done():
+                p.future.set_exception(error)
+
+    async def _save(self, results: List[Tuple[_Pending, dict]]):
+        if not results:
+            return
+        await get_storage().save_analyses(
+            [(p.sentence_id, p.text, r["translation"], json.dumps(r["analysis"], ensure_ascii=False))
+             for p, r in results]
+        )
+
+    def pending(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def is_inflight(self, sentence_id: int) -> bool:
+        return sentence_id in self._inflight
+
+
+analysis_batcher = AnalysisBatcher()
@@ -0,0 +1,320 @@
+"""
+Whole-text audiobook rendering.
+A render walks a text's sentences in reading order and synthesizes each one
+into its own MP3 segment. The segments are stored under AUDIO_SEGMENT_DIR and
+named by a hash of voice and sentence, so:
+
+- a render that stopped (error, restart) resumes where it left off;
+- re-rendering after an edit only synthesizes the sentences that changed;
+- repeated sentences, within a book or across books, are synthesized once.
+
+Renders share a pool of AUDIOBOOK_WORKERS synthesis slots, so a few books
+rendering at once can't flood edge-tts or starve /tts. The playlist is an HLS
+media playlist of the segments rendered so far in reading order: an EVENT
+playlist that players reload while the render runs, then VOD with an end tag.
+Each segment URI carries its sentence id for highlighting. A segment is only
+served through a text whose sentences produced it, so the shared store
+doesn't reveal what other users' books contain.
+
+Segments of edited or deleted texts are not tracked; instead the store is
+kept under AUDIO_SEGMENT_MAX_MB by deleting the least recently used segments
+(by mtime, refreshed whenever a render reuses one).
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+import uuid
+from typing import Dict, List, Optional, Set, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app import metrics
+from app.config import AUDIOBOOK_CONFIG, VOICES
+from app.services.tts import synthesize
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+PENDING, DONE, FAILED = "pending", "done", "failed"
+
+_renders: Dict[Tuple[int, str], "AudioRender"] = {}  # (text_id, voice) -> most recent render
+_slots: Optional[asyncio.Semaphore] = None
+_sweeper: Optional[asyncio.Task] = None
+
+
+class RenderLimitReached(Exception):
+    pass
+
+
+def segment_key(edge_voice: str, content: str) -> str:
+    return hashlib.sha1(f"{edge_voice}\n{content}".encode("utf-8")).hexdigest()
+
+
+def segment_path(key: str) -> str:
+    return os.path.join(AUDIOBOOK_CONFIG["segment_dir"], key[:2], f"{key}.mp3")
+
+
+def _duration(size: int) -> float:
+    return size * 8 / AUDIOBOOK_CONFIG["bitrate"]
+
+
+def _max_seconds(content: str) -> float:
+    """Generous upper bound on how long content takes to speak"""
+    return max(len(content) / AUDIOBOOK_CONFIG["min_chars_per_second"],
+               len(content.split()) / AUDIOBOOK_CONFIG["min_words_per_second"])
+
+
+def _touch(path: str):
+    # Marks the segment as recently used for sweep_segments
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def _write_segment(key: str, audio: bytes):
+    path = segment_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(audio)
+    os.replace(tmp, path)
+
+
+class Segment:
+    __slots__ = ("sentence_id", "key", "content", "state", "duration")
+
+    def __init__(self, sentence_id: int, key: str, content: str):
+        self.sentence_id = sentence_id
+        self.key = key
+        self.content = content  # dropped once rendered
+        self.state = PENDING
+        self.duration = 0.0
+
+
+class AudioRender:
+    def __init__(self, text_id: int, voice: str, sentences: List[dict]):
+        """Blocking (stats every segment file): build it in the threadpool"""
+        self.text_id = text_id
+        self.voice = voice  # a VOICES name
+        edge_voice = VOICES[voice]
+        self.segments = []
+        for row in sentences:
+            content = " ".join((row["content"] or "").split())
+            if not content:
+                continue
+            segment = Segment(row["id"], segment_key(edge_voice, content), content)
+            path = segment_path(segment.key)
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0
+            if size:
+                _touch(path)
+                segment.state, segment.duration, segment.content = DONE, _duration(size), None
+            self.segments.append(segment)
+        self.keys = {s.key for s in self.segments}
+        # Players expect EXT-X-TARGETDURATION not to change between reloads: fix it
+        # from the text (not the rendered prefix) as an upper bound on any segment
+        self.target_duration = max([AUDIOBOOK_CONFIG["target_duration"]]
+                                   + [math.ceil(_max_seconds(row["content"] or "")) for row in sentences]
+                                   + [math.ceil(s.duration) for s in self.segments])
+        self.reused = sum(1 for s in self.segments if s.state == DONE)
+        self.task: Optional[asyncio.Task] = None
+        self.updated = time.monotonic()
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    def status(self) -> dict:
+        counts = {PENDING: 0, DONE: 0, FAILED: 0}
+        for s in self.segments:
+            counts[s.state] += 1
+        if self.running:
+            state = "rendering"
+        else:
+            state = "complete" if not counts[PENDING] else "partial"
+        return {
+            "text_id": self.text_id,
+            "voice": self.voice,
+            "state": state,
+            "total": len(self.segments),
+            "rendered": counts[DONE],
+            "failed": counts[FAILED],
+            "duration": round(sum(s.duration for s in self.segments), 3),
+        }
+
+    def playlist(self, query: str = "") -> str:
+        """
+        HLS playlist of the rendered prefix; failed sentences are left out.
+        query is appended to every segment URI (e.g. a URL signature)
+        """
+        entries = []
+        for s in self.segments:
+            if s.state == PENDING:
+                break
+            if s.state == DONE:
+                entries.append(s)
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{self.target_duration}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            f"#EXT-X-PLAYLIST-TYPE:{'EVENT' if self.running else 'VOD'}",
+        ]
+        for s in entries:
+            lines.append(f"#EXTINF:{s.duration:.3f},")
+            lines.append(f"segments/{s.key}.mp3?sentence={s.sentence_id}{query}")
+        if not self.running:
+            lines.append("#EXT-X-ENDLIST")
+        return "\n".join(lines) + "\n"
+
+    async def run(self):
+        todo = iter([s for s in self.segments if s.state == PENDING])
+        started = time.perf_counter()
+        await asyncio.gather(*(self._worker(todo) for _ in range(AUDIOBOOK_CONFIG["workers"])))
+        status = self.status()
+        self.updated = time.monotonic()
+        logger.info(f"Rendered text {self.text_id} ({self.voice}): {status['rendered']}/{status['total']} segments "
+                    f"({self.reused} reused, {status['failed']} failed) in {time.perf_counter() - started:.1f}s")
+
+    async def _worker(self, todo):
+        # Workers take the next sentence in reading order, so the playable prefix grows steadily
+        for segment in todo:
+            await self._render(segment)
+
+    async def _render(self, segment: Segment):
+        global _slots
+        if _slots is None:
+            _slots = asyncio.Semaphore(AUDIOBOOK_CONFIG["workers"])
+        for attempt in range(AUDIOBOOK_CONFIG["retries"] + 1):
+            try:
+                async with _slots:
+                    audio = await synthesize(segment.content, VOICES[self.voice])
+                if not audio:
+                    raise ValueError("no audio received")
+                await run_in_threadpool(_write_segment, segment.key, audio)
+            except Exception as e:
+                if attempt < AUDIOBOOK_CONFIG["retries"]:
+                    await asyncio.sleep(2 ** attempt)
+                    continue
+                logger.warning(f"Skipping sentence {segment.sentence_id} of text {self.text_id}: {e}")
+                segment.state = FAILED
+                metrics.AUDIOBOOK_SEGMENTS.inc(outcome="failed")
+                return
+            segment.state, segment.duration, segment.content = DONE, _duration(len(audio)), None
+            metrics.AUDIOBOOK_SEGMENTS.inc(outcome="rendered")
+            return
+
+
+def _expire():
+    cutoff = time.monotonic() - AUDIOBOOK_CONFIG["job_ttl"]
+    for key, render in list(_renders.items()):
+        if not render.running and render.updated < cutoff:
+            del _renders[key]
+    # Then the least recently used idle renders, down to the cap
+    idle = sorted((r.updated, key) for key, r in _renders.items() if not r.running)
+    for _, key in idle[:max(0, len(_renders) - AUDIOBOOK_CONFIG["max_cached_renders"])]:
+        del _renders[key]
+
+
+async def _load(text_id: int, voice: str) -> AudioRender:
+    sentences = await get_storage().list_sentences(text_id)
+    return await run_in_threadpool(AudioRender, text_id, voice, sentences)
+
+
+async def start_render(text_id: int, voice: str) -> AudioRender:
+    """Start (or resume) rendering a text; returns the running render if there is one"""
+    _expire()
+    render = _renders.get((text_id, voice))
+    if render and render.running:
+        return render
+    if sum(1 for r in _renders.values() if r.running) >= AUDIOBOOK_CONFIG["max_renders"]:
+        raise RenderLimitReached(f"{AUDIOBOOK_CONFIG['max_renders']} texts are already rendering, try again later")
+    # Re-read the sentences: the text may have been edited since the last render
+    render = await _load(text_id, voice)
+    current = _renders.get((text_id, voice))
+    if current and current.running:
+        return current  # another request started one meanwhile
+    _renders[(text_id, voice)] = render
+    metrics.AUDIOBOOK_SEGMENTS.inc(render.reused, outcome="reused")
+    render.task = asyncio.create_task(render.run())
+    return render
+
+
+async def get_render(text_id: int, voice: str) -> AudioRender:
+    """The current or last render, or what is already on disk if there was none"""
+    _expire()
+    render = _renders.get((text_id, voice))
+    if render is None:
+        render = await _load(text_id, voice)
+        render = _renders.setdefault((text_id, voice), render)
+        _expire()
+    elif not render.running:
+        render.updated = time.monotonic()
+    return render
+
+
+def sweep_segments(keep: Set[str], max_bytes: Optional[int] = None) -> int:
+    """
+    Delete the least recently used segments, except keep, until the store
+    fits in max_bytes (segment_max_mb by default); returns files deleted.
+    Also removes temporary files left by an interrupted write.
+    """
+    max_bytes = AUDIOBOOK_CONFIG["segment_max_mb"] * 2 ** 20 if max_bytes is None else max_bytes
+    root = AUDIOBOOK_CONFIG["segment_dir"]
+    if not os.path.isdir(root):
+        return 0
+    files, total = [], 0
+    stale = time.time() - 3600
+    for directory in os.scandir(root):
+        if not directory.is_dir():
+            continue
+        for entry in os.scandir(directory.path):
+            try:
+                st = entry.stat()
+                if entry.name.endswith(".tmp"):
+                    if st.st_mtime < stale:
+                        os.remove(entry.path)
+                elif entry.name.endswith(".mp3"):
+                    files.append((st.st_mtime, st.st_size, entry.path))
+                    total += st.st_size
+            except FileNotFoundError:
+                pass  # removed meanwhile
+    deleted = 0
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if os.path.basename(path)[:-4] in keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        deleted += 1
+    if deleted:
+        logger.info(f"Deleted {deleted} least recently used audio segments ({total / 2**20:.0f} MiB kept)")
+    return deleted
+
+
+async def _sweep_loop():
+    while True:
+        try:
+            # Segments of cached renders may be in a playlist a player is reading
+            keep = set().union(*(r.keys for r in _renders.values()))
+            await run_in_threadpool(sweep_segments, keep)
+        except Exception as e:
+            logger.error(f"Audio segment sweep failed: {e}")
+        await asyncio.sleep(AUDIOBOOK_CONFIG["sweep_interval"])
+
+
+def start_segment_sweeper():
+    global _sweeper
+    if _sweeper is None or _sweeper.done():
+        _sweeper = asyncio.get_running_loop().create_task(_sweep_loop())
@@ -1,9 +1,12 @@
+import asyncio
 import secrets
 import hashlib
+import hmac
 import jwt
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
-from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_HOURS
+from app.config import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_HOURS, PASSWORD_HASH_CONFIG
 
 def create_access_token(user_id: int) -> str:
     expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
@@ -19,17 +22,63 @@ def verify_token(token: str) -> Optional[int]:
     except jwt.InvalidTokenError:
         return None
 
+class PasswordHashBusy(Exception):
+    """Too many password hashes are already waiting for a worker"""
+
+_kdf_pool: Optional[ThreadPoolExecutor] = None
+_kdf_waiting = 0
+_dummy_hash: Optional[str] = None
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # maxmem leaves room above the 128 * n * r bytes scrypt needs
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20, dklen=32)
+
 def hash_password(password: str) -> str:
-    """Hash password with salt using SHA-256"""
-    salt = secrets.token_hex(16)
-    hash_obj = hashlib.sha256((salt + password).encode())
-    return f"{salt}${hash_obj.hexdigest()}"
+    """scrypt$n$r$p$salt$hash (CPU-heavy: call through run_kdf)"""
+    n, r, p = PASSWORD_HASH_CONFIG["n"], PASSWORD_HASH_CONFIG["r"], PASSWORD_HASH_CONFIG["p"]
+    salt = secrets.token_bytes(16)
+    return f"scrypt${n}${r}${p}${salt.hex()}${_scrypt(password, salt, n, r, p).hex()}"
 
 def verify_password(password: str, hashed: str) -> bool:
-    """Verify password against hashed value"""
+    """Verify password against a scrypt or legacy salted SHA-256 hash (CPU-heavy: call through run_kdf)"""
     try:
-        salt, hash_value = hashed.split('$')
-        hash_obj = hashlib.sha256((salt + password).encode())
-        return hash_obj.hexdigest() == hash_value
+        parts = hashed.split('$')
+        if parts[0] == "scrypt":
+            n, r, p, salt, hash_value = parts[1:]
+            computed = _scrypt(password, bytes.fromhex(salt), int(n), int(r), int(p)).hex()
+        else:
+            salt, hash_value = parts
+            computed = hashlib.sha256((salt + password).encode()).hexdigest()
+        return hmac.compare_digest(computed, hash_value)
     except:
         return False
+
+def needs_rehash(hashed: str) -> bool:
+    """True for legacy hashes and scrypt hashes with other cost parameters"""
+    config = PASSWORD_HASH_CONFIG
+    return not hashed.startswith(f"scrypt${config['n']}${config['r']}${config['p']}$")
+
+def verify_missing_user(password: str) -> bool:
+    """Same work as a real verification, so unknown emails can't be told apart by timing"""
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = hash_password(secrets.token_hex(16))
+    verify_password(password, _dummy_hash)
+    return False
+
+async def run_kdf(func, *args):
+    """
+    Run a password hash function on the bounded KDF pool, keeping the event
+    loop free for other requests; raises PasswordHashBusy when max_waiting
+    calls are already queued
+    """
+    global _kdf_pool, _kdf_waiting
+    if _kdf_waiting >= PASSWORD_HASH_CONFIG["max_waiting"]:
+        raise PasswordHashBusy(f"{_kdf_waiting} password checks queued")
+    if _kdf_pool is None:
+        _kdf_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_CONFIG["workers"], thread_name_prefix="kdf")
+    _kdf_waiting += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_kdf_pool, func, *args)
+    finally:
+        _kdf_waiting -= 1
@@ -0,0 +1,200 @@
+"""
+Text bundles: one text with its chapters, sentences, translations and
+analyses as NDJSON, for backups and moving a library between instances.
+
+    {"type": "bundle", "version": 1, ...}
+    {"type": "text", "title": ..., "scaffolding_data": ..., ...}
+    {"type": "chapter", "index": 0, "title": ..., "content": ...}
+    {"type": "sentence", "index": 0, "content": ..., "analysis_json": "...", ...}   (that chapter's sentences)
+    ...
+    {"type": "end", "chapters": N, "sentences": M}
+
+Stored JSON columns travel as strings, so neither side re-parses them.
+Export reads and import writes one chapter at a time through the storage
+backend, so memory stays flat whatever the book size. Bundles may be gzipped.
+"""
+
+import gzip
+import json
+import logging
+import time
+import zlib
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+VERSION = 1
+BATCH = 2000             # sentences per serialized export batch
+FLUSH_BYTES = 64 * 1024  # export output chunk size
+
+
+class BundleError(ValueError):
+    """The uploaded file is not a complete bundle"""
+
+
+def _dumps(record: dict) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def _sentence_lines(rows: List[dict]) -> bytes:
+    return b"".join(_dumps({
+        "type": "sentence", "index": r["sentence_index"], "content": r["content"],
+        "translation": r["translation"], "analysis_json": r["analysis_json"],
+        "vocab_json": r["vocab_json"], "vocab_max": r["vocab_max"],
+    }) for r in rows)
+
+
+async def _records(text_id: int, user_id: int) -> AsyncIterator[bytes]:
+    storage = get_storage()
+    t = await storage.get_text(text_id, user_id)
+    current_id = t["current_paragraph_id"]
+    current = (await storage.get_owned_sentences([current_id], user_id)).get(current_id) if current_id else None
+    yield _dumps({"type": "bundle", "version": VERSION, "exported_at": int(time.time())})
+    yield _dumps({
+        "type": "text",
+        "title": t["title"],
+        "reading_mode": t["reading_mode"],
+        "scaffold_level": t["scaffold_level"],
+        "vocab_level": t["vocab_level"],
+        "scaffolding_data": json.loads(t["scaffolding_data"]) if t["scaffolding_data"] else None,
+        "current_sentence": current["sentence_index"] if current else None,
+        "created_at": str(t["created_at"]),
+    })
+
+    chapters = sentences = 0
+    for info in await storage.list_chapters(text_id):
+        c = await storage.get_chapter(text_id, info["chapter_index"])
+        chapters += 1
+        yield _dumps({"type": "chapter", "index": c["chapter_index"], "title": c["title"], "content": c["content"]})
+        rows = await storage.list_sentences(text_id, c["chapter_index"])
+        sentences += len(rows)
+        for i in range(0, len(rows), BATCH):
+            yield await run_in_threadpool(_sentence_lines, rows[i:i + BATCH])
+    yield _dumps({"type": "end", "chapters": chapters, "sentences": sentences})
+
+
+async def export_bundle(text_id: int, user_id: int, compress: bool = False) -> AsyncIterator[bytes]:
+    """Bundle bytes in ~64 KiB chunks, gzipped if compress"""
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+    buf = []
+    size = 0
+    async for data in _records(text_id, user_id):
+        buf.append(data)
+        size += len(data)
+        if size >= FLUSH_BYTES:
+            out = b"".join(buf)
+            buf, size = [], 0
+            out = gz.compress(out) if gz else out
+            if out:
+                yield out
+    out = b"".join(buf)
+    yield gz.compress(out) + gz.flush() if gz else out
+
+
+def _lines(fileobj: BinaryIO) -> Iterator[dict]:
+    head = fileobj.read(2)
+    fileobj.seek(0)
+    stream = gzip.GzipFile(fileobj=fileobj) if head == b"\x1f\x8b" else fileobj
+    try:
+        for number, line in enumerate(stream, 1):
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    raise BundleError(f"Line {number} is not valid JSON")
+                if not isinstance(record, dict):
+                    raise BundleError(f"Line {number} is not a record")
+                yield record
+    except (OSError, EOFError) as e:  # truncated or corrupt gzip
+        raise BundleError(f"Cannot read bundle ({e})")
+
+
+def _field(record: dict, name: str, types, required: bool = False):
+    value = record.get(name)
+    if (value is None and required) or (value is not None and not isinstance(value, types)):
+        raise BundleError(f"Malformed {record.get('type')} record ({name})")
+    return value
+
+
+def _index(record: dict, last: int) -> int:
+    index = _field(record, "index", int, required=True)
+    if index <= last:
+        raise BundleError(f"{record['type'].capitalize()} records out of order")
+    return index
+
+
+def _chapters(records: Iterator[dict]) -> Iterator[Tuple[dict, List[dict]]]:
+    """
+    (chapter, sentences) per chapter record. The last chapter is only handed
+    over once the end record has confirmed the counts, so a truncated bundle
+    raises before the import can complete.
+    """
+    chapter = None
+    sentences = []
+    chapter_count = sentence_count = 0
+    last_chapter = last_sentence = -1
+    for r in records:
+        kind = r.get("type")
+        if kind == "sentence":
+            if chapter is None:
+                raise BundleError("Sentence before any chapter")
+            last_sentence = _index(r, last_sentence)
+            sentences.append({
+                "index": last_sentence,
+                "content": _field(r, "content", str, required=True),
+                "translation": _field(r, "translation", str),
+                "analysis_json": _field(r, "analysis_json", str),
+                "vocab_json": _field(r, "vocab_json", str),
+                "vocab_max": _field(r, "vocab_max", int),
+            })
+            sentence_count += 1
+        elif kind == "chapter":
+            if chapter is not None:
+                yield chapter, sentences
+            last_chapter = _index(r, last_chapter)
+            chapter = {"index": last_chapter, "title": _field(r, "title", str),
+                       "content": _field(r, "content", str) or ""}
+            sentences = []
+            chapter_count += 1
+        elif kind == "end":
+            if r.get("chapters") != chapter_count or r.get("sentences") != sentence_count:
+                break
+            if chapter is not None:
+                yield chapter, sentences
+            return
+    raise BundleError("Bundle is truncated")
+
+
+def _open(fileobj: BinaryIO, title: Optional[str]) -> Tuple[dict, Iterator[Tuple[dict, List[dict]]]]:
+    records = _lines(fileobj)
+    header = next(records, None)
+    if not header or header.get("type") != "bundle":
+        raise BundleError("Not a text bundle")
+    if header.get("version") != VERSION:
+        raise BundleError(f"Unsupported bundle version {header.get('version')}")
+    t = next(records, None)
+    if not t or t.get("type") != "text":
+        raise BundleError("Bundle has no text record")
+    text = {
+        "title": title or _field(t, "title", str) or "Untitled",
+        "scaffolding_data": json.dumps(t["scaffolding_data"]) if t.get("scaffolding_data") else None,
+        "reading_mode": _field(t, "reading_mode", str) or "flow",
+        "scaffold_level": _field(t, "scaffold_level", int) or 2,
+        "vocab_level": _field(t, "vocab_level", str) or "B1",
+        "current_sentence": _field(t, "current_sentence", int),
+    }
+    return text, _chapters(records)
+
+
+async def import_bundle(user_id: int, fileobj: BinaryIO, title: Optional[str] = None) -> int:
+    """Create a text from an uploaded bundle; returns the new text id"""
+    text, chapters = await run_in_threadpool(_open, fileobj, title)
+    # The storage reads the chapters lazily; a BundleError raised on the way
+    # leaves nothing of the text behind
+    text_id, chapter_count, sentence_count = await get_storage().restore_text(user_id, text, chapters)
+    logger.info(f"Imported bundle as text {text_id} ({chapter_count} chapters, {sentence_count} sentences)")
+    return text_id
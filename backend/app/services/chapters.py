@@ -0,0 +1,296 @@
+"""
+Chapter-chunked text storage.
+A book's content lives in `chapters` rows (contiguous slices of the original
+text, so joining them in order gives the text back exactly); `texts` only
+keeps metadata and a short preview. Chapters are detected from heading lines
+at ingest, and anything too long is split at paragraph breaks, so a request
+never needs more than one chapter in memory.
+"""
+
+import logging
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+from app import codec
+from app.config import CHAPTER_CONFIG
+from app.database import get_db
+from app.services.nlp import sentencize
+
+logger = logging.getLogger(__name__)
+
+_NUMBER = (r"(?:\d+|[ivxlcdm]+|one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|"
+           r"thirteen|fourteen|fifteen|sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty|"
+           r"the\s+\w+)")
+_heading_re = re.compile(
+    r"^[ \t]*(?:"
+    rf"(?:chapter|chap\.|book|part|volume|letter|act|stave)\s+{_NUMBER}\b[^\n]{{0,80}}"
+    r"|(?-i:[IVXLC]{1,7})\.?"                           # bare roman numeral line
+    r"|#{1,2}[ \t]+[^\n]{1,80}"                          # markdown heading
+    r"|第[0-9一二三四五六七八九十百千零〇两]+[章回节卷部篇][^\n]{0,40}"
+    r")[ \t]*$",
+    re.IGNORECASE | re.MULTILINE
+)
+_para_break_re = re.compile(r"\n[ \t]*\n")
+
+
+def _detect(content: str) -> List[Tuple[int, Optional[str]]]:
+    """Start offsets and titles of detected chapters (the first starts at 0)"""
+    starts = [(0, None)]
+    for m in _heading_re.finditer(content):
+        if m.start() == 0:
+            starts[0] = (0, m.group().strip())
+        else:
+            starts.append((m.start(), m.group().strip()))
+    return starts
+
+
+def is_heading(line: str) -> bool:
+    return _heading_re.match(line.strip()) is not None
+
+
+def _merge_short(spans: List[Tuple[int, int, Optional[str]]]) -> List[Tuple[int, int, Optional[str]]]:
+    # Contents pages and stray headings have no body: fold them into the next chapter
+    merged = []
+    carry = None
+    for start, end, title in spans:
+        if carry is not None:
+            start = carry
+            carry = None
+        if end - start < CHAPTER_CONFIG["min_chapter_chars"]:
+            carry = start
+            continue
+        merged.append((start, end, title))
+    if carry is not None:
+        if merged:
+            start, _, title = merged.pop()
+            merged.append((start, spans[-1][1], title))
+        else:
+            merged.append((carry, spans[-1][1], spans[-1][2]))
+    return merged
+
+
+def _split_long(content: str, start: int, end: int) -> Iterator[Tuple[int, int]]:
+    limit = CHAPTER_CONFIG["max_chapter_chars"]
+    while end - start > limit:
+        # Cut at the last paragraph break (else line break) before the limit
+        cut = -1
+        for m in _para_break_re.finditer(content, start + limit // 2, start + limit):
+            cut = m.end()
+        if cut == -1:
+            cut = content.rfind("\n", start + limit // 2, start + limit) + 1 or start + limit
+        yield start, cut
+        start = cut
+    yield start, end
+
+
+def split_chapters(content: str) -> List[Tuple[str, int, int]]:
+    """[(title, start, end)] covering content from 0 to len(content) with no gaps"""
+    if not content:
+        return [("Chapter 1", 0, 0)]
+    starts = _detect(content)
+    spans = [(s, e, t) for (s, t), (e, _) in zip(starts, starts[1:] + [(len(content), None)])]
+    chapters = []
+    for start, end, title in _merge_short(spans):
+        pieces = list(_split_long(content, start, end))
+        for i, (s, e) in enumerate(pieces):
+            if not title:
+                name = f"Part {len(chapters) + 1}"
+            else:
+                name = f"{title} ({i + 1})" if i > 0 else title
+            chapters.append((name, s, e))
+    return chapters
+
+
+def preview(content: str) -> str:
+    return content[:CHAPTER_CONFIG["preview_chars"]].strip()
+
+
+def chunk_chapters(pieces: Iterable[Tuple[Optional[str], str]]) -> Iterator[Tuple[str, str]]:
+    """
+    Streaming counterpart of split_chapters for (title, body) pieces read by
+    an importer: short pieces fold into the next one, long ones are split at
+    paragraph breaks, and consecutive pieces with the same title are numbered.
+    Holds at most one chapter back (to fold a short tail into it).
+    """
+    count = 0
+    last_title, part = None, 0
+    pending = None
+    carry = []
+
+    def named(title, body):
+        nonlocal count, last_title, part
+        for s, e in _split_long(body, 0, len(body)):
+            if not title:
+                name = f"Part {count + 1}"
+            else:
+                part = part + 1 if title == last_title else 1
+                name = f"{title} ({part})" if part > 1 else title
+            last_title = title
+            count += 1
+            yield name, body[s:e]
+
+    for title, body in pieces:
+        if carry:
+            body = "\n\n".join(carry + [body])
+            carry = []
+        if len(body) < CHAPTER_CONFIG["min_chapter_chars"]:
+            carry = [body]
+            continue
+        if pending is not None:
+            yield from named(*pending)
+        pending = (title, body)
+    if carry:
+        if pending is not None:
+            pending = (pending[0], pending[1] + "\n\n" + carry[0])
+        else:
+            pending = (None, carry[0])
+    if pending is not None:
+        yield from named(*pending)
+
+
+def chapter_sentences(body: str) -> List[str]:
+    sentences = sentencize(body)
+    if not sentences:
+        sentences = [p.strip() for p in re.split(r'\n+', body) if p.strip()]
+    return sentences
+
+
+def content_chapters(content: str) -> Iterator[Tuple[str, str]]:
+    """(title, body) chapters of a pasted text"""
+    return ((title, content[start:end]) for title, start, end in split_chapters(content))
+
+
+def store_chapters(cursor, text_id: int, chapters: Iterable[Tuple[str, str]], commit: bool = False) -> int:
+    """
+    Write (title, body) chapters and their sentences for a text, one chapter
+    in memory at a time (existing rows must already be deleted), and update
+    the text's chapter metadata. Returns the sentence count. With commit,
+    each chapter is committed once written, so the write lock is only held
+    while inserting, not while the next chapter is parsed and split.
+    """
+    sentence_index = 0
+    chapter_count = 0
+    char_count = 0
+    head = ""
+    for chapter_index, (title, body) in enumerate(chapters):
+        sentences = chapter_sentences(body)
+        cursor.execute('''
+            INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, sentence_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (text_id, chapter_index, title, codec.encode(body, codec.KIND_CONTENT), len(body),
+              sentence_index, len(sentences)))
+        chapter_id = cursor.lastrowid
+        cursor.executemany(
+            "INSERT INTO sentences (text_id, chapter_id, sentence_index, content) VALUES (?, ?, ?, ?)",
+            [(text_id, chapter_id, sentence_index + i, s) for i, s in enumerate(sentences)]
+        )
+        if commit:
+            cursor.connection.commit()
+        sentence_index += len(sentences)
+        chapter_count += 1
+        char_count += len(body)
+        if len(head) < CHAPTER_CONFIG["preview_chars"]:
+            head += body[:CHAPTER_CONFIG["preview_chars"]]
+    if not chapter_count:
+        return store_chapters(cursor, text_id, [("Chapter 1", "")], commit)
+    cursor.execute(
+        "UPDATE texts SET content = '', preview = ?, char_count = ?, chapter_count = ? WHERE id = ?",
+        (preview(head), char_count, chapter_count, text_id)
+    )
+    logger.info(f"Stored text {text_id} as {chapter_count} chapters, {sentence_index} sentences")
+    return sentence_index
+
+
+def replace_chapters(cursor, text_id: int, chapters: Iterable[Tuple[str, str]]) -> int:
+    cursor.execute("DELETE FROM sentences WHERE text_id = ?", (text_id,))
+    cursor.execute("DELETE FROM chapters WHERE text_id = ?", (text_id,))
+    return store_chapters(cursor, text_id, chapters)
+
+
+def iter_content(text_id: int) -> Iterator[str]:
+    """The full text, one chapter at a time"""
+    last_index = -1
+    while True:
+        with get_db() as conn:
+            row = conn.execute('''
+                SELECT chapter_index, content FROM chapters
+                WHERE text_id = ? AND chapter_index > ?
+                ORDER BY chapter_index LIMIT 1
+            ''', (text_id, last_index)).fetchone()
+        if row is None:
+            return
+        last_index = row["chapter_index"]
+        yield codec.decode(row["content"])
+
+
+def chapter_of_sentence(cursor, sentence_id: Optional[int]) -> Optional[int]:
+    if sentence_id is None:
+        return None
+    cursor.execute('''
+        SELECT c.chapter_index FROM sentences s JOIN chapters c ON c.id = s.chapter_id
+        WHERE s.id = ?
+    ''', (sentence_id,))
+    row = cursor.fetchone()
+    return row["chapter_index"] if row else None
+
+
+def discard_interrupted_imports() -> int:
+    """Delete texts whose import never finished (server killed mid-import); returns how many"""
+    with get_db() as conn:
+        # Cascades to the chapters and sentences committed so far
+        count = conn.execute("DELETE FROM texts WHERE importing").rowcount
+    if count:
+        logger.warning(f"Discarded {count} interrupted imports")
+    return count
+
+
+def migrate_legacy_texts():
+    """
+    Move texts stored in texts.content into chapter rows, one text per
+    transaction. Existing sentences keep their ids (and analyses) and are
+    attached to the chapter their content falls in.
+    """
+    with get_db() as conn:
+        pending = [r["id"] for r in conn.execute("SELECT id FROM texts WHERE chapter_count IS NULL AND NOT importing")]
+    for text_id in pending:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            if cursor.execute("SELECT 1 FROM chapters WHERE text_id = ? LIMIT 1", (text_id,)).fetchone():
+                # Not a legacy text: a partial import from before the importing flag
+                logger.warning(f"Text {text_id} has chapters but no chapter_count; not migrating it")
+                continue
+            content = cursor.execute("SELECT content FROM texts WHERE id = ?", (text_id,)).fetchone()["content"]
+            chapters = split_chapters(content)
+            chapter_ids = []
+            for chapter_index, (title, start, end) in enumerate(chapters):
+                cursor.execute('''
+                    INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, sentence_count)
+                    VALUES (?, ?, ?, ?, ?, 0, 0)
+                ''', (text_id, chapter_index, title, codec.encode(content[start:end], codec.KIND_CONTENT),
+                      end - start))
+                chapter_ids.append(cursor.lastrowid)
+
+            # Locate each sentence in the original text to find its chapter
+            updates = []
+            pos, chapter = 0, 0
+            for r in cursor.execute(
+                "SELECT id, content FROM sentences WHERE text_id = ? ORDER BY sentence_index", (text_id,)
+            ).fetchall():
+                found = content.find(r["content"], pos)
+                if found != -1:
+                    pos = found + len(r["content"])
+                    while chapter + 1 < len(chapters) and chapters[chapter + 1][1] <= found:
+                        chapter += 1
+                updates.append((chapter_ids[chapter], r["id"]))
+            cursor.executemany("UPDATE sentences SET chapter_id = ? WHERE id = ?", updates)
+            cursor.execute('''
+                UPDATE chapters SET
+                    sentence_start = COALESCE((SELECT MIN(sentence_index) FROM sentences WHERE chapter_id = chapters.id), 0),
+                    sentence_count = (SELECT COUNT(*) FROM sentences WHERE chapter_id = chapters.id)
+                WHERE text_id = ?
+            ''', (text_id,))
+            cursor.execute(
+                "UPDATE texts SET content = '', preview = ?, char_count = ?, chapter_count = ? WHERE id = ?",
+                (preview(content), len(content), len(chapters), text_id)
+            )
+        logger.info(f"Migrated text {text_id} into {len(chapters)} chapters")
@@ -0,0 +1,187 @@
+"""
+Built frontend (src-react/dist) as a table of servable files.
+Compressible files get .br and .gz siblings, written at build time with
+
+    cd backend
+    python -m app.services.frontend compress [DIST_DIR]
+
+or at startup for any that are missing or older than their source (brotli
+needs the optional brotli package; gzip always works). The directory is
+scanned once: every file gets its content type, a strong ETag per encoding
+and its caching policy (content-hashed files under assets/ never change, so
+they are immutable; everything else, index.html included, is revalidated
+with its ETag). Small files are kept in memory; larger ones are sent from
+disk. Requests only ever look paths up in this table, so nothing outside
+dist can be reached.
+"""
+
+import argparse
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from typing import Dict, Optional
+
+from app.config import FRONTEND_CONFIG
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE = {".html", ".js", ".mjs", ".css", ".json", ".map", ".svg", ".txt", ".xml", ".webmanifest", ".wasm"}
+# Sidecar suffix -> Content-Encoding, in order of preference
+ENCODINGS = {".br": "br", ".gz": "gzip"}
+# Vite output names: assets/index-CnG8ZC6M.js
+_hashed_re = re.compile(r"^assets/(?:.+/)?[^/]+-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+
+_files: Dict[str, "Asset"] = {}
+
+
+class Variant:
+    """One encoding of a file"""
+    __slots__ = ("path", "size", "etag", "encoding", "data")
+
+    def __init__(self, path: str, encoding: Optional[str], data: Optional[bytes], size: int, digest: str):
+        self.path = path
+        self.size = size
+        self.encoding = encoding
+        self.etag = f'"{digest}"'
+        self.data = data  # None: read from path
+
+
+class Asset:
+    __slots__ = ("content_type", "immutable", "variants")
+
+    def __init__(self, content_type: str, immutable: bool):
+        self.content_type = content_type
+        self.immutable = immutable
+        self.variants: Dict[Optional[str], Variant] = {}  # encoding (None: identity) -> variant
+
+    @property
+    def identity(self) -> Variant:
+        return self.variants[None]
+
+
+def _compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_dir(dist_dir: str) -> int:
+    """Write .br/.gz siblings that are missing or stale; returns files written"""
+    written = 0
+    for root, _, names in os.walk(dist_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            if os.path.splitext(name)[1] not in COMPRESSIBLE:
+                continue
+            size = os.path.getsize(path)
+            if size < FRONTEND_CONFIG["min_compress_bytes"]:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for suffix, encoding in ENCODINGS.items():
+                target = path + suffix
+                if encoding == "br" and brotli is None:
+                    continue
+                if os.path.exists(target) and os.path.getmtime(target) >= mtime:
+                    continue
+                if data is None:
+                    with open(path, "rb") as f:
+                        data = f.read()
+                packed = _compress(data, encoding)
+                if len(packed) >= size:
+                    continue  # not worth it; _load ignores larger siblings anyway
+                with open(target + ".tmp", "wb") as f:
+                    f.write(packed)
+                os.replace(target + ".tmp", target)
+                written += 1
+    return written
+
+
+def _variant(path: str, encoding: Optional[str]) -> Variant:
+    size = os.path.getsize(path)
+    digest = hashlib.sha1()
+    keep = size <= FRONTEND_CONFIG["memory_max_bytes"]
+    chunks = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(FRONTEND_CONFIG["chunk_bytes"])
+            if not chunk:
+                break
+            digest.update(chunk)
+            if keep:
+                chunks.append(chunk)
+    suffix = f"-{encoding}" if encoding else ""
+    return Variant(path, encoding, b"".join(chunks) if keep else None, size, digest.hexdigest()[:20] + suffix)
+
+
+def _load(dist_dir: str) -> Dict[str, Asset]:
+    files = {}
+    for root, _, names in os.walk(dist_dir):
+        for name in names:
+            base, suffix = os.path.splitext(name)
+            if suffix in ENCODINGS and base in names or name.endswith(".tmp"):
+                continue  # a sibling, attached to its source below
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, dist_dir).replace(os.sep, "/")
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type in ("application/javascript", "image/svg+xml"):
+                content_type += "; charset=utf-8"
+            asset = Asset(content_type, _hashed_re.match(rel) is not None)
+            asset.variants[None] = _variant(path, None)
+            mtime = os.path.getmtime(path)
+            for sibling_suffix, encoding in ENCODINGS.items():
+                sibling = path + sibling_suffix
+                if (os.path.exists(sibling) and os.path.getmtime(sibling) >= mtime
+                        and os.path.getsize(sibling) < asset.identity.size):
+                    asset.variants[encoding] = _variant(sibling, encoding)
+            files[rel] = asset
+    return files
+
+
+def load() -> bool:
+    """Scan the dist directory (compressing first if configured); False if there is no build"""
+    global _files
+    dist_dir = FRONTEND_CONFIG["dist_dir"]
+    if not os.path.isfile(os.path.join(dist_dir, "index.html")):
+        logger.warning(f"No frontend build at {dist_dir}; run `npm run build` in src-react")
+        _files = {}
+        return False
+    if FRONTEND_CONFIG["precompress"]:
+        try:
+            written = compress_dir(dist_dir)
+            if written:
+                logger.info(f"Precompressed {written} frontend files")
+        except OSError as e:
+            logger.warning(f"Could not precompress {dist_dir}: {e}")
+    _files = _load(dist_dir)
+    in_memory = sum(v.size for a in _files.values() for v in a.variants.values() if v.data is not None)
+    logger.info(f"Serving frontend from {dist_dir}: {len(_files)} files, {in_memory / 2**10:.0f} KiB in memory"
+                + ("" if brotli else " (no brotli module, gzip only)"))
+    return True
+
+
+def lookup(path: str) -> Optional[Asset]:
+    """The file for a URL path; extensionless paths are client-side routes and get index.html"""
+    path = path.strip("/")
+    asset = _files.get(path or "index.html")
+    if asset is None and "." not in path.rsplit("/", 1)[-1]:
+        asset = _files.get("index.html")
+    return asset
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Frontend build tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    c = sub.add_parser("compress", help="write .br/.gz next to compressible files of a build")
+    c.add_argument("dist_dir", nargs="?", default=FRONTEND_CONFIG["dist_dir"])
+    args = parser.parse_args()
+    print(f"Wrote {compress_dir(args.dist_dir)} compressed files"
+          + ("" if brotli else " (gzip only: pip install brotli for .br)"))
@@ -0,0 +1,297 @@
+"""
+Streaming book importers.
+EPUB files are read one spine document at a time straight from the zip, with
+chapter titles taken from the table of contents (EPUB 3 nav or EPUB 2 NCX);
+TXT files are decoded incrementally and cut at heading lines. Either way the
+pieces go through chunk_chapters into the storage backend, so memory stays
+around one chapter whatever the file size.
+"""
+
+import codecs
+import logging
+import os
+import posixpath
+import re
+import zipfile
+import zlib
+import xml.etree.ElementTree as ET
+from html.parser import HTMLParser
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import unquote
+
+from app.config import CHAPTER_CONFIG, IMPORT_CONFIG
+from app.services.chapters import chunk_chapters, is_heading
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 64 * 1024
+
+NS = {
+    "container": "urn:oasis:names:tc:opendocument:xmlns:container",
+    "opf": "http://www.idpf.org/2007/opf",
+    "dc": "http://purl.org/dc/elements/1.1/",
+    "ncx": "http://www.daisy.org/z3986/2005/ncx/",
+    "xhtml": "http://www.w3.org/1999/xhtml",
+    "epub": "http://www.idpf.org/2007/ops",
+}
+
+_space_re = re.compile(r"[ \t\r\f\v ]+")
+# Raised by zipfile reading a damaged, encrypted or unsupported member
+ZIP_ERRORS = (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError)
+
+
+class BookImportError(ValueError):
+    """The uploaded file cannot be read as a book"""
+
+
+class _TextExtractor(HTMLParser):
+    """XHTML -> plain text with blank lines between blocks (fed incrementally)"""
+
+    BLOCKS = {"p", "div", "section", "article", "blockquote", "li", "tr", "pre", "figcaption",
+              "h1", "h2", "h3", "h4", "h5", "h6", "dt", "dd", "hr", "table", "ul", "ol"}
+    SKIP = {"head", "script", "style", "title", "svg"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.paragraphs: List[str] = []
+        self._current: List[str] = []
+        self._skip = 0
+
+    def _end_block(self):
+        lines = (_space_re.sub(" ", line).strip() for line in "".join(self._current).split("\n"))
+        text = "\n".join(line for line in lines if line)
+        if text:
+            self.paragraphs.append(text)
+        self._current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip += 1
+        elif tag in self.BLOCKS:
+            self._end_block()
+        elif tag == "br":
+            self._current.append("\n")
+
+    def handle_startendtag(self, tag, attrs):
+        if tag == "br":
+            self._current.append("\n")
+        elif tag in self.BLOCKS:
+            self._end_block()
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip = max(0, self._skip - 1)
+        elif tag in self.BLOCKS:
+            self._end_block()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._current.append(data.replace("\n", " "))
+
+    def text(self) -> str:
+        self.close()
+        self._end_block()
+        return "\n\n".join(self.paragraphs)
+
+
+class EpubBook:
+    def __init__(self, fileobj: BinaryIO):
+        try:
+            self.zip = zipfile.ZipFile(fileobj)
+            container = ET.fromstring(self.zip.read("META-INF/container.xml"))
+            rootfile = container.find(".//container:rootfile", NS)
+            self.opf_path = rootfile.get("full-path")
+            opf = ET.fromstring(self.zip.read(self.opf_path))
+        except (*ZIP_ERRORS, KeyError, AttributeError, ET.ParseError) as e:
+            raise BookImportError(f"Not a valid EPUB file ({e})")
+
+        base = posixpath.dirname(self.opf_path)
+        title = opf.find(".//dc:title", NS)
+        self.title = title.text.strip() if title is not None and title.text else None
+
+        manifest = {}  # id -> (path, media type, properties)
+        for item in opf.iterfind(".//opf:manifest/opf:item", NS):
+            if not item.get("href"):
+                raise BookImportError(f"Not a valid EPUB file (manifest item {item.get('id')} has no href)")
+            manifest[item.get("id")] = (self._resolve(base, item.get("href")), item.get("media-type"),
+                                        item.get("properties") or "")
+        spine = opf.find(".//opf:spine", NS)
+        if spine is None:
+            raise BookImportError("EPUB has no spine")
+        self.spine = [manifest[ref.get("idref")][0] for ref in spine.iterfind("opf:itemref", NS)
+                      if ref.get("idref") in manifest and ref.get("linear", "yes") != "no"]
+
+        self.toc: Dict[str, str] = {}
+        nav = next((path for path, _, props in manifest.values() if "nav" in props.split()), None)
+        ncx = manifest.get(spine.get("toc") or "", (None,))[0]
+        if nav:
+            self._read_nav(nav)
+        if not self.toc and ncx:
+            self._read_ncx(ncx)
+
+    @staticmethod
+    def _resolve(base: str, href: str) -> str:
+        return posixpath.normpath(posixpath.join(base, unquote(href.split("#")[0])))
+
+    def _add_toc(self, base: str, href: Optional[str], label: str):
+        label = _space_re.sub(" ", label or "").strip()
+        if href and label:
+            # The first entry pointing into a document names it
+            self.toc.setdefault(self._resolve(base, href), label)
+
+    def _read_nav(self, path: str):
+        try:
+            root = ET.fromstring(self.zip.read(path))
+        except (*ZIP_ERRORS, KeyError, ET.ParseError):
+            return  # no titles; the text is still readable
+        base = posixpath.dirname(path)
+        navs = root.iter(f"{{{NS['xhtml']}}}nav")
+        toc = next((n for n in navs if n.get(f"{{{NS['epub']}}}type") == "toc"), None)
+        for a in (toc if toc is not None else root).iter(f"{{{NS['xhtml']}}}a"):
+            self._add_toc(base, a.get("href"), "".join(a.itertext()))
+
+    def _read_ncx(self, path: str):
+        try:
+            root = ET.fromstring(self.zip.read(path))
+        except (*ZIP_ERRORS, KeyError, ET.ParseError):
+            return
+        base = posixpath.dirname(path)
+        for point in root.iter(f"{{{NS['ncx']}}}navPoint"):
+            label = point.find("ncx:navLabel/ncx:text", NS)
+            content = point.find("ncx:content", NS)
+            if label is not None and content is not None:
+                self._add_toc(base, content.get("src"), label.text)
+
+    def _document_text(self, path: str) -> str:
+        if self.zip.getinfo(path).file_size > IMPORT_CONFIG["max_document_mb"] * 2 ** 20:
+            raise BookImportError(f"EPUB document too large: {path}")
+        parser = _TextExtractor()
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        with self.zip.open(path) as f:
+            while True:
+                chunk = f.read(READ_CHUNK)
+                if not chunk:
+                    break
+                parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b"", final=True))
+        return parser.text()
+
+    def chapters(self) -> Iterator[Tuple[Optional[str], str]]:
+        """(title, text) per spine document; untitled documents continue the previous chapter"""
+        title = None
+        for path in self.spine:
+            try:
+                text = self._document_text(path)
+            except KeyError:
+                logger.warning(f"EPUB spine item missing: {path}")
+                continue
+            except ZIP_ERRORS as e:
+                raise BookImportError(f"Corrupt EPUB file: can't read {path} ({e})")
+            title = self.toc.get(path, title)
+            if text:
+                yield title, text
+
+
+def _sniff_encoding(fileobj: BinaryIO) -> str:
+    head = fileobj.read(READ_CHUNK)
+    fileobj.seek(0)
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    for encoding in ("utf-8", "gb18030"):
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(head, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin-1"
+
+
+def _lines(fileobj: BinaryIO, encoding: str) -> Iterator[str]:
+    """Decoded lines with normalized line endings, read a chunk at a time"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    pending = ""
+    while True:
+        chunk = fileobj.read(READ_CHUNK)
+        text = pending + decoder.decode(chunk, final=not chunk)
+        if chunk and text.endswith("\r"):
+            text, pending = text[:-1], "\r"  # may be half of a \r\n
+        else:
+            pending = ""
+        lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+        if not chunk:
+            if lines[-1]:
+                yield lines[-1]
+            return
+        pending = lines.pop() + pending
+        for line in lines:
+            yield line + "\n"
+
+
+def txt_chapters(fileobj: BinaryIO) -> Iterator[Tuple[Optional[str], str]]:
+    """
+    (title, text) pieces of a plain-text book, cut at heading lines. Text
+    without headings is flushed at a paragraph break once it reaches the
+    chapter size limit, so nothing larger than about one chapter is buffered.
+    """
+    limit = CHAPTER_CONFIG["max_chapter_chars"]
+    title, buf, size = None, [], 0
+    cut = None  # index in buf of the last paragraph break past half the limit
+    for line in _lines(fileobj, _sniff_encoding(fileobj)):
+        heading = is_heading(line)
+        if heading and size:
+            text = "".join(buf).strip("\n")
+            if text.strip():
+                yield title, text
+            buf, size, cut = [], 0, None
+        elif size + len(line) > limit:
+            # Same cut as chapters._split_long: the chapter continues in the next piece
+            head, buf = buf[:cut or len(buf)], buf[cut or len(buf):]
+            yield title, "".join(head).strip("\n")
+            size, cut = sum(len(l) for l in buf), None
+        if heading and not size:
+            title = line.strip()
+        if not line.strip() and size >= limit // 2:
+            cut = len(buf)
+        buf.append(line)
+        size += len(line)
+    text = "".join(buf).strip("\n")
+    if text.strip():
+        yield title, text
+
+
+def open_book(filename: str, fileobj: BinaryIO, title: Optional[str] = None) -> Tuple[str, Iterator[Tuple[str, str]]]:
+    """
+    Title and lazily read (title, body) chapters of an uploaded .epub or .txt
+    file. Limits are enforced while the chapters are read, so the storage
+    backend consuming them discards the partial text on BookImportError.
+    """
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".epub":
+        book = EpubBook(fileobj)
+        title = title or book.title
+        pieces = book.chapters()
+    elif ext == ".txt":
+        pieces = txt_chapters(fileobj)
+    else:
+        raise BookImportError("Only .epub and .txt files can be imported")
+    title = title or os.path.splitext(os.path.basename(filename))[0] or "Untitled"
+
+    def limited(pieces):
+        total = 0
+        for piece in pieces:
+            total += len(piece[1])
+            if total > IMPORT_CONFIG["max_chars"]:
+                raise BookImportError(f"Book is longer than {IMPORT_CONFIG['max_chars']:,} characters")
+            yield piece
+
+    def non_empty(chapters):
+        found = False
+        for chapter in chapters:
+            found = found or bool(chapter[1].strip())
+            yield chapter
+        if not found:
+            raise BookImportError("No text found in file")
+
+    return title, non_empty(chunk_chapters(limited(pieces)))
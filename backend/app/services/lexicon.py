@@ -0,0 +1,247 @@
+"""
+Offline CEFR lexicon and vocabulary pre-annotation.
+The lexicon is three parallel arrays in app/data/lexicon: sorted 64-bit word
+hashes, CEFR levels (1-6 = A1-C2) and Zipf frequencies (x10). They are
+memory-mapped, so a lookup is one numpy searchsorted over every distinct
+word of a book. annotate() marks each sentence's vocabulary candidates at
+import, which lets analysis ask the LLM to explain pre-selected words only.
+
+Rebuild the data with:
+    python -m app.services.lexicon build [--wordlist cefr.tsv] [--size 40000]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.config import LEXICON_CONFIG
+from app.services.nlp import tokenize_batch
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+LEVELS = ["A1", "A2", "B1", "B2", "C1", "C2"]
+NOT_FOUND = 7
+ANNOTATE_BATCH = 2000  # sentences per UPDATE round
+
+# Frequency fallback for words without a CEFR label: (min Zipf, level)
+ZIPF_LEVELS = [(5.5, 1), (4.8, 2), (4.2, 3), (3.7, 4), (3.0, 5)]
+
+_keys: Optional[np.ndarray] = None
+_levels: Optional[np.ndarray] = None
+_zipf: Optional[np.ndarray] = None
+
+
+def level_number(level: Optional[str]) -> int:
+    """'A1'..'C2' -> 1..6 (B1 when unknown, the texts default)"""
+    try:
+        return LEVELS.index((level or "B1").upper()) + 1
+    except ValueError:
+        return 3
+
+
+def word_key(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+
+
+def _paths() -> Tuple[str, str, str]:
+    base = LEXICON_CONFIG["data_dir"]
+    return (os.path.join(base, "keys.npy"), os.path.join(base, "levels.npy"),
+            os.path.join(base, "zipf.npy"))
+
+
+def load() -> bool:
+    """Map the lexicon arrays; returns False when the data is missing"""
+    global _keys, _levels, _zipf
+    if _keys is not None:
+        return True
+    keys_path, levels_path, zipf_path = _paths()
+    if not LEXICON_CONFIG["enabled"] or not os.path.exists(keys_path):
+        return False
+    _keys = np.load(keys_path, mmap_mode="r")
+    _levels = np.load(levels_path, mmap_mode="r")
+    _zipf = np.load(zipf_path, mmap_mode="r")
+    logger.info(f"Loaded CEFR lexicon with {len(_keys)} words")
+    return True
+
+
+def _lemma_candidates(word: str) -> List[str]:
+    """Cheap inflection stripping for when spaCy has no lemma tables"""
+    cands = []
+    for suffix, repl in (("ies", "y"), ("ied", "y"), ("es", ""), ("s", ""), ("ed", ""),
+                         ("ed", "e"), ("ing", ""), ("ing", "e"), ("er", ""), ("est", ""), ("ly", "")):
+        if word.endswith(suffix) and len(word) - len(suffix) + len(repl) >= 3:
+            stem = word[:-len(suffix)] + repl
+            cands.append(stem)
+            if not repl and len(stem) > 3 and stem[-1] == stem[-2]:
+                cands.append(stem[:-1])  # running -> run
+    return cands
+
+
+def lookup(words: List[List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (level, zipf x10) of the easiest known form of each word, with level
+    NOT_FOUND and zipf 0 for unknown words. All forms are resolved with one
+    vectorized searchsorted.
+    """
+    if not words or not load():
+        return np.full(len(words), NOT_FOUND, dtype=np.uint8), np.zeros(len(words), dtype=np.uint8)
+    width = max(len(forms) for forms in words)
+    hashes = np.zeros((len(words), width), dtype=np.uint64)
+    valid = np.zeros((len(words), width), dtype=bool)
+    for row, forms in enumerate(words):
+        hashes[row, :len(forms)] = [word_key(f) for f in forms]
+        valid[row, :len(forms)] = True
+    pos = np.searchsorted(_keys, hashes.ravel()).reshape(hashes.shape)
+    pos = np.minimum(pos, len(_keys) - 1)
+    found = valid & (_keys[pos] == hashes)
+    levels = np.where(found, _levels[pos], NOT_FOUND)
+    best = levels.argmin(axis=1)
+    rows = np.arange(len(words))
+    zipf = np.where(found[rows, best], _zipf[pos[rows, best]], 0)
+    return levels[rows, best].astype(np.uint8), zipf.astype(np.uint8)
+
+
+def annotate(sentences: List[str]) -> List[Tuple[List[dict], int]]:
+    """
+    Vocabulary candidates per sentence: ([{"word", "lemma", "diff", "zipf"}], max diff).
+    Words below min_level, capitalised words inside a sentence (names) and
+    capitalised unknowns are left out.
+    """
+    tokenized = tokenize_batch(sentences)
+
+    # Resolve each distinct (surface, lemma) pair once for the whole batch
+    index: Dict[Tuple[str, str], int] = {}
+    forms = []
+    flat_sent, flat_word, flat_name = [], [], []
+    for s, tokens in enumerate(tokenized):
+        for surface, lemma, is_first in tokens:
+            flat_name.append(not is_first and surface[:1].isupper())
+            pair = (surface, lemma)
+            idx = index.get(pair)
+            if idx is None:
+                idx = index[pair] = len(forms)
+                lower = surface.lower()
+                forms.append(list(dict.fromkeys([lower, lemma, *_lemma_candidates(lower)])))
+            flat_sent.append(s)
+            flat_word.append(idx)
+
+    result = [([], 0) for _ in sentences]
+    if not flat_word:
+        return result
+
+    pairs = list(index)
+    word_levels, word_zipf = lookup(forms)
+    word_levels = word_levels.astype(np.int16)
+    proper = np.fromiter((p[0][:1].isupper() for p in pairs), dtype=bool, count=len(pairs))
+    unknown = word_levels == NOT_FOUND
+    word_levels[unknown] = LEXICON_CONFIG["unknown_level"]
+    keep_word = (word_levels >= LEXICON_CONFIG["min_level"]) & ~(unknown & proper)
+
+    flat_sent = np.asarray(flat_sent)
+    flat_word = np.asarray(flat_word)
+    levels = word_levels[flat_word]
+    keep = keep_word[flat_word] & ~np.asarray(flat_name)
+    max_diff = np.zeros(len(sentences), dtype=np.int16)
+    np.maximum.at(max_diff, flat_sent[keep], levels[keep])
+
+    vocab: List[Dict[str, dict]] = [{} for _ in sentences]
+    for s, w, lvl in zip(flat_sent[keep].tolist(), flat_word[keep].tolist(), levels[keep].tolist()):
+        surface, lemma = pairs[w]
+        vocab[s].setdefault(lemma, {"word": surface, "lemma": lemma, "diff": lvl, "zipf": float(word_zipf[w]) / 10})
+    # Rarest words first, so prompts and UIs can cut the list short
+    return [(sorted(v.values(), key=lambda e: e["zipf"]), int(m)) for v, m in zip(vocab, max_diff)]
+
+
+async def annotate_text(text_id: int) -> int:
+    """Store vocabulary candidates for every sentence of a text; returns rows annotated"""
+    if not await run_in_threadpool(load):
+        return 0
+    storage = get_storage()
+    total = 0
+    async for rows in storage.sentence_batches(text_id, ANNOTATE_BATCH):
+        annotated = await run_in_threadpool(annotate, [r["content"] for r in rows])
+        await storage.set_vocab([(r["id"], json.dumps(words, ensure_ascii=False), max_diff)
+                                 for r, (words, max_diff) in zip(rows, annotated)])
+        total += len(rows)
+    logger.info(f"Annotated vocabulary for {total} sentences of text {text_id}")
+    return total
+
+
+def candidates_for(vocab_json: Optional[str], vocab_level: Optional[str]) -> Optional[List[dict]]:
+    """
+    Pre-selected words above the reader's level, or None when the
+    sentence was never annotated (the LLM then picks vocabulary itself).
+    """
+    if vocab_json is None:
+        return None
+    threshold = level_number(vocab_level)
+    try:
+        words = json.loads(vocab_json)
+    except json.JSONDecodeError:
+        return None
+    return [{"word": w["word"], "diff": w["diff"]} for w in words if w["diff"] > threshold]
+
+
+def build(size: int, wordlist: Optional[str] = None):
+    """
+    Build the lexicon from wordfreq's English list (only needed at build time),
+    overriding levels with an optional "word<TAB>CEFR" list such as CEFR-J or
+    the Oxford 5000.
+    """
+    from wordfreq import top_n_list, zipf_frequency
+
+    entries: Dict[str, Tuple[int, float]] = {}
+    for word in top_n_list("en", size):
+        if not word.isalpha():
+            continue
+        zipf = zipf_frequency(word, "en")
+        level = next((lvl for min_zipf, lvl in ZIPF_LEVELS if zipf >= min_zipf), 6)
+        entries[word] = (level, zipf)
+
+    if wordlist:
+        labelled: Dict[str, int] = {}
+        with open(wordlist, encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 2 or parts[1].strip().upper() not in LEVELS:
+                    continue
+                word = parts[0].strip().lower()
+                level = LEVELS.index(parts[1].strip().upper()) + 1
+                # A word listed at several levels keeps its easiest sense
+                labelled[word] = min(level, labelled.get(word, level))
+        for word, level in labelled.items():
+            zipf = entries[word][1] if word in entries else zipf_frequency(word, "en")
+            entries[word] = (level, zipf)
+
+    keys = np.fromiter((word_key(w) for w in entries), dtype=np.uint64, count=len(entries))
+    levels = np.fromiter((v[0] for v in entries.values()), dtype=np.uint8, count=len(entries))
+    zipf = np.fromiter((min(255, round(v[1] * 10)) for v in entries.values()), dtype=np.uint8, count=len(entries))
+    order = np.argsort(keys)
+    if np.any(np.diff(keys[order]) == 0):
+        raise ValueError("Hash collision in lexicon keys")
+
+    keys_path, levels_path, zipf_path = _paths()
+    os.makedirs(os.path.dirname(keys_path), exist_ok=True)
+    np.save(keys_path, keys[order])
+    np.save(levels_path, levels[order])
+    np.save(zipf_path, zipf[order])
+    counts = np.bincount(levels, minlength=7)[1:]
+    print(f"Wrote {len(keys)} words to {os.path.dirname(keys_path)}: "
+          + ", ".join(f"{name}={n}" for name, n in zip(LEVELS, counts)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CEFR lexicon tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="rebuild app/data/lexicon")
+    b.add_argument("--size", type=int, default=40000, help="most frequent words to include")
+    b.add_argument("--wordlist", help="optional word<TAB>CEFR list overriding frequency levels")
+    args = parser.parse_args()
+    build(args.size, args.wordlist)
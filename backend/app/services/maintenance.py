@@ -0,0 +1,297 @@
+"""
+Database maintenance.
+Foreign keys are enforced on every connection (see get_db_connection), so
+deleting a text cascades to its chapters, sentences and translation memory
+signatures. This module cleans up what was orphaned before that, reclaims
+freed pages with incremental vacuum in small steps instead of a full VACUUM,
+keeps planner statistics fresh, and reports size and fragmentation:
+
+    python -m app.services.maintenance report
+"""
+
+import argparse
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+from app import database
+from app.config import MAINTENANCE_CONFIG
+from app.database import get_db
+
+logger = logging.getLogger(__name__)
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+# (table, key column, parent check) for tables whose parent row may be gone
+ORPHANS = [
+    ("texts", "id", "NOT EXISTS (SELECT 1 FROM users p WHERE p.id = o.user_id)"),
+    ("chapters", "id", "NOT EXISTS (SELECT 1 FROM texts p WHERE p.id = o.text_id)"),
+    ("sentences", "id", "NOT EXISTS (SELECT 1 FROM texts p WHERE p.id = o.text_id)"),
+    ("tm_signatures", "sentence_id", "NOT EXISTS (SELECT 1 FROM sentences p WHERE p.id = o.sentence_id)"),
+]
+BAND_SWEEP_ROWS = 50000  # tm_bands rows checked per pass
+
+_wake = threading.Event()
+_thread: Optional[threading.Thread] = None
+_band_cursor = (None, None)  # (band_key, sentence_id) where the tm_bands sweep resumes
+_last_optimize = 0.0
+_incremental = False  # auto_vacuum is INCREMENTAL (checked until it is)
+_warned = False
+
+
+def _autocommit_connection() -> sqlite3.Connection:
+    # VACUUM and incremental_vacuum cannot run inside a transaction
+    conn = database.get_db_connection()
+    conn.isolation_level = None
+    return conn
+
+
+def _pragma(conn, name: str) -> int:
+    return conn.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+def delete_orphans(table: str, key: str, condition: str) -> int:
+    """Delete rows whose parent is gone, a batch per transaction; returns rows deleted"""
+    total = 0
+    while True:
+        with get_db() as conn:
+            ids = [r[0] for r in conn.execute(
+                f"SELECT o.{key} FROM {table} o WHERE {condition} LIMIT ?", (MAINTENANCE_CONFIG["orphan_batch"],)
+            )]
+            if not ids:
+                return total
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", [(i,) for i in ids])
+        total += len(ids)
+        time.sleep(MAINTENANCE_CONFIG["step_pause"])
+
+
+def sweep_bands(max_rows: int = BAND_SWEEP_ROWS) -> int:
+    """
+    tm_bands has no foreign key (and no sentence_id index), so it is checked a
+    slice per pass, resuming where the last pass stopped. Returns rows deleted.
+    """
+    global _band_cursor
+    deleted = 0
+    checked = 0
+    while checked < max_rows:
+        band_key, sentence_id = _band_cursor
+        with get_db() as conn:
+            rows = conn.execute(f'''
+                SELECT b.band_key, b.sentence_id, ts.sentence_id IS NULL AS orphan
+                FROM (
+                    SELECT band_key, sentence_id FROM tm_bands
+                    {"WHERE (band_key, sentence_id) > (?, ?)" if band_key is not None else ""}
+                    ORDER BY band_key, sentence_id LIMIT ?
+                ) b
+                LEFT JOIN tm_signatures ts ON ts.sentence_id = b.sentence_id
+            ''', (*([band_key, sentence_id] if band_key is not None else []),
+                  MAINTENANCE_CONFIG["orphan_batch"] * 5)).fetchall()
+            if not rows:
+                _band_cursor = (None, None)  # wrapped around, start over next pass
+                break
+            orphans = [(r["band_key"], r["sentence_id"]) for r in rows if r["orphan"]]
+            conn.executemany("DELETE FROM tm_bands WHERE band_key = ? AND sentence_id = ?", orphans)
+        _band_cursor = (rows[-1]["band_key"], rows[-1]["sentence_id"])
+        checked += len(rows)
+        deleted += len(orphans)
+        time.sleep(MAINTENANCE_CONFIG["step_pause"])
+    return deleted
+
+
+def cleanup_orphans(full_sweep: bool = False) -> dict:
+    """Delete orphaned rows; tm_bands is swept one slice per call unless full_sweep"""
+    counts = {}
+    for table, key, condition in ORPHANS:
+        counts[table] = delete_orphans(table, key, condition)
+    counts["tm_bands"] = sweep_bands()
+    while full_sweep and _band_cursor != (None, None):
+        counts["tm_bands"] += sweep_bands()
+    removed = {table: n for table, n in counts.items() if n}
+    if removed:
+        logger.info(f"Deleted orphaned rows: {removed}")
+    return counts
+
+
+def enable_incremental_vacuum(force: bool = False) -> bool:
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. That takes one
+    full VACUUM, so outside of `python -m app.services.maintenance convert`
+    (run while the server is stopped) it only happens with auto_convert on and
+    below convert_max_mb. Returns whether the mode is incremental.
+    """
+    global _incremental, _warned
+    conn = _autocommit_connection()
+    try:
+        if _pragma(conn, "auto_vacuum") != 2:
+            size_mb = _pragma(conn, "page_count") * _pragma(conn, "page_size") / 2 ** 20
+            if not force and (not MAINTENANCE_CONFIG["auto_convert"]
+                              or size_mb > MAINTENANCE_CONFIG["convert_max_mb"]):
+                if not _warned:
+                    logger.warning(f"Database is {size_mb:.0f} MiB with auto_vacuum off; run "
+                                   f"`python -m app.services.maintenance convert` to enable incremental vacuum")
+                    _warned = True
+                return False
+            started = time.perf_counter()
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            logger.info(f"Enabled incremental auto_vacuum ({size_mb:.0f} MiB, "
+                        f"{time.perf_counter() - started:.1f}s)")
+        _incremental = _pragma(conn, "auto_vacuum") == 2
+        return _incremental
+    finally:
+        conn.close()
+
+
+def reclaim(max_pages: Optional[int] = None) -> int:
+    """Return free pages to the filesystem in small steps; returns pages freed"""
+    max_pages = MAINTENANCE_CONFIG["vacuum_max_pages"] if max_pages is None else max_pages
+    conn = _autocommit_connection()
+    freed = 0
+    try:
+        if _pragma(conn, "auto_vacuum") != 2:
+            return 0
+        while freed < max_pages:
+            free = _pragma(conn, "freelist_count")
+            step = min(MAINTENANCE_CONFIG["vacuum_step_pages"], free - MAINTENANCE_CONFIG["vacuum_keep_pages"],
+                       max_pages - freed)
+            if step <= 0:
+                break
+            # Frees one page per row step, so the statement has to be drained
+            conn.execute(f"PRAGMA incremental_vacuum({int(step)})").fetchall()
+            delta = free - _pragma(conn, "freelist_count")
+            if delta <= 0:
+                break
+            freed += delta
+            time.sleep(MAINTENANCE_CONFIG["step_pause"])
+    finally:
+        conn.close()
+    if freed:
+        logger.info(f"Reclaimed {freed} free pages")
+    return freed
+
+
+def optimize():
+    """Refresh planner statistics with a bounded ANALYZE, then PRAGMA optimize"""
+    global _last_optimize
+    conn = _autocommit_connection()
+    try:
+        # analysis_limit samples each index instead of scanning it, so this
+        # stays cheap however large the tables get
+        conn.execute(f"PRAGMA analysis_limit = {int(MAINTENANCE_CONFIG['analysis_limit'])}")
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+    finally:
+        conn.close()
+    _last_optimize = time.monotonic()
+
+
+def report(table_sizes: bool = False) -> dict:
+    """Database size and fragmentation (free pages), optionally bytes per table/index"""
+    with get_db() as conn:
+        page_size = _pragma(conn, "page_size")
+        page_count = _pragma(conn, "page_count")
+        free = _pragma(conn, "freelist_count")
+        stats = {
+            "path": database.DATABASE_PATH,
+            "file_bytes": os.path.getsize(database.DATABASE_PATH),
+            "page_size": page_size,
+            "page_count": page_count,
+            "free_pages": free,
+            "free_bytes": free * page_size,
+            "fragmentation": round(free / page_count, 4) if page_count else 0.0,
+            "auto_vacuum": AUTO_VACUUM_MODES.get(_pragma(conn, "auto_vacuum"), "unknown"),
+        }
+        if table_sizes:
+            try:
+                rows = conn.execute(
+                    "SELECT name, SUM(pgsize) AS bytes FROM dbstat GROUP BY name ORDER BY bytes DESC"
+                ).fetchall()
+                stats["tables"] = {r["name"]: r["bytes"] for r in rows}
+            except sqlite3.OperationalError:
+                stats["tables"] = None  # SQLite built without the dbstat table
+    return stats
+
+
+def run_once(full: bool = False):
+    """
+    One maintenance pass. Foreign keys keep new orphans from appearing, so
+    every table is only checked on full passes (startup, statistics refresh);
+    other passes sweep a slice of tm_bands and reclaim free pages.
+    """
+    if not _incremental:
+        try:
+            enable_incremental_vacuum()
+        except sqlite3.OperationalError as e:
+            # The VACUUM needs the database to itself; retried next pass
+            logger.warning(f"Could not enable incremental auto_vacuum yet: {e}")
+    due = full or time.monotonic() - _last_optimize >= MAINTENANCE_CONFIG["optimize_interval"]
+    if due:
+        cleanup_orphans()
+    else:
+        count = sweep_bands()
+        if count:
+            logger.info(f"Deleted {count} orphaned rows from tm_bands")
+    reclaim()
+    if due:
+        optimize()
+        stats = report()
+        logger.info(f"Database {stats['file_bytes'] / 2**20:.1f} MiB, "
+                    f"{stats['free_bytes'] / 2**20:.1f} MiB free ({stats['fragmentation']:.1%})")
+
+
+def _loop():
+    try:
+        run_once(full=True)
+    except Exception as e:
+        logger.error(f"Database maintenance failed: {e}")
+    while True:
+        _wake.wait(MAINTENANCE_CONFIG["interval"])
+        _wake.clear()
+        try:
+            run_once()
+        except Exception as e:
+            logger.error(f"Database maintenance failed: {e}")
+
+
+def request_reclaim():
+    """Run a pass soon, e.g. after a large delete"""
+    _wake.set()
+
+
+def start_background_maintenance():
+    global _thread
+    if not MAINTENANCE_CONFIG["enabled"]:
+        return
+    if _thread is None or not _thread.is_alive():
+        _thread = threading.Thread(target=_loop, name="db-maintenance", daemon=True)
+        _thread.start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("report", help="size, fragmentation and bytes per table")
+    sub.add_parser("cleanup", help="delete orphaned rows")
+    v = sub.add_parser("vacuum", help="reclaim free pages incrementally")
+    v.add_argument("--pages", type=int, help="most pages to free (default: all)")
+    sub.add_parser("optimize", help="refresh planner statistics")
+    sub.add_parser("convert", help="enable incremental auto_vacuum (one full VACUUM)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.command == "report":
+        print(json.dumps(report(table_sizes=True), indent=2))
+    elif args.command == "cleanup":
+        for table, count in cleanup_orphans(full_sweep=True).items():
+            print(f"{table}: {count} orphaned rows deleted")
+    elif args.command == "vacuum":
+        print(f"{reclaim(args.pages if args.pages is not None else 2 ** 62)} pages freed")
+    elif args.command == "optimize":
+        optimize()
+    elif args.command == "convert":
+        enable_incremental_vacuum(force=True)
+        print(json.dumps(report(), indent=2))
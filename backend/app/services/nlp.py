@@ -1,9 +1,13 @@
+import re
 import spacy
 
 nlp = None
+has_lemmas = False
+
+_word_re = re.compile(r"[A-Za-z]+(?:['’-][A-Za-z]+)*")
 
 def init_spacy():
-    global nlp
+    global nlp, has_lemmas
     try:
         nlp = spacy.blank("en")
         nlp.add_pipe("sentencizer")
@@ -11,9 +15,33 @@ def init_spacy():
     except Exception as e:
         print(f"❌ Failed to load Spacy: {e}")
         nlp = None
+        return
+    try:
+        # Lookup lemmas need spacy-lookups-data; without it words are matched as written
+        nlp.add_pipe("lemmatizer", config={"mode": "lookup"}).initialize()
+        has_lemmas = True
+        print("✅ Spacy lookup lemmatizer loaded.")
+    except Exception as e:
+        if "lemmatizer" in nlp.pipe_names:
+            nlp.remove_pipe("lemmatizer")
+        print(f"⚠️ Spacy lemmatizer unavailable ({e}), using surface forms")
 
 def sentencize(text: str):
     if nlp:
-        doc = nlp(text)
+        # Only sentence boundaries are needed; lemmas are for tokenize_batch
+        doc = nlp(text, disable=["lemmatizer"])
         return [sent.text.strip() for sent in doc.sents if sent.text.strip()]
     return []
+
+def tokenize_batch(texts, batch_size: int = 256):
+    """Word tokens per text as [(surface, lemma, is_first)]; lemma is lowercased"""
+    if nlp is None:
+        return [[(m.group(), m.group().lower(), i == 0) for i, m in enumerate(_word_re.finditer(t))]
+                for t in texts]
+    result = []
+    for doc in nlp.pipe(texts, batch_size=batch_size, disable=["sentencizer"]):
+        result.append([
+            (tok.text, (tok.lemma_ if has_lemmas and tok.lemma_ else tok.text).lower(), tok.i == 0)
+            for tok in doc if tok.is_alpha
+        ])
+    return result
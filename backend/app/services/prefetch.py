@@ -0,0 +1,119 @@
+"""
+Lookahead analysis prefetch.
+When a reader reports progress, the next few unanalyzed sentences after the
+reading position are queued at PREFETCH priority, so their analysis is
+usually in the database before the paragraph becomes active.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Dict
+
+from app import metrics
+from app.config import ANALYSIS_BATCH_CONFIG, PREFETCH_CONFIG
+from app.services.ai_router import plan_providers
+from app.services.analysis import PREFETCH, analysis_batcher
+from app.services.lexicon import candidates_for
+from app.services.translation_memory import reuse_from_memory
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+BUDGET_WINDOW = 3600  # seconds
+SWEEP_INTERVAL = 60   # seconds between drops of expired budget windows
+
+_usage: Dict[int, deque] = {}  # user_id -> timestamps of prefetched sentences (only non-empty windows)
+_tasks = set()
+_last_sweep = 0.0
+
+
+def _sweep(now: float):
+    # Readers who stopped reading never ask for their budget again; drop their windows
+    global _last_sweep
+    if now - _last_sweep < SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    cutoff = now - BUDGET_WINDOW
+    for user_id in [u for u, window in _usage.items() if window[-1] < cutoff]:
+        del _usage[user_id]
+
+
+def _remaining_budget(user_id: int) -> int:
+    now = time.monotonic()
+    _sweep(now)
+    window = _usage.get(user_id)
+    if window is None:
+        return PREFETCH_CONFIG["user_budget_per_hour"]
+    cutoff = now - BUDGET_WINDOW
+    while window and window[0] < cutoff:
+        window.popleft()
+    if not window:
+        del _usage[user_id]
+    return PREFETCH_CONFIG["user_budget_per_hour"] - len(window)
+
+
+def schedule_prefetch(user_id: int, text_id: int, sentence_id: int):
+    """Queue analysis for the sentences following sentence_id in the background"""
+    if not PREFETCH_CONFIG["enabled"]:
+        return
+    # Even the lookahead query stays off the progress request's path
+    task = asyncio.create_task(_schedule(user_id, text_id, sentence_id))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _schedule(user_id: int, text_id: int, sentence_id: int):
+    try:
+        await _plan(user_id, text_id, sentence_id)
+    except Exception as e:
+        logger.warning(f"Prefetch for user {user_id} failed: {e}")
+
+
+async def _plan(user_id: int, text_id: int, sentence_id: int):
+    budget = _remaining_budget(user_id)
+    if budget <= 0:
+        return
+
+    storage = get_storage()
+    rows = await storage.next_unanalyzed(text_id, sentence_id, PREFETCH_CONFIG["lookahead"])
+    todo = [r for r in rows if not analysis_batcher.is_inflight(r["id"])][:budget]
+    if not todo:
+        return
+
+    # Speculative work is still paid work; skip users who couldn't pay for it
+    user = await storage.get_user(user_id)
+    if not user or (user["credits"] or 0) < math.ceil(len(todo) / ANALYSIS_BATCH_CONFIG["max_items"]):
+        return
+
+    # Near-duplicates of already analyzed sentences need no LLM call
+    todo = await reuse_from_memory(todo)
+    if not todo:
+        return
+
+    plan = plan_providers(PREFETCH_CONFIG["provider"])
+    if not plan:
+        return
+
+    now = time.monotonic()
+    _usage.setdefault(user_id, deque()).extend([now] * len(todo))
+    await _prefetch(user_id, todo, plan)
+
+
+async def _prefetch(user_id: int, rows, plan):
+    outcomes = await asyncio.gather(
+        *(analysis_batcher.analyze(r["id"], r["content"], plan, priority=PREFETCH,
+                                   vocab=candidates_for(r["vocab_json"], r["vocab_level"]))
+          for r in rows),
+        return_exceptions=True
+    )
+    analyzed = sum(1 for o in outcomes if not isinstance(o, Exception))
+    logger.info(f"Prefetched {analyzed}/{len(rows)} sentences for user {user_id}")
+    if not analyzed:
+        return
+    # Charge like interactive analysis, but only for what was actually produced
+    cost = math.ceil(analyzed / ANALYSIS_BATCH_CONFIG["max_items"])
+    await get_storage().deduct_credits(user_id, cost, partial=True)
+    metrics.CREDITS.inc(cost, reason="prefetch")
@@ -0,0 +1,192 @@
+"""
+Local sentence retrieval index (CPU only).
+Each sentence is embedded with a signed feature-hashing vectorizer (unigrams +
+bigrams, sublinear tf) into a fixed number of float16 dimensions. Vectors are
+appended to per-text files and searched through numpy memmaps, so the index
+is built incrementally at import and queries never load a book into memory.
+Per-text document frequencies are kept so queries can apply IDF weighting.
+Builds write to temporary files and swap them in under a per-text lock, so a
+search only ever sees a finished index. Sentences are read through the
+storage backend; the index files stay local to each node, which builds them
+on first search.
+"""
+
+import logging
+import math
+import os
+import re
+import threading
+import uuid
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.config import RETRIEVAL_CONFIG
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+DIMS = RETRIEVAL_CONFIG["dims"]
+VEC_DTYPE = np.float16
+SEARCH_CHUNK = 8192  # rows scored per step, bounds the float32 working set
+
+_token_re = re.compile(r"[a-z0-9']+")
+
+_locks: Dict[int, threading.Lock] = {}  # text_id -> guards swapping/dropping/reading its files
+_locks_guard = threading.Lock()
+
+
+def _lock(text_id: int) -> threading.Lock:
+    with _locks_guard:
+        return _locks.setdefault(text_id, threading.Lock())
+
+
+def _paths(text_id: int, suffix: str = "") -> Tuple[str, str, str]:
+    base = os.path.join(RETRIEVAL_CONFIG["index_dir"], str(text_id))
+    return base + ".vec" + suffix, base + ".ids" + suffix, base + ".df" + suffix
+
+
+def _features(text: str) -> Counter:
+    tokens = _token_re.findall(text.lower())
+    feats = Counter(tokens)
+    feats.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return feats
+
+
+def _hash(feature: str) -> Tuple[int, float]:
+    h = zlib.crc32(feature.encode())
+    return h % DIMS, (1.0 if h & 0x80000000 else -1.0)
+
+
+def embed(texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (L2-normalized vectors, per-dimension document counts)"""
+    texts = list(texts)
+    vecs = np.zeros((len(texts), DIMS), dtype=np.float32)
+    df = np.zeros(DIMS, dtype=np.int32)
+    for row, text in enumerate(texts):
+        for feature, tf in _features(text).items():
+            idx, sign = _hash(feature)
+            vecs[row, idx] += sign * (1.0 + math.log(tf))
+        df += vecs[row] != 0
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vecs / norms, df
+
+
+def index_sentences(paths: Tuple[str, str, str], sentences: List[Tuple[int, str]]):
+    """Append (sentence_id, content) pairs to the index files at paths"""
+    if not sentences:
+        return
+    vec_path, ids_path, df_path = paths
+    vecs, df = embed(content for _, content in sentences)
+
+    if os.path.exists(df_path):
+        df += np.fromfile(df_path, dtype=np.int32)
+    # Vectors first, then ids: readers size the index by the ids file
+    with open(vec_path, "ab") as f:
+        f.write(vecs.astype(VEC_DTYPE).tobytes())
+    with open(ids_path, "ab") as f:
+        f.write(np.array([sid for sid, _ in sentences], dtype=np.int64).tobytes())
+    df.tofile(df_path)
+
+
+async def build_index(text_id: int, batch_size: int = 2000):
+    """
+    (Re)build a text's index from its sentences in bounded batches.
+    Concurrent builds each write their own temporary files; the last to
+    finish is the one searched.
+    """
+    os.makedirs(RETRIEVAL_CONFIG["index_dir"], exist_ok=True)
+    tmp_paths = _paths(text_id, f".{uuid.uuid4().hex}.tmp")
+    try:
+        async for rows in get_storage().sentence_batches(text_id, batch_size):
+            await run_in_threadpool(index_sentences, tmp_paths, [(r["id"], r["content"]) for r in rows])
+        await run_in_threadpool(_swap, text_id, tmp_paths)
+    finally:
+        _remove(tmp_paths)
+    logger.info(f"Built retrieval index for text {text_id}")
+
+
+def _swap(text_id: int, tmp_paths: Tuple[str, str, str]):
+    with _lock(text_id):
+        if not os.path.exists(tmp_paths[1]):
+            _remove(_paths(text_id))  # no sentences: no index
+        else:
+            for tmp, path in zip(tmp_paths, _paths(text_id)):
+                os.replace(tmp, path)
+
+
+def _remove(paths):
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def drop_index(text_id: int):
+    with _lock(text_id):
+        _remove(_paths(text_id))
+
+
+async def search(text_id: int, query: str, k: int) -> List[Tuple[int, float]]:
+    """Top-k (sentence_id, score) for the query, best first"""
+    if not os.path.exists(_paths(text_id)[1]):
+        await build_index(text_id)
+    return await run_in_threadpool(_search_locked, text_id, query, k)
+
+
+def _search_locked(text_id: int, query: str, k: int) -> List[Tuple[int, float]]:
+    # Held while the files are mapped, so a build can't swap them underneath
+    with _lock(text_id):
+        return _search(text_id, query, k)
+
+
+def _search(text_id: int, query: str, k: int) -> List[Tuple[int, float]]:
+    vec_path, ids_path, df_path = _paths(text_id)
+    if not os.path.exists(ids_path):
+        return []
+    n = os.path.getsize(ids_path) // 8
+    if n == 0:
+        return []
+    ids = np.memmap(ids_path, dtype=np.int64, mode="r", shape=(n,))
+    vecs = np.memmap(vec_path, dtype=VEC_DTYPE, mode="r", shape=(n, DIMS))
+    df = np.fromfile(df_path, dtype=np.int32)
+
+    q, _ = embed([query])
+    q = q[0] * np.log((n + 1) / (df + 1)).astype(np.float32)
+    if not q.any():
+        return []
+
+    k = min(k, n)
+    best_scores = np.empty(0, dtype=np.float32)
+    best_rows = np.empty(0, dtype=np.int64)
+    for start in range(0, n, SEARCH_CHUNK):
+        scores = np.asarray(vecs[start:start + SEARCH_CHUNK], dtype=np.float32) @ q
+        rows = np.arange(start, start + len(scores))
+        best_scores = np.concatenate([best_scores, scores])
+        best_rows = np.concatenate([best_rows, rows])
+        if len(best_scores) > k:
+            keep = np.argpartition(-best_scores, k - 1)[:k]
+            best_scores, best_rows = best_scores[keep], best_rows[keep]
+
+    order = np.argsort(-best_scores)
+    return [(int(ids[best_rows[i]]), float(best_scores[i])) for i in order if best_scores[i] > 0]
+
+
+async def retrieve_context(text_id: int, query: str, k: int) -> List[dict]:
+    """Top-k sentences (in reading order) trimmed to the prompt context budget"""
+    hits = await search(text_id, query, k)
+    if not hits:
+        return []
+    rows = await get_storage().get_text_sentences(text_id, [sid for sid, _ in hits])
+
+    # Spend the character budget on the best hits, then present them in reading order
+    picked, budget = [], RETRIEVAL_CONFIG["max_context_chars"]
+    for sid, score in hits:
+        row = rows.get(sid)
+        if row and len(row["content"]) <= budget:
+            budget -= len(row["content"])
+            picked.append({**row, "score": round(score, 4)})
+    return sorted(picked, key=lambda r: r["sentence_index"])
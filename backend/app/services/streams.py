@@ -0,0 +1,136 @@
+"""
+Resumable AI streams.
+The upstream response is pumped into a short-lived, numbered event buffer by a
+background task, so a client that drops can reconnect with Last-Event-ID and
+replay what it missed without a new upstream call (or a new credit).
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from app.config import STREAM_RESUME_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class StreamGone(Exception):
+    """The requested events are no longer buffered"""
+
+
+class StreamSession:
+    def __init__(self, user_id: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.events = []      # [(event_id, data)], ids are contiguous from base_id
+        self.base_id = 1
+        self.next_id = 1
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def append(self, data: str):
+        self.events.append((self.next_id, data))
+        self.next_id += 1
+        # Ring buffer: trim in halves so the copy cost is amortised
+        limit = STREAM_RESUME_CONFIG["buffer_events"]
+        if len(self.events) > 2 * limit:
+            drop = len(self.events) - limit
+            self.events = self.events[drop:]
+            self.base_id += drop
+        self._notify()
+
+    def finish(self):
+        self.done = True
+        self.finished_at = time.monotonic()
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def can_resume(self, last_event_id: int) -> bool:
+        return last_event_id + 1 >= self.base_id
+
+    def expired(self, now: float) -> bool:
+        return self.done and now - self.finished_at > STREAM_RESUME_CONFIG["ttl"]
+
+    async def follow(self, last_event_id: int = 0) -> AsyncIterator[tuple]:
+        """Yield (event_id, data) after last_event_id, then live events until done"""
+        cursor = last_event_id
+        while True:
+            if not self.can_resume(cursor):
+                raise StreamGone(f"Stream {self.id} no longer buffers event {cursor + 1}")
+            start = cursor + 1 - self.base_id
+            for event_id, data in self.events[start:]:
+                yield event_id, data
+                cursor = event_id
+            if cursor >= self.next_id - 1:
+                if self.done:
+                    return
+                await self._changed.wait()
+
+
+_sessions: Dict[str, StreamSession] = {}
+
+
+def _sweep():
+    now = time.monotonic()
+    for sid in [sid for sid, s in _sessions.items() if s.expired(now)]:
+        del _sessions[sid]
+    # Hard cap: drop the oldest finished streams first
+    if len(_sessions) >= STREAM_RESUME_CONFIG["max_sessions"]:
+        finished = sorted((s for s in _sessions.values() if s.done), key=lambda s: s.finished_at)
+        for s in finished[:len(_sessions) - STREAM_RESUME_CONFIG["max_sessions"] + 1]:
+            del _sessions[s.id]
+
+
+def start_stream(user_id: int, produce: Callable[[], AsyncIterator[str]],
+                 on_finish: Optional[Callable[[], None]] = None) -> StreamSession:
+    """
+    Run produce() in the background, buffering each chunk as a numbered event.
+    The terminal event is "[DONE]" or "[ERROR]<message>", matching the SSE
+    protocol the frontend already speaks.
+    """
+    _sweep()
+    session = StreamSession(user_id)
+    _sessions[session.id] = session
+
+    async def pump():
+        try:
+            async for chunk in produce():
+                session.append(chunk)
+            session.append("[DONE]")
+        except asyncio.CancelledError:
+            session.append("[ERROR]Stream cancelled")
+            raise
+        except Exception as e:
+            session.append(f"[ERROR]{str(e)}")
+        finally:
+            session.finish()
+            if on_finish:
+                on_finish()
+
+    session.task = asyncio.create_task(pump())
+    logger.info(f"Started stream {session.id} for user {user_id}")
+    return session
+
+
+def get_stream(stream_id: str, user_id: int) -> Optional[StreamSession]:
+    session = _sessions.get(stream_id)
+    if session is None or session.user_id != user_id:
+        return None
+    if session.expired(time.monotonic()):
+        del _sessions[stream_id]
+        return None
+    return session
+
+
+def stream_stats() -> dict:
+    return {
+        "sessions": len(_sessions),
+        "live": sum(1 for s in _sessions.values() if not s.done),
+    }
@@ -0,0 +1,161 @@
+"""
+Fuzzy translation memory.
+Sentences with a stored translation/analysis are indexed by a MinHash
+signature over normalized character 3-grams, plus LSH band keys in the
+tm_bands table, written by the storage backend along with the analysis. A
+lookup is one indexed query over the band keys followed by a signature
+comparison of the few candidates, so it stays sub-millisecond at millions
+of stored sentences. Near-duplicates (editions, punctuation
+variants, OCR noise) then reuse the stored analysis instead of an LLM call.
+"""
+
+import hashlib
+import logging
+import re
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from app.config import TRANSLATION_MEMORY_CONFIG
+from app.storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+NUM_PERM = TRANSLATION_MEMORY_CONFIG["num_perm"]
+BANDS = TRANSLATION_MEMORY_CONFIG["bands"]
+ROWS = NUM_PERM // BANDS
+
+# Multiply-shift hash family: top 32 bits of (a * x + b) mod 2^64, a odd
+_rng = np.random.RandomState(20240611)
+_A = _rng.randint(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+_B = _rng.randint(0, np.iinfo(np.uint64).max, NUM_PERM, dtype=np.uint64)
+_SHIFT = np.uint64(32)
+
+_strip_re = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def normalize(text: str) -> str:
+    """Lowercase and drop punctuation/whitespace differences"""
+    return _strip_re.sub(" ", text.lower()).strip()
+
+
+def signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature (uint32[NUM_PERM]) or None if the text is too short"""
+    norm = normalize(text)
+    if len(norm) < TRANSLATION_MEMORY_CONFIG["min_chars"]:
+        return None
+    shingles = {norm[i:i + 3] for i in range(len(norm) - 2)}
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    # Hash every shingle under every permutation (uint64 wraps), min per permutation
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) >> _SHIFT
+    return permuted.min(axis=1).astype(np.uint32)
+
+
+def band_keys(sig: np.ndarray) -> List[int]:
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                 digest_size=8, person=band.to_bytes(2, "little")).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+    return keys
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def memory_rows(sentences: List[Tuple[int, str]]) -> Tuple[List[Tuple[int, bytes]], List[Tuple[int, int]]]:
+    """(sentence_id, signature) and (band_key, sentence_id) rows for (sentence_id, content) pairs"""
+    sig_rows, band_rows = [], []
+    if not TRANSLATION_MEMORY_CONFIG["enabled"]:
+        return sig_rows, band_rows
+    for sentence_id, content in dict(sentences).items():
+        sig = signature(content)
+        if sig is None:
+            continue
+        sig_rows.append((sentence_id, sig.tobytes()))
+        band_rows.extend((key, sentence_id) for key in band_keys(sig))
+    return sig_rows, band_rows
+
+
+def add_sentences(conn, sentences: List[Tuple[int, str]]):
+    """Index (sentence_id, content) pairs in the SQLite file; call inside the caller's transaction"""
+    sig_rows, band_rows = memory_rows(sentences)
+    if sig_rows:
+        conn.executemany("INSERT OR REPLACE INTO tm_signatures (sentence_id, signature) VALUES (?, ?)", sig_rows)
+        conn.executemany("INSERT OR IGNORE INTO tm_bands (band_key, sentence_id) VALUES (?, ?)", band_rows)
+
+
+def best_match(sig: np.ndarray, candidates: List[dict], exclude_id: Optional[int] = None) -> Optional[dict]:
+    """The candidate (see Storage.memory_candidates) most similar to sig, if similar enough to reuse"""
+    best, best_score = None, TRANSLATION_MEMORY_CONFIG["reuse_threshold"]
+    for r in candidates:
+        if r["sentence_id"] == exclude_id:
+            continue
+        score = similarity(sig, np.frombuffer(r["signature"], dtype=np.uint32))
+        if score >= best_score:
+            best, best_score = r, score
+    if best is None:
+        return None
+    return {
+        "source_id": best["sentence_id"],
+        "similarity": best_score,
+        "translation": best["translation"],
+        "analysis_json": best["analysis_json"],
+    }
+
+
+def _lookup_keys(rows: List[dict]) -> List[Optional[Tuple[np.ndarray, List[int]]]]:
+    keys = []
+    for r in rows:
+        sig = signature(r["content"])
+        keys.append((sig, band_keys(sig)) if sig is not None else None)
+    return keys
+
+
+async def reuse_from_memory(rows: List[dict]) -> List[dict]:
+    """
+    Fill rows (dicts with id/content) from the translation memory where a
+    near-duplicate exists. Returns the rows that still need an LLM call.
+    """
+    if not TRANSLATION_MEMORY_CONFIG["enabled"] or not rows:
+        return rows
+    storage = get_storage()
+    remaining, reused = [], []
+    for r, keys in zip(rows, await run_in_threadpool(_lookup_keys, rows)):
+        hit = None
+        if keys is not None:
+            sig, bands = keys
+            candidates = await storage.memory_candidates(bands, TRANSLATION_MEMORY_CONFIG["max_candidates"])
+            hit = best_match(sig, candidates, exclude_id=r["id"])
+        if hit:
+            reused.append((r["id"], r["content"], hit["translation"], hit["analysis_json"]))
+        else:
+            remaining.append(r)
+    if reused:
+        # Stored like a batcher result, which also indexes the reused rows
+        await storage.save_analyses(reused)
+        logger.info(f"Translation memory reused {len(reused)}/{len(rows)} analyses")
+    return remaining
+
+
+async def _index(text_id: Optional[int], batch_size: int) -> int:
+    storage = get_storage()
+    total = 0
+    async for rows in storage.sentence_batches(text_id, batch_size, analyzed=True):
+        await storage.add_to_memory([(r["id"], r["content"]) for r in rows])
+        total += len(rows)
+    return total
+
+
+async def rebuild(batch_size: int = 5000) -> int:
+    """Backfill the memory from every analyzed sentence; returns rows indexed"""
+    return await _index(None, batch_size)
+
+
+async def index_text(text_id: int, batch_size: int = 5000) -> int:
+    """Index the analyzed sentences of one text (e.g. after a bundle import); returns rows indexed"""
+    return await _index(text_id, batch_size)
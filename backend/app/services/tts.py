@@ -0,0 +1,32 @@
+"""
+edge-tts synthesis shared by /tts and audiobook rendering.
+"""
+
+import io
+import time
+
+import edge_tts
+
+from app import metrics
+from app.config import EDGE_TTS_WSS_URL
+
+if EDGE_TTS_WSS_URL:
+    edge_tts.communicate.WSS_URL = EDGE_TTS_WSS_URL
+
+
+async def synthesize(text: str, voice: str) -> bytes:
+    """MP3 bytes for text spoken by voice (an edge-tts voice name)"""
+    communicate = edge_tts.Communicate(text, voice)
+    audio_data = io.BytesIO()
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        async for chunk in communicate.stream():
+            if chunk["type"] == "audio":
+                audio_data.write(chunk["data"])
+        outcome = "ok"
+    finally:
+        metrics.TTS_SYNTHESIS.observe(time.perf_counter() - started, outcome=outcome)
+    metrics.TTS_BYTES.inc(audio_data.tell())
+    return audio_data.getvalue()
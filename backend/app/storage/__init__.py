@@ -0,0 +1,35 @@
+"""
+Storage backends, chosen by STORAGE_BACKEND (see STORAGE_CONFIG):
+
+    sqlite      one file next to the app (DATABASE_PATH), one writer; the default
+    postgres    asyncpg pool on DATABASE_URL, shared by any number of workers/nodes
+
+asyncpg is only imported when the postgres backend is selected. Every feature
+reads and writes through Storage; only at-rest compression (app/codec.py) and
+file maintenance (app/services/maintenance.py) are specific to the SQLite
+file, since PostgreSQL compresses large values (TOAST) and reclaims space
+(autovacuum) by itself.
+"""
+
+from typing import Optional
+
+from app.config import STORAGE_CONFIG
+from app.storage.base import Chapters, InsufficientCredits, Storage, StoredChapters
+
+_storage: Optional[Storage] = None
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        backend = STORAGE_CONFIG["backend"]
+        if backend == "sqlite":
+            from app.storage.sqlite import SQLiteStorage
+            _storage = SQLiteStorage()
+        elif backend == "postgres":
+            from app.storage.postgres import PostgresStorage
+            _storage = PostgresStorage(STORAGE_CONFIG["postgres_dsn"], STORAGE_CONFIG["pool_min"],
+                                       STORAGE_CONFIG["pool_max"], STORAGE_CONFIG["command_timeout"])
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend} (expected sqlite or postgres)")
+    return _storage
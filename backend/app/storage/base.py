@@ -0,0 +1,190 @@
+"""
+Storage interface for users, texts (with their chapters), sentences and
+credits. Routers and services call these coroutines instead of writing SQL,
+so the same code runs on the single-file SQLite backend or on PostgreSQL
+shared by several workers.
+
+Rows are plain dicts with the column names of the SQLite schema. JSON
+columns (scaffolding_data, analysis_json, vocab_json) go in and come out as
+JSON strings; backends may store them differently (e.g. compressed).
+Timestamps come back as "YYYY-MM-DD HH:MM:SS" UTC strings.
+
+Sentences saved with a translation or analysis are added to the translation
+memory (app/services/translation_memory.py) in the same transaction.
+"""
+
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+Chapters = Iterable[Tuple[str, str]]  # (title, body), read lazily
+# ({"index", "title", "content"}, [{"index", "content", "translation", "analysis_json",
+#   "vocab_json", "vocab_max"}, ...]) per chapter, as in a text bundle (app/services/bundles.py)
+StoredChapters = Iterable[Tuple[dict, List[dict]]]
+
+
+class InsufficientCredits(Exception):
+    def __init__(self, credits: int):
+        super().__init__(f"{credits} credits left")
+        self.credits = credits
+
+
+class Storage(ABC):
+    name = ""
+
+    async def open(self):
+        """Connect and create the schema if needed (application startup)"""
+
+    async def close(self):
+        """Release connections (application shutdown)"""
+
+    # ---- Users and credits ----
+
+    @abstractmethod
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def create_user(self, email: str, password_hash: str) -> Optional[dict]:
+        """The new user, or None if the email is taken"""
+
+    @abstractmethod
+    async def set_password_hash(self, user_id: int, password_hash: str):
+        ...
+
+    @abstractmethod
+    async def add_credits(self, user_id: int, amount: int) -> Optional[dict]:
+        """The updated user, or None if there is no such user"""
+
+    @abstractmethod
+    async def deduct_credits(self, user_id: int, amount: int, partial: bool = False) -> Optional[int]:
+        """
+        Atomically take amount credits; returns what is left, or None if there
+        is no such user. Raises InsufficientCredits unless partial, which
+        takes what there is (down to 0) instead.
+        """
+
+    # ---- Texts and chapters ----
+
+    @abstractmethod
+    async def list_texts(self, user_id: int) -> List[dict]:
+        """The user's texts, most recently updated first"""
+
+    @abstractmethod
+    async def get_text(self, text_id: int, user_id: int) -> Optional[dict]:
+        """Text metadata (no content) plus current_chapter, the chapter of current_paragraph_id"""
+
+    @abstractmethod
+    async def create_text(self, user_id: int, title: str, chapters: Chapters,
+                          scaffolding_data: Optional[str] = None) -> Tuple[int, int]:
+        """
+        Store a text, its chapters and their sentences, reading one chapter
+        at a time. Backends may commit chapter by chapter (SQLite does, to
+        keep its single write lock free), but an exception raised while
+        iterating chapters leaves nothing of the text behind, and the text
+        is not listed or readable until its last chapter is stored. Returns
+        (text_id, sentence_count).
+        """
+
+    @abstractmethod
+    async def restore_text(self, user_id: int, text: dict, chapters: StoredChapters) -> Tuple[int, int, int]:
+        """
+        Store a text exactly as exported: text carries title, scaffolding_data,
+        reading_mode, scaffold_level, vocab_level and current_sentence (a
+        sentence_index); chapters keep their sentences, translations and
+        analyses. Same guarantees as create_text. Returns (text_id, chapters,
+        sentences).
+        """
+
+    @abstractmethod
+    async def owns_text(self, text_id: int, user_id: int) -> bool:
+        ...
+
+    @abstractmethod
+    async def update_text(self, text_id: int, title: Optional[str] = None,
+                          scaffolding_data: Optional[str] = None, chapters: Optional[Chapters] = None):
+        """Set the given fields; new chapters replace the sentences (and analyses) and reset the position"""
+
+    @abstractmethod
+    async def update_progress(self, text_id: int, fields: Dict[str, object]):
+        """Set reading_mode / scaffold_level / vocab_level / current_paragraph_id"""
+
+    @abstractmethod
+    async def delete_text(self, text_id: int, user_id: int) -> bool:
+        """Delete a text with its chapters and sentences; False if not found"""
+
+    @abstractmethod
+    async def list_chapters(self, text_id: int) -> List[dict]:
+        """Chapter metadata (no content) in order"""
+
+    @abstractmethod
+    async def get_chapter(self, text_id: int, chapter_index: int) -> Optional[dict]:
+        ...
+
+    # ---- Sentences ----
+
+    @abstractmethod
+    async def list_sentences(self, text_id: int, chapter_index: Optional[int] = None) -> List[dict]:
+        """A text's sentences (or one chapter's) in reading order"""
+
+    @abstractmethod
+    async def get_owned_sentences(self, sentence_ids: List[int], user_id: int) -> Dict[int, dict]:
+        """Rows for the ids that belong to the user's texts, with their text's vocab_level, keyed by id"""
+
+    @abstractmethod
+    async def next_unanalyzed(self, text_id: int, sentence_id: int, limit: int) -> List[dict]:
+        """
+        Up to limit sentences after sentence_id still missing a translation or
+        analysis (id, content, vocab_json, vocab_level), in reading order
+        """
+
+    @abstractmethod
+    async def update_sentences(self, text_id: int,
+                               updates: List[Tuple[int, Optional[str], Optional[str]]]) -> List[int]:
+        """
+        (id, translation, analysis_json) updates in one transaction; None
+        keeps the stored value. Ids not in the text are skipped. Returns the
+        ids found in the text.
+        """
+
+    @abstractmethod
+    async def update_sentence(self, sentence_id: int, user_id: int, translation: Optional[str] = None,
+                              analysis_json: Optional[str] = None) -> Optional[dict]:
+        """The updated row, or None if the sentence is not the user's"""
+
+    @abstractmethod
+    async def save_analyses(self, results: List[Tuple[int, str, str, str]]):
+        """(id, content, translation, analysis_json) produced by the analysis batcher"""
+
+    # ---- Derived data: retrieval index, vocabulary, translation memory ----
+
+    @abstractmethod
+    def sentence_batches(self, text_id: Optional[int], batch_size: int,
+                         analyzed: bool = False) -> AsyncIterator[List[dict]]:
+        """
+        (id, sentence_index, content) rows of a text in reading order, or of
+        every text when text_id is None, batch_size at a time; only those
+        with both a translation and an analysis if analyzed
+        """
+
+    @abstractmethod
+    async def get_text_sentences(self, text_id: int, sentence_ids: List[int]) -> Dict[int, dict]:
+        """(id, sentence_index, content) rows for the ids that belong to the text, keyed by id"""
+
+    @abstractmethod
+    async def set_vocab(self, updates: List[Tuple[int, str, int]]):
+        """(id, vocab_json, vocab_max) lexicon annotations"""
+
+    @abstractmethod
+    async def add_to_memory(self, sentences: List[Tuple[int, str]]):
+        """Index (sentence_id, content) pairs in the translation memory"""
+
+    @abstractmethod
+    async def memory_candidates(self, band_keys: List[int], limit: int) -> List[dict]:
+        """
+        Analyzed sentences sharing the most LSH bands with band_keys, at most
+        limit: (sentence_id, signature, translation, analysis_json) rows
+        """
@@ -0,0 +1,500 @@
+"""
+PostgreSQL storage backend (asyncpg, one connection pool per worker), for
+running several uvicorn workers or nodes against one database.
+
+Same tables and columns as the SQLite schema, minus the legacy texts.content
+column; JSON columns are plain TEXT (large values are compressed by TOAST).
+Credits are taken with a single conditional UPDATE, so concurrent workers
+never overdraw. Reading and sentencizing imported chapters runs in the
+threadpool, chapter by chapter, and sentences are written with COPY.
+Translation memory signatures are computed in the threadpool and written in
+the transaction that stores the analyses.
+"""
+
+import logging
+from typing import Dict, List, Optional, Tuple
+
+import asyncpg
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from app import metrics, profiling
+from app.config import CHAPTER_CONFIG, METRICS_CONFIG, PROFILING_CONFIG
+from app.services import translation_memory
+from app.services.chapters import chapter_sentences, preview
+from app.storage.base import Chapters, InsufficientCredits, Storage, StoredChapters
+
+logger = logging.getLogger(__name__)
+
+# Held while creating the schema, so workers starting together don't race
+SCHEMA_LOCK = 0x5243_5033
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    id BIGSERIAL PRIMARY KEY,
+    email TEXT UNIQUE NOT NULL,
+    password_hash TEXT NOT NULL,
+    credits INTEGER NOT NULL DEFAULT 100,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS texts (
+    id BIGSERIAL PRIMARY KEY,
+    user_id BIGINT NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+    title TEXT NOT NULL,
+    preview TEXT,
+    char_count INTEGER,
+    chapter_count INTEGER,
+    scaffolding_data TEXT,
+    reading_mode TEXT DEFAULT 'flow',
+    scaffold_level INTEGER DEFAULT 2,
+    vocab_level TEXT DEFAULT 'B1',
+    current_paragraph_id BIGINT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+CREATE TABLE IF NOT EXISTS chapters (
+    id BIGSERIAL PRIMARY KEY,
+    text_id BIGINT NOT NULL REFERENCES texts (id) ON DELETE CASCADE,
+    chapter_index INTEGER NOT NULL,
+    title TEXT,
+    content TEXT NOT NULL,
+    char_count INTEGER NOT NULL,
+    sentence_start INTEGER NOT NULL,
+    sentence_count INTEGER NOT NULL,
+    UNIQUE (text_id, chapter_index)
+);
+CREATE TABLE IF NOT EXISTS sentences (
+    id BIGSERIAL PRIMARY KEY,
+    text_id BIGINT NOT NULL REFERENCES texts (id) ON DELETE CASCADE,
+    chapter_id BIGINT REFERENCES chapters (id) ON DELETE CASCADE,
+    sentence_index INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    translation TEXT,
+    analysis_json TEXT,
+    vocab_json TEXT,
+    vocab_max INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_texts_user_updated ON texts (user_id, updated_at DESC);
+CREATE INDEX IF NOT EXISTS idx_sentences_text_order ON sentences (text_id, sentence_index);
+CREATE INDEX IF NOT EXISTS idx_sentences_chapter ON sentences (chapter_id, sentence_index);
+CREATE TABLE IF NOT EXISTS tm_signatures (
+    sentence_id BIGINT PRIMARY KEY REFERENCES sentences (id) ON DELETE CASCADE,
+    signature BYTEA NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tm_bands (
+    band_key BIGINT NOT NULL,
+    sentence_id BIGINT NOT NULL REFERENCES tm_signatures (sentence_id) ON DELETE CASCADE,
+    PRIMARY KEY (band_key, sentence_id)
+);
+-- Unlike SQLite, nothing sweeps orphaned postings here, so tm_bands cascades
+-- and needs an index to find a deleted sentence's rows
+CREATE INDEX IF NOT EXISTS idx_tm_bands_sentence ON tm_bands (sentence_id);
+'''
+
+
+def _ts(column: str) -> str:
+    # Same shape as SQLite's CURRENT_TIMESTAMP
+    return f"to_char({column} AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS') AS {column.split('.')[-1]}"
+
+
+USER_COLUMNS = f"id, email, password_hash, credits, {_ts('created_at')}"
+TEXT_COLUMNS = f'''
+    t.id, t.user_id, t.title, t.preview, t.char_count, t.chapter_count, t.scaffolding_data,
+    t.reading_mode, t.scaffold_level, t.vocab_level, t.current_paragraph_id,
+    {_ts('t.created_at')}, {_ts('t.updated_at')}
+'''
+CHAPTER_COLUMNS = "chapter_index, title, char_count, sentence_start, sentence_count"
+SENTENCE_COLUMNS = "s.id, s.text_id, s.chapter_id, s.sentence_index, s.content, s.translation, " \
+                   "s.analysis_json, s.vocab_json, s.vocab_max"
+PROGRESS_FIELDS = ("reading_mode", "scaffold_level", "vocab_level", "current_paragraph_id")
+
+
+def _row(record) -> Optional[dict]:
+    return dict(record) if record is not None else None
+
+
+def _observe(query):
+    # asyncpg query logger; runs via call_soon in the caller's context, so
+    # per-request metrics and profiles see it like a SQLite statement
+    metrics.observe_query(query.elapsed)
+    profiling.observe_query(query.query, query.elapsed)
+
+
+def _merge(updates: List[Tuple[int, Optional[str], Optional[str]]]) -> Dict[int, list]:
+    # One row per id (UPDATE ... FROM applies only one match); later values win
+    merged = {}
+    for sid, translation, analysis_json in updates:
+        entry = merged.setdefault(sid, [None, None])
+        if translation is not None:
+            entry[0] = translation
+        if analysis_json is not None:
+            entry[1] = analysis_json
+    return merged
+
+
+async def _read_chapters(chapters: Chapters):
+    """(title, body, sentences) per chapter; reading and sentencizing run in the threadpool"""
+    async for title, body in iterate_in_threadpool(iter(chapters)):
+        yield title, body, await run_in_threadpool(chapter_sentences, body)
+
+
+async def _index_memory(conn, sentences: List[Tuple[int, str]]):
+    """Add (sentence_id, content) pairs to the translation memory in conn's transaction"""
+    sig_rows, band_rows = await run_in_threadpool(translation_memory.memory_rows, sentences)
+    if not sig_rows:
+        return
+    await conn.execute('''
+        INSERT INTO tm_signatures (sentence_id, signature)
+        SELECT * FROM unnest($1::bigint[], $2::bytea[])
+        ON CONFLICT (sentence_id) DO UPDATE SET signature = EXCLUDED.signature
+    ''', [r[0] for r in sig_rows], [r[1] for r in sig_rows])
+    await conn.execute('''
+        INSERT INTO tm_bands (band_key, sentence_id)
+        SELECT * FROM unnest($1::bigint[], $2::bigint[])
+        ON CONFLICT DO NOTHING
+    ''', [r[0] for r in band_rows], [r[1] for r in band_rows])
+
+
+class PostgresStorage(Storage):
+    name = "postgres"
+
+    def __init__(self, dsn: str, min_size: int, max_size: int, command_timeout: float):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.command_timeout = command_timeout
+        self._pool: Optional[asyncpg.Pool] = None
+
+    async def _init_connection(self, conn):
+        if (METRICS_CONFIG["enabled"] or PROFILING_CONFIG["enabled"]) and hasattr(conn, "add_query_logger"):
+            conn.add_query_logger(_observe)
+
+    async def open(self):
+        if self._pool is not None:
+            return
+        self._pool = await asyncpg.create_pool(
+            self.dsn, min_size=self.min_size, max_size=self.max_size,
+            command_timeout=self.command_timeout, init=self._init_connection
+        )
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute("SELECT pg_advisory_xact_lock($1)", SCHEMA_LOCK)
+            await conn.execute(SCHEMA)
+        logger.info(f"PostgreSQL storage ready (pool {self.min_size}-{self.max_size})")
+
+    async def close(self):
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    # ---- Users and credits ----
+
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(f"SELECT {USER_COLUMNS} FROM users WHERE id = $1", user_id))
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(f"SELECT {USER_COLUMNS} FROM users WHERE email = $1", email))
+
+    async def create_user(self, email: str, password_hash: str) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(f'''
+            INSERT INTO users (email, password_hash) VALUES ($1, $2)
+            ON CONFLICT (email) DO NOTHING
+            RETURNING {USER_COLUMNS}
+        ''', email, password_hash))
+
+    async def set_password_hash(self, user_id: int, password_hash: str):
+        await self._pool.execute("UPDATE users SET password_hash = $2 WHERE id = $1", user_id, password_hash)
+
+    async def add_credits(self, user_id: int, amount: int) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(
+            f"UPDATE users SET credits = credits + $2 WHERE id = $1 RETURNING {USER_COLUMNS}", user_id, amount
+        ))
+
+    async def deduct_credits(self, user_id: int, amount: int, partial: bool = False) -> Optional[int]:
+        if partial:
+            return await self._pool.fetchval(
+                "UPDATE users SET credits = GREATEST(credits - $2, 0) WHERE id = $1 RETURNING credits",
+                user_id, amount
+            )
+        row = await self._pool.fetchrow(
+            "UPDATE users SET credits = credits - $2 WHERE id = $1 AND credits >= $2 RETURNING credits",
+            user_id, amount
+        )
+        if row:
+            return row["credits"]
+        credits = await self._pool.fetchval("SELECT credits FROM users WHERE id = $1", user_id)
+        if credits is None:
+            return None
+        raise InsufficientCredits(credits)
+
+    # ---- Texts and chapters ----
+
+    async def list_texts(self, user_id: int) -> List[dict]:
+        rows = await self._pool.fetch(
+            f"SELECT {TEXT_COLUMNS} FROM texts t WHERE t.user_id = $1 ORDER BY t.updated_at DESC", user_id
+        )
+        return [dict(r) for r in rows]
+
+    async def get_text(self, text_id: int, user_id: int) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(f'''
+            SELECT {TEXT_COLUMNS}, (
+                SELECT c.chapter_index FROM sentences s JOIN chapters c ON c.id = s.chapter_id
+                WHERE s.id = t.current_paragraph_id
+            ) AS current_chapter
+            FROM texts t WHERE t.id = $1 AND t.user_id = $2
+        ''', text_id, user_id))
+
+    async def _store_chapters(self, conn, text_id: int, chapters: Chapters) -> int:
+        sentence_index = 0
+        chapter_count = 0
+        char_count = 0
+        head = ""
+        async for title, body, sentences in _read_chapters(chapters):
+            chapter_id = await conn.fetchval('''
+                INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, sentence_count)
+                VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id
+            ''', text_id, chapter_count, title, body, len(body), sentence_index, len(sentences))
+            await conn.copy_records_to_table(
+                "sentences", columns=("text_id", "chapter_id", "sentence_index", "content"),
+                records=[(text_id, chapter_id, sentence_index + i, s) for i, s in enumerate(sentences)]
+            )
+            sentence_index += len(sentences)
+            chapter_count += 1
+            char_count += len(body)
+            if len(head) < CHAPTER_CONFIG["preview_chars"]:
+                head += body[:CHAPTER_CONFIG["preview_chars"]]
+        if not chapter_count:
+            return await self._store_chapters(conn, text_id, [("Chapter 1", "")])
+        await conn.execute(
+            "UPDATE texts SET preview = $2, char_count = $3, chapter_count = $4 WHERE id = $1",
+            text_id, preview(head), char_count, chapter_count
+        )
+        logger.info(f"Stored text {text_id} as {chapter_count} chapters, {sentence_index} sentences")
+        return sentence_index
+
+    async def create_text(self, user_id: int, title: str, chapters: Chapters,
+                          scaffolding_data: Optional[str] = None) -> Tuple[int, int]:
+        async with self._pool.acquire() as conn, conn.transaction():
+            text_id = await conn.fetchval(
+                "INSERT INTO texts (user_id, title, scaffolding_data) VALUES ($1, $2, $3) RETURNING id",
+                user_id, title, scaffolding_data
+            )
+            return text_id, await self._store_chapters(conn, text_id, chapters)
+
+    async def restore_text(self, user_id: int, text: dict, chapters: StoredChapters) -> Tuple[int, int, int]:
+        # One transaction: the text appears complete or not at all
+        chapter_count = sentence_count = char_count = 0
+        head = ""
+        async with self._pool.acquire() as conn, conn.transaction():
+            text_id = await conn.fetchval('''
+                INSERT INTO texts (user_id, title, scaffolding_data, reading_mode, scaffold_level, vocab_level)
+                VALUES ($1, $2, $3, $4, $5, $6) RETURNING id
+            ''', user_id, text["title"], text["scaffolding_data"], text["reading_mode"],
+                text["scaffold_level"], text["vocab_level"])
+            async for chapter, sentences in iterate_in_threadpool(iter(chapters)):
+                content = chapter["content"]
+                chapter_id = await conn.fetchval('''
+                    INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, sentence_count)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id
+                ''', text_id, chapter["index"], chapter["title"], content, len(content),
+                    sentences[0]["index"] if sentences else 0, len(sentences))
+                await conn.copy_records_to_table(
+                    "sentences", columns=("text_id", "chapter_id", "sentence_index", "content", "translation",
+                                          "analysis_json", "vocab_json", "vocab_max"),
+                    records=[(text_id, chapter_id, r["index"], r["content"], r["translation"], r["analysis_json"],
+                              r["vocab_json"], r["vocab_max"]) for r in sentences]
+                )
+                chapter_count += 1
+                sentence_count += len(sentences)
+                char_count += len(content)
+                if len(head) < CHAPTER_CONFIG["preview_chars"]:
+                    head += content[:CHAPTER_CONFIG["preview_chars"]]
+            await conn.execute('''
+                UPDATE texts SET preview = $2, char_count = $3, chapter_count = $4,
+                    current_paragraph_id = (SELECT id FROM sentences WHERE text_id = $1 AND sentence_index = $5)
+                WHERE id = $1
+            ''', text_id, preview(head), char_count, chapter_count, text["current_sentence"])
+        return text_id, chapter_count, sentence_count
+
+    async def owns_text(self, text_id: int, user_id: int) -> bool:
+        return await self._pool.fetchval(
+            "SELECT 1 FROM texts WHERE id = $1 AND user_id = $2", text_id, user_id
+        ) is not None
+
+    async def update_text(self, text_id: int, title: Optional[str] = None,
+                          scaffolding_data: Optional[str] = None, chapters: Optional[Chapters] = None):
+        async with self._pool.acquire() as conn, conn.transaction():
+            if chapters is not None:
+                await conn.execute("DELETE FROM sentences WHERE text_id = $1", text_id)
+                await conn.execute("DELETE FROM chapters WHERE text_id = $1", text_id)
+                await self._store_chapters(conn, text_id, chapters)
+                await conn.execute("UPDATE texts SET current_paragraph_id = NULL WHERE id = $1", text_id)
+            if title is not None or scaffolding_data is not None or chapters is not None:
+                await conn.execute('''
+                    UPDATE texts SET title = COALESCE($2, title),
+                                     scaffolding_data = COALESCE($3, scaffolding_data),
+                                     updated_at = now()
+                    WHERE id = $1
+                ''', text_id, title, scaffolding_data)
+
+    async def update_progress(self, text_id: int, fields: Dict[str, object]):
+        names = [name for name in PROGRESS_FIELDS if name in fields]
+        if not names:
+            return
+        assignments = ", ".join(f"{name} = ${i + 2}" for i, name in enumerate(names))
+        await self._pool.execute(f"UPDATE texts SET {assignments}, updated_at = now() WHERE id = $1",
+                                 text_id, *(fields[name] for name in names))
+
+    async def delete_text(self, text_id: int, user_id: int) -> bool:
+        # Cascades to chapters, sentences and translation memory signatures
+        deleted = await self._pool.fetchval(
+            "DELETE FROM texts WHERE id = $1 AND user_id = $2 RETURNING id", text_id, user_id
+        )
+        return deleted is not None
+
+    async def list_chapters(self, text_id: int) -> List[dict]:
+        rows = await self._pool.fetch(
+            f"SELECT {CHAPTER_COLUMNS} FROM chapters WHERE text_id = $1 ORDER BY chapter_index", text_id
+        )
+        return [dict(r) for r in rows]
+
+    async def get_chapter(self, text_id: int, chapter_index: int) -> Optional[dict]:
+        return _row(await self._pool.fetchrow(
+            f"SELECT {CHAPTER_COLUMNS}, content FROM chapters WHERE text_id = $1 AND chapter_index = $2",
+            text_id, chapter_index
+        ))
+
+    # ---- Sentences ----
+
+    async def list_sentences(self, text_id: int, chapter_index: Optional[int] = None) -> List[dict]:
+        if chapter_index is None:
+            rows = await self._pool.fetch(
+                f"SELECT {SENTENCE_COLUMNS} FROM sentences s WHERE s.text_id = $1 ORDER BY s.sentence_index",
+                text_id
+            )
+        else:
+            rows = await self._pool.fetch(f'''
+                SELECT {SENTENCE_COLUMNS} FROM chapters c JOIN sentences s ON s.chapter_id = c.id
+                WHERE c.text_id = $1 AND c.chapter_index = $2
+                ORDER BY s.sentence_index
+            ''', text_id, chapter_index)
+        return [dict(r) for r in rows]
+
+    async def get_owned_sentences(self, sentence_ids: List[int], user_id: int) -> Dict[int, dict]:
+        rows = await self._pool.fetch(f'''
+            SELECT {SENTENCE_COLUMNS}, t.vocab_level FROM sentences s
+            JOIN texts t ON s.text_id = t.id
+            WHERE t.user_id = $1 AND s.id = ANY($2::bigint[])
+        ''', user_id, list(set(sentence_ids)))
+        return {r["id"]: dict(r) for r in rows}
+
+    async def next_unanalyzed(self, text_id: int, sentence_id: int, limit: int) -> List[dict]:
+        rows = await self._pool.fetch('''
+            SELECT s.id, s.content, s.vocab_json, t.vocab_level
+            FROM sentences cur
+            JOIN texts t ON t.id = cur.text_id
+            JOIN sentences s ON s.text_id = cur.text_id AND s.sentence_index > cur.sentence_index
+            WHERE cur.id = $1 AND cur.text_id = $2
+              AND (s.translation IS NULL OR s.analysis_json IS NULL)
+            ORDER BY s.sentence_index
+            LIMIT $3
+        ''', sentence_id, text_id, limit)
+        return [dict(r) for r in rows]
+
+    async def update_sentences(self, text_id: int,
+                               updates: List[Tuple[int, Optional[str], Optional[str]]]) -> List[int]:
+        merged = _merge(updates)
+        if not merged:
+            return []
+        async with self._pool.acquire() as conn, conn.transaction():
+            rows = await conn.fetch('''
+                UPDATE sentences s
+                SET translation = COALESCE(u.translation, s.translation),
+                    analysis_json = COALESCE(u.analysis_json, s.analysis_json)
+                FROM unnest($2::bigint[], $3::text[], $4::text[]) AS u (id, translation, analysis_json)
+                WHERE s.id = u.id AND s.text_id = $1
+                RETURNING s.id, s.content
+            ''', text_id, list(merged), [v[0] for v in merged.values()], [v[1] for v in merged.values()])
+            await _index_memory(conn, [(r["id"], r["content"]) for r in rows if merged[r["id"]] != [None, None]])
+        return [r["id"] for r in rows]
+
+    async def update_sentence(self, sentence_id: int, user_id: int, translation: Optional[str] = None,
+                              analysis_json: Optional[str] = None) -> Optional[dict]:
+        async with self._pool.acquire() as conn, conn.transaction():
+            row = _row(await conn.fetchrow(f'''
+                UPDATE sentences s
+                SET translation = COALESCE($3, s.translation),
+                    analysis_json = COALESCE($4, s.analysis_json)
+                FROM texts t
+                WHERE s.id = $1 AND t.id = s.text_id AND t.user_id = $2
+                RETURNING {SENTENCE_COLUMNS}
+            ''', sentence_id, user_id, translation, analysis_json))
+            if row and (translation is not None or analysis_json is not None):
+                await _index_memory(conn, [(row["id"], row["content"])])
+        return row
+
+    async def save_analyses(self, results: List[Tuple[int, str, str, str]]):
+        if not results:
+            return
+        async with self._pool.acquire() as conn, conn.transaction():
+            await conn.execute('''
+                UPDATE sentences s SET translation = u.translation, analysis_json = u.analysis_json
+                FROM unnest($1::bigint[], $2::text[], $3::text[]) AS u (id, translation, analysis_json)
+                WHERE s.id = u.id
+            ''', [r[0] for r in results], [r[2] for r in results], [r[3] for r in results])
+            await _index_memory(conn, [(r[0], r[1]) for r in results])
+
+    # ---- Derived data ----
+
+    async def sentence_batches(self, text_id: Optional[int], batch_size: int, analyzed: bool = False):
+        where = "translation IS NOT NULL AND analysis_json IS NOT NULL" if analyzed else "true"
+        after = 0 if text_id is None else -1
+        while True:
+            if text_id is None:
+                rows = await self._pool.fetch(f'''
+                    SELECT id, sentence_index, content FROM sentences
+                    WHERE id > $1 AND {where} ORDER BY id LIMIT $2
+                ''', after, batch_size)
+            else:
+                rows = await self._pool.fetch(f'''
+                    SELECT id, sentence_index, content FROM sentences
+                    WHERE text_id = $1 AND sentence_index > $2 AND {where} ORDER BY sentence_index LIMIT $3
+                ''', text_id, after, batch_size)
+            if not rows:
+                return
+            yield [dict(r) for r in rows]
+            after = rows[-1]["id" if text_id is None else "sentence_index"]
+
+    async def get_text_sentences(self, text_id: int, sentence_ids: List[int]) -> Dict[int, dict]:
+        rows = await self._pool.fetch(
+            "SELECT id, sentence_index, content FROM sentences WHERE text_id = $1 AND id = ANY($2::bigint[])",
+            text_id, list(set(sentence_ids))
+        )
+        return {r["id"]: dict(r) for r in rows}
+
+    async def set_vocab(self, updates: List[Tuple[int, str, int]]):
+        if not updates:
+            return
+        await self._pool.execute('''
+            UPDATE sentences s SET vocab_json = u.vocab_json, vocab_max = u.vocab_max
+            FROM unnest($1::bigint[], $2::text[], $3::int[]) AS u (id, vocab_json, vocab_max)
+            WHERE s.id = u.id
+        ''', [u[0] for u in updates], [u[1] for u in updates], [u[2] for u in updates])
+
+    async def add_to_memory(self, sentences: List[Tuple[int, str]]):
+        if not sentences:
+            return
+        async with self._pool.acquire() as conn, conn.transaction():
+            await _index_memory(conn, sentences)
+
+    async def memory_candidates(self, band_keys: List[int], limit: int) -> List[dict]:
+        rows = await self._pool.fetch('''
+            SELECT b.sentence_id, ts.signature, s.translation, s.analysis_json
+            FROM (
+                SELECT sentence_id, COUNT(*) AS hits FROM tm_bands
+                WHERE band_key = ANY($1::bigint[])
+                GROUP BY sentence_id ORDER BY hits DESC LIMIT $2
+            ) b
+            JOIN tm_signatures ts ON ts.sentence_id = b.sentence_id
+            JOIN sentences s ON s.id = b.sentence_id
+            WHERE s.translation IS NOT NULL AND s.analysis_json IS NOT NULL
+        ''', band_keys, limit)
+        return [dict(r) for r in rows]
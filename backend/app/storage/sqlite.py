@@ -0,0 +1,507 @@
+"""
+SQLite storage backend: the schema and connections of app/database.py, with
+every call run in the threadpool so the event loop never waits on the file.
+JSON columns are compressed at rest by app/codec.py, and sentence writes
+feed the translation memory in the same transaction.
+"""
+
+import sqlite3
+from typing import Callable, Dict, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from app import codec
+from app.config import CHAPTER_CONFIG
+from app.database import get_db
+from app.services import translation_memory
+from app.services.chapters import chapter_of_sentence, preview, replace_chapters, store_chapters
+from app.storage.base import Chapters, InsufficientCredits, Storage, StoredChapters
+
+# Everything but the (legacy) content column; book text is read per chapter
+TEXT_COLUMNS = '''
+    id, user_id, title, preview, char_count, chapter_count, scaffolding_data,
+    reading_mode, scaffold_level, vocab_level, current_paragraph_id, created_at, updated_at
+'''
+CHAPTER_COLUMNS = "chapter_index, title, char_count, sentence_start, sentence_count"
+PROGRESS_FIELDS = ("reading_mode", "scaffold_level", "vocab_level", "current_paragraph_id")
+
+# Stay well under SQLITE_MAX_VARIABLE_NUMBER for the id IN (...) lookups
+ID_CHUNK = 500
+
+
+def _text(row) -> dict:
+    t = dict(row)
+    t["scaffolding_data"] = codec.decode(t["scaffolding_data"])
+    return t
+
+
+def _sentence(row) -> dict:
+    r = dict(row)
+    r["analysis_json"] = codec.decode(r["analysis_json"])
+    return r
+
+
+def _restore_chapters(cursor, text_id: int, chapters: StoredChapters,
+                      current_sentence: Optional[int]) -> Tuple[int, int]:
+    """Write exported chapters with their sentences, committing each; returns (chapters, sentences)"""
+    chapter_count = sentence_count = char_count = 0
+    head = ""
+    for chapter, sentences in chapters:
+        content = chapter["content"]
+        cursor.execute('''
+            INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, sentence_count)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (text_id, chapter["index"], chapter["title"], codec.encode(content, codec.KIND_CONTENT), len(content),
+              sentences[0]["index"] if sentences else 0, len(sentences)))
+        chapter_id = cursor.lastrowid
+        cursor.executemany('''
+            INSERT INTO sentences (text_id, chapter_id, sentence_index, content, translation,
+                                   analysis_json, vocab_json, vocab_max)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [(text_id, chapter_id, r["index"], r["content"], r["translation"],
+               codec.encode(r["analysis_json"], codec.KIND_ANALYSIS), r["vocab_json"], r["vocab_max"])
+              for r in sentences])
+        cursor.connection.commit()
+        chapter_count += 1
+        sentence_count += len(sentences)
+        char_count += len(content)
+        if len(head) < CHAPTER_CONFIG["preview_chars"]:
+            head += content[:CHAPTER_CONFIG["preview_chars"]]
+    cursor.execute('''
+        UPDATE texts SET preview = ?, char_count = ?, chapter_count = ?,
+            current_paragraph_id = (SELECT id FROM sentences WHERE text_id = ? AND sentence_index = ?)
+        WHERE id = ?
+    ''', (preview(head), char_count, chapter_count, text_id, current_sentence, text_id))
+    return chapter_count, sentence_count
+
+
+class SQLiteStorage(Storage):
+    name = "sqlite"
+
+    # ---- Users and credits ----
+
+    def _get_user(self, user_id: int) -> Optional[dict]:
+        with get_db() as conn:
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            return dict(row) if row else None
+
+    async def get_user(self, user_id: int) -> Optional[dict]:
+        return await run_in_threadpool(self._get_user, user_id)
+
+    def _get_user_by_email(self, email: str) -> Optional[dict]:
+        with get_db() as conn:
+            row = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+            return dict(row) if row else None
+
+    async def get_user_by_email(self, email: str) -> Optional[dict]:
+        return await run_in_threadpool(self._get_user_by_email, email)
+
+    def _create_user(self, email: str, password_hash: str) -> Optional[dict]:
+        with get_db() as conn:
+            try:
+                cursor = conn.execute("INSERT INTO users (email, password_hash) VALUES (?, ?)",
+                                      (email, password_hash))
+            except sqlite3.IntegrityError:
+                return None
+            return dict(conn.execute("SELECT * FROM users WHERE id = ?", (cursor.lastrowid,)).fetchone())
+
+    async def create_user(self, email: str, password_hash: str) -> Optional[dict]:
+        return await run_in_threadpool(self._create_user, email, password_hash)
+
+    def _set_password_hash(self, user_id: int, password_hash: str):
+        with get_db() as conn:
+            conn.execute("UPDATE users SET password_hash = ? WHERE id = ?", (password_hash, user_id))
+
+    async def set_password_hash(self, user_id: int, password_hash: str):
+        await run_in_threadpool(self._set_password_hash, user_id, password_hash)
+
+    def _add_credits(self, user_id: int, amount: int) -> Optional[dict]:
+        with get_db() as conn:
+            conn.execute("UPDATE users SET credits = COALESCE(credits, 0) + ? WHERE id = ?", (amount, user_id))
+            row = conn.execute("SELECT * FROM users WHERE id = ?", (user_id,)).fetchone()
+            return dict(row) if row else None
+
+    async def add_credits(self, user_id: int, amount: int) -> Optional[dict]:
+        return await run_in_threadpool(self._add_credits, user_id, amount)
+
+    def _deduct_credits(self, user_id: int, amount: int, partial: bool) -> Optional[int]:
+        with get_db() as conn:
+            if partial:
+                row = conn.execute(
+                    "UPDATE users SET credits = MAX(COALESCE(credits, 0) - ?, 0) WHERE id = ? RETURNING credits",
+                    (amount, user_id)
+                ).fetchone()
+                return row["credits"] if row else None
+            row = conn.execute(
+                "UPDATE users SET credits = credits - ? WHERE id = ? AND credits >= ? RETURNING credits",
+                (amount, user_id, amount)
+            ).fetchone()
+            if row:
+                return row["credits"]
+            row = conn.execute("SELECT credits FROM users WHERE id = ?", (user_id,)).fetchone()
+            if not row:
+                return None
+            raise InsufficientCredits(row["credits"] or 0)
+
+    async def deduct_credits(self, user_id: int, amount: int, partial: bool = False) -> Optional[int]:
+        return await run_in_threadpool(self._deduct_credits, user_id, amount, partial)
+
+    # ---- Texts and chapters ----
+
+    def _list_texts(self, user_id: int) -> List[dict]:
+        with get_db() as conn:
+            rows = conn.execute(
+                f"SELECT {TEXT_COLUMNS} FROM texts WHERE user_id = ? AND NOT importing ORDER BY updated_at DESC",
+                (user_id,)
+            ).fetchall()
+            return [_text(r) for r in rows]
+
+    async def list_texts(self, user_id: int) -> List[dict]:
+        return await run_in_threadpool(self._list_texts, user_id)
+
+    def _get_text(self, text_id: int, user_id: int) -> Optional[dict]:
+        with get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {TEXT_COLUMNS} FROM texts WHERE id = ? AND user_id = ? AND NOT importing",
+                           (text_id, user_id))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            t = _text(row)
+            t["current_chapter"] = chapter_of_sentence(cursor, t["current_paragraph_id"])
+            return t
+
+    async def get_text(self, text_id: int, user_id: int) -> Optional[dict]:
+        return await run_in_threadpool(self._get_text, text_id, user_id)
+
+    def _import_text(self, columns: Dict[str, object], fill: Callable[[sqlite3.Cursor, int], tuple]) -> tuple:
+        """Insert a texts row and fill in its chapters: (text_id, *fill's counts)"""
+        # chapter_count is set (legacy migration skips it) and the text is hidden
+        # until its last chapter is in; a crash leaves it to discard_interrupted_imports
+        with get_db() as conn:
+            text_id = conn.execute(
+                f"INSERT INTO texts ({', '.join(columns)}, content, chapter_count, importing) "
+                f"VALUES ({', '.join('?' * len(columns))}, '', 0, 1)",
+                list(columns.values())
+            ).lastrowid
+        # A whole book in one transaction would lock out every other writer
+        # (progress, credits, analyses) for the length of the import
+        try:
+            with get_db() as conn:
+                counts = fill(conn.cursor(), text_id)
+                conn.execute("UPDATE texts SET importing = 0 WHERE id = ?", (text_id,))
+                return (text_id, *counts)
+        except BaseException:
+            # Chapters are already committed: drop the partial text (cascades to its rows)
+            with get_db() as conn:
+                conn.execute("DELETE FROM texts WHERE id = ?", (text_id,))
+            raise
+
+    def _create_text(self, user_id: int, title: str, chapters: Chapters,
+                     scaffolding_data: Optional[str]) -> Tuple[int, int]:
+        return self._import_text(
+            {"user_id": user_id, "title": title,
+             "scaffolding_data": codec.encode(scaffolding_data, codec.KIND_SCAFFOLDING)},
+            lambda cursor, text_id: (store_chapters(cursor, text_id, chapters, commit=True),)
+        )
+
+    async def create_text(self, user_id: int, title: str, chapters: Chapters,
+                          scaffolding_data: Optional[str] = None) -> Tuple[int, int]:
+        return await run_in_threadpool(self._create_text, user_id, title, chapters, scaffolding_data)
+
+    def _restore_text(self, user_id: int, text: dict, chapters: StoredChapters) -> Tuple[int, int, int]:
+        return self._import_text(
+            {"user_id": user_id, "title": text["title"],
+             "scaffolding_data": codec.encode(text["scaffolding_data"], codec.KIND_SCAFFOLDING),
+             "reading_mode": text["reading_mode"], "scaffold_level": text["scaffold_level"],
+             "vocab_level": text["vocab_level"]},
+            lambda cursor, text_id: _restore_chapters(cursor, text_id, chapters, text["current_sentence"])
+        )
+
+    async def restore_text(self, user_id: int, text: dict, chapters: StoredChapters) -> Tuple[int, int, int]:
+        return await run_in_threadpool(self._restore_text, user_id, text, chapters)
+
+    def _owns_text(self, text_id: int, user_id: int) -> bool:
+        with get_db() as conn:
+            return conn.execute("SELECT 1 FROM texts WHERE id = ? AND user_id = ? AND NOT importing",
+                                (text_id, user_id)).fetchone() is not None
+
+    async def owns_text(self, text_id: int, user_id: int) -> bool:
+        return await run_in_threadpool(self._owns_text, text_id, user_id)
+
+    def _update_text(self, text_id: int, title: Optional[str], scaffolding_data: Optional[str],
+                     chapters: Optional[Chapters]):
+        updates = []
+        params = []
+        if title is not None:
+            updates.append("title = ?"); params.append(title)
+        if scaffolding_data is not None:
+            updates.append("scaffolding_data = ?")
+            params.append(codec.encode(scaffolding_data, codec.KIND_SCAFFOLDING))
+        with get_db() as conn:
+            cursor = conn.cursor()
+            if chapters is not None:
+                replace_chapters(cursor, text_id, chapters)
+                updates.append("current_paragraph_id = NULL")
+            if updates:
+                updates.append("updated_at = CURRENT_TIMESTAMP")
+                cursor.execute(f"UPDATE texts SET {', '.join(updates)} WHERE id = ?", [*params, text_id])
+
+    async def update_text(self, text_id: int, title: Optional[str] = None,
+                          scaffolding_data: Optional[str] = None, chapters: Optional[Chapters] = None):
+        await run_in_threadpool(self._update_text, text_id, title, scaffolding_data, chapters)
+
+    def _update_progress(self, text_id: int, fields: Dict[str, object]):
+        updates = [f"{name} = ?" for name in PROGRESS_FIELDS if name in fields]
+        if not updates:
+            return
+        with get_db() as conn:
+            conn.execute(
+                f"UPDATE texts SET {', '.join(updates)}, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                [*(fields[name] for name in PROGRESS_FIELDS if name in fields), text_id]
+            )
+
+    async def update_progress(self, text_id: int, fields: Dict[str, object]):
+        await run_in_threadpool(self._update_progress, text_id, fields)
+
+    def _delete_text(self, text_id: int, user_id: int) -> bool:
+        with get_db() as conn:
+            # Cascades to chapters, sentences and translation memory signatures
+            return conn.execute("DELETE FROM texts WHERE id = ? AND user_id = ?",
+                                (text_id, user_id)).rowcount > 0
+
+    async def delete_text(self, text_id: int, user_id: int) -> bool:
+        return await run_in_threadpool(self._delete_text, text_id, user_id)
+
+    def _list_chapters(self, text_id: int) -> List[dict]:
+        with get_db() as conn:
+            rows = conn.execute(
+                f"SELECT {CHAPTER_COLUMNS} FROM chapters WHERE text_id = ? ORDER BY chapter_index", (text_id,)
+            ).fetchall()
+            return [dict(r) for r in rows]
+
+    async def list_chapters(self, text_id: int) -> List[dict]:
+        return await run_in_threadpool(self._list_chapters, text_id)
+
+    def _get_chapter(self, text_id: int, chapter_index: int) -> Optional[dict]:
+        with get_db() as conn:
+            row = conn.execute(
+                f"SELECT {CHAPTER_COLUMNS}, content FROM chapters WHERE text_id = ? AND chapter_index = ?",
+                (text_id, chapter_index)
+            ).fetchone()
+            if not row:
+                return None
+            c = dict(row)
+            c["content"] = codec.decode(c["content"])
+            return c
+
+    async def get_chapter(self, text_id: int, chapter_index: int) -> Optional[dict]:
+        return await run_in_threadpool(self._get_chapter, text_id, chapter_index)
+
+    # ---- Sentences ----
+
+    def _list_sentences(self, text_id: int, chapter_index: Optional[int]) -> List[dict]:
+        with get_db() as conn:
+            if chapter_index is None:
+                rows = conn.execute(
+                    "SELECT * FROM sentences WHERE text_id = ? ORDER BY sentence_index ASC", (text_id,)
+                ).fetchall()
+            else:
+                rows = conn.execute('''
+                    SELECT s.* FROM chapters c JOIN sentences s ON s.chapter_id = c.id
+                    WHERE c.text_id = ? AND c.chapter_index = ?
+                    ORDER BY s.sentence_index ASC
+                ''', (text_id, chapter_index)).fetchall()
+            return [_sentence(r) for r in rows]
+
+    async def list_sentences(self, text_id: int, chapter_index: Optional[int] = None) -> List[dict]:
+        return await run_in_threadpool(self._list_sentences, text_id, chapter_index)
+
+    def _get_owned_sentences(self, sentence_ids: List[int], user_id: int) -> Dict[int, dict]:
+        rows = {}
+        ids = list(set(sentence_ids))
+        with get_db() as conn:
+            for i in range(0, len(ids), ID_CHUNK):
+                chunk = ids[i:i + ID_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows.update((r["id"], _sentence(r)) for r in conn.execute(f'''
+                    SELECT s.*, t.vocab_level FROM sentences s
+                    JOIN texts t ON s.text_id = t.id
+                    WHERE t.user_id = ? AND s.id IN ({placeholders})
+                ''', [user_id, *chunk]).fetchall())
+        return rows
+
+    async def get_owned_sentences(self, sentence_ids: List[int], user_id: int) -> Dict[int, dict]:
+        return await run_in_threadpool(self._get_owned_sentences, sentence_ids, user_id)
+
+    def _next_unanalyzed(self, text_id: int, sentence_id: int, limit: int) -> List[dict]:
+        with get_db() as conn:
+            current = conn.execute('''
+                SELECT s.sentence_index, t.vocab_level FROM sentences s
+                JOIN texts t ON s.text_id = t.id
+                WHERE s.id = ? AND s.text_id = ?
+            ''', (sentence_id, text_id)).fetchone()
+            if not current:
+                return []
+            rows = conn.execute('''
+                SELECT id, content, vocab_json FROM sentences
+                WHERE text_id = ? AND sentence_index > ?
+                  AND (translation IS NULL OR analysis_json IS NULL)
+                ORDER BY sentence_index ASC
+                LIMIT ?
+            ''', (text_id, current["sentence_index"], limit)).fetchall()
+            return [dict(r, vocab_level=current["vocab_level"]) for r in rows]
+
+    async def next_unanalyzed(self, text_id: int, sentence_id: int, limit: int) -> List[dict]:
+        return await run_in_threadpool(self._next_unanalyzed, text_id, sentence_id, limit)
+
+    def _update_sentences(self, text_id: int,
+                          updates: List[Tuple[int, Optional[str], Optional[str]]]) -> List[int]:
+        with get_db() as conn:
+            # Resolve which of the requested ids actually belong to this text
+            requested_ids = list({sid for sid, _, _ in updates})
+            existing = {}  # id -> content
+            for i in range(0, len(requested_ids), ID_CHUNK):
+                chunk = requested_ids[i:i + ID_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                existing.update((r["id"], r["content"]) for r in conn.execute(
+                    f"SELECT id, content FROM sentences WHERE text_id = ? AND id IN ({placeholders})",
+                    [text_id, *chunk]
+                ).fetchall())
+
+            params = [(translation, codec.encode(analysis_json, codec.KIND_ANALYSIS), sid)
+                      for sid, translation, analysis_json in updates
+                      if sid in existing and (translation is not None or analysis_json is not None)]
+            # COALESCE keeps the stored value for fields the item leaves unset,
+            # so every row goes through the same prepared statement.
+            if params:
+                conn.executemany(
+                    """UPDATE sentences
+                       SET translation = COALESCE(?, translation),
+                           analysis_json = COALESCE(?, analysis_json)
+                       WHERE id = ?""",
+                    params
+                )
+                translation_memory.add_sentences(conn, [(sid, existing[sid]) for _, _, sid in params])
+            return list(existing)
+
+    async def update_sentences(self, text_id: int,
+                               updates: List[Tuple[int, Optional[str], Optional[str]]]) -> List[int]:
+        return await run_in_threadpool(self._update_sentences, text_id, updates)
+
+    def _update_sentence(self, sentence_id: int, user_id: int, translation: Optional[str],
+                         analysis_json: Optional[str]) -> Optional[dict]:
+        with get_db() as conn:
+            owned = conn.execute('''
+                SELECT 1 FROM sentences p
+                JOIN texts t ON p.text_id = t.id
+                WHERE p.id = ? AND t.user_id = ?
+            ''', (sentence_id, user_id)).fetchone()
+            if not owned:
+                return None
+            if translation is not None or analysis_json is not None:
+                conn.execute(
+                    "UPDATE sentences SET translation = COALESCE(?, translation), "
+                    "analysis_json = COALESCE(?, analysis_json) WHERE id = ?",
+                    (translation, codec.encode(analysis_json, codec.KIND_ANALYSIS), sentence_id)
+                )
+            r = _sentence(conn.execute("SELECT * FROM sentences WHERE id = ?", (sentence_id,)).fetchone())
+            if translation is not None or analysis_json is not None:
+                translation_memory.add_sentences(conn, [(r["id"], r["content"])])
+            return r
+
+    async def update_sentence(self, sentence_id: int, user_id: int, translation: Optional[str] = None,
+                              analysis_json: Optional[str] = None) -> Optional[dict]:
+        return await run_in_threadpool(self._update_sentence, sentence_id, user_id, translation, analysis_json)
+
+    def _save_analyses(self, results: List[Tuple[int, str, str, str]]):
+        with get_db() as conn:
+            conn.executemany(
+                "UPDATE sentences SET translation = ?, analysis_json = ? WHERE id = ?",
+                [(translation, codec.encode(analysis_json, codec.KIND_ANALYSIS), sid)
+                 for sid, _, translation, analysis_json in results]
+            )
+            translation_memory.add_sentences(conn, [(sid, content) for sid, content, _, _ in results])
+
+    async def save_analyses(self, results: List[Tuple[int, str, str, str]]):
+        if results:
+            await run_in_threadpool(self._save_analyses, results)
+
+    # ---- Derived data ----
+
+    def _sentence_batch(self, text_id: Optional[int], after: int, batch_size: int, analyzed: bool) -> List[dict]:
+        where = "translation IS NOT NULL AND analysis_json IS NOT NULL" if analyzed else "1"
+        with get_db() as conn:
+            if text_id is None:
+                rows = conn.execute(f'''
+                    SELECT id, sentence_index, content FROM sentences
+                    WHERE id > ? AND {where} ORDER BY id LIMIT ?
+                ''', (after, batch_size)).fetchall()
+            else:
+                rows = conn.execute(f'''
+                    SELECT id, sentence_index, content FROM sentences
+                    WHERE text_id = ? AND sentence_index > ? AND {where} ORDER BY sentence_index LIMIT ?
+                ''', (text_id, after, batch_size)).fetchall()
+            return [dict(r) for r in rows]
+
+    async def sentence_batches(self, text_id: Optional[int], batch_size: int, analyzed: bool = False):
+        # Keyset pagination, one short read transaction per batch
+        after = 0 if text_id is None else -1
+        while True:
+            rows = await run_in_threadpool(self._sentence_batch, text_id, after, batch_size, analyzed)
+            if not rows:
+                return
+            yield rows
+            after = rows[-1]["id" if text_id is None else "sentence_index"]
+
+    def _get_text_sentences(self, text_id: int, sentence_ids: List[int]) -> Dict[int, dict]:
+        rows = {}
+        ids = list(set(sentence_ids))
+        with get_db() as conn:
+            for i in range(0, len(ids), ID_CHUNK):
+                chunk = ids[i:i + ID_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                rows.update((r["id"], dict(r)) for r in conn.execute(
+                    f"SELECT id, sentence_index, content FROM sentences WHERE text_id = ? AND id IN ({placeholders})",
+                    [text_id, *chunk]
+                ).fetchall())
+        return rows
+
+    async def get_text_sentences(self, text_id: int, sentence_ids: List[int]) -> Dict[int, dict]:
+        return await run_in_threadpool(self._get_text_sentences, text_id, sentence_ids)
+
+    def _set_vocab(self, updates: List[Tuple[int, str, int]]):
+        with get_db() as conn:
+            conn.executemany("UPDATE sentences SET vocab_json = ?, vocab_max = ? WHERE id = ?",
+                             [(vocab_json, vocab_max, sid) for sid, vocab_json, vocab_max in updates])
+
+    async def set_vocab(self, updates: List[Tuple[int, str, int]]):
+        if updates:
+            await run_in_threadpool(self._set_vocab, updates)
+
+    def _add_to_memory(self, sentences: List[Tuple[int, str]]):
+        with get_db() as conn:
+            translation_memory.add_sentences(conn, sentences)
+
+    async def add_to_memory(self, sentences: List[Tuple[int, str]]):
+        if sentences:
+            await run_in_threadpool(self._add_to_memory, sentences)
+
+    def _memory_candidates(self, band_keys: List[int], limit: int) -> List[dict]:
+        placeholders = ", ".join("?" * len(band_keys))
+        with get_db() as conn:
+            rows = conn.execute(f'''
+                SELECT b.sentence_id, ts.signature, s.translation, s.analysis_json
+                FROM (
+                    SELECT sentence_id, COUNT(*) AS hits FROM tm_bands
+                    WHERE band_key IN ({placeholders})
+                    GROUP BY sentence_id ORDER BY hits DESC LIMIT ?
+                ) b
+                JOIN tm_signatures ts ON ts.sentence_id = b.sentence_id
+                JOIN sentences s ON s.id = b.sentence_id
+                WHERE s.translation IS NOT NULL AND s.analysis_json IS NOT NULL
+            ''', [*band_keys, limit]).fetchall()
+            return [_sentence(r) for r in rows]
+
+    async def memory_candidates(self, band_keys: List[int], limit: int) -> List[dict]:
+        return await run_in_threadpool(self._memory_candidates, band_keys, limit)
@@ -0,0 +1,144 @@
+"""
+Password hashing benchmark: login throughput and event-loop lag in a burst.
+
+Seeds a scratch SQLite database with users, then fires --logins concurrent
+POST /auth/login handler calls (--concurrency at a time) while a ticker
+stands in for a streaming reader: it wakes every --tick-ms and records how
+late it was, which is how long the loop was blocked. Scenarios:
+
+    sha256 inline       legacy salted SHA-256, hashed on the loop (before)
+    scrypt inline       scrypt on the loop: what a naive upgrade would do
+    scrypt pool         scrypt on the bounded KDF pool (current handler)
+    sha256->scrypt      first login of legacy users: verify + rehash + store
+
+    cd backend
+    python -m benchmarks.auth --logins 200 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import hashlib
+import os
+import secrets
+import sys
+import tempfile
+import time
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def legacy_hash(password: str) -> str:
+    salt = secrets.token_hex(16)
+    return f"{salt}${hashlib.sha256((salt + password).encode()).hexdigest()}"
+
+
+async def ticker(interval: float, lags: list, stop: asyncio.Event):
+    expected = time.perf_counter() + interval
+    while not stop.is_set():
+        await asyncio.sleep(max(0.0, expected - time.perf_counter()))
+        now = time.perf_counter()
+        lags.append(now - expected)
+        expected = max(expected + interval, now)
+
+
+async def run_scenario(name, args, hashes, kdf, rehash) -> dict:
+    from app.models.auth import UserLogin
+    from app.routers import auth as auth_router
+    from app.services import auth as auth_service
+    from app.storage import get_storage
+
+    storage = get_storage()
+    emails = []
+    for i in range(args.logins):
+        email = f"{name.replace(' ', '_').replace('>', '')}-{i}@bench.example"
+        await storage.create_user(email, hashes[i % len(hashes)])
+        emails.append(email)
+
+    async def inline(func, *args):
+        return func(*args)
+
+    auth_router.kdf = kdf or inline
+    auth_router.needs_rehash = auth_service.needs_rehash if rehash else (lambda hashed: False)
+
+    gate = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def login(email):
+        async with gate:
+            started = time.perf_counter()
+            await auth_router.login(UserLogin(email=email, password=args.password))
+            latencies.append(time.perf_counter() - started)
+
+    lags, stop = [], asyncio.Event()
+    tick = asyncio.create_task(ticker(args.tick_ms / 1000, lags, stop))
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await asyncio.gather(*(login(e) for e in emails))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick
+
+    upgraded = 0
+    if rehash:
+        for email in emails:
+            user = await storage.get_user_by_email(email)
+            upgraded += not auth_service.needs_rehash(user["password_hash"])
+    return {
+        "rate": len(emails) / elapsed,
+        "p50": percentile(latencies, .5) * 1000,
+        "p95": percentile(latencies, .95) * 1000,
+        "lag_p50": percentile(lags, .5) * 1000,
+        "lag_p99": percentile(lags, .99) * 1000,
+        "lag_max": max(lags, default=0.0) * 1000,
+        "upgraded": upgraded,
+    }
+
+
+async def run(args):
+    from app.config import PASSWORD_HASH_CONFIG
+    from app.routers.auth import kdf
+    from app.services.auth import hash_password
+    from app.storage import get_storage
+
+    PASSWORD_HASH_CONFIG["max_waiting"] = max(PASSWORD_HASH_CONFIG["max_waiting"], args.concurrency)
+    await get_storage().open()
+    legacy = [legacy_hash(args.password) for _ in range(16)]
+    scrypt = [hash_password(args.password) for _ in range(4)]
+    scenarios = [
+        ("sha256 inline", legacy, None, False),
+        ("scrypt inline", scrypt, None, False),
+        ("scrypt pool", scrypt, kdf, False),
+        ("sha256->scrypt", legacy, kdf, True),
+    ]
+    print(f"scrypt n={PASSWORD_HASH_CONFIG['n']} r={PASSWORD_HASH_CONFIG['r']} p={PASSWORD_HASH_CONFIG['p']}, "
+          f"{PASSWORD_HASH_CONFIG['workers']} KDF workers, {args.logins} logins, {args.concurrency} at a time\n")
+    print(f"{'scenario':<16}{'logins/s':>10}{'login p50/p95 ms':>22}{'loop lag p50/p99/max ms':>30}")
+    for name, hashes, kdf_func, rehash in scenarios:
+        r = await run_scenario(name, args, hashes, kdf_func, rehash)
+        note = f"  ({r['upgraded']} rehashed)" if rehash else ""
+        print(f"{name:<16}{r['rate']:>10.1f}{r['p50']:>13.1f} / {r['p95']:<7.1f}"
+              f"{r['lag_p50']:>13.1f} / {r['lag_p99']:.1f} / {r['lag_max']:<7.1f}{note}")
+    await get_storage().close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput and event-loop lag by password hashing scheme")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--tick-ms", type=float, default=5.0, help="interval of the simulated streaming reader")
+    parser.add_argument("--password", default="correct horse battery staple")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="auth_bench_")
+    os.environ["DATABASE_PATH"] = os.path.join(workdir, "auth_bench.db")
+    os.environ["STORAGE_BACKEND"] = "sqlite"
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+Local stand-ins for the upstream services, for load tests.
+
+Serves the DashScope text-generation endpoint (plain and SSE), Gemini
+generateContent / streamGenerateContent and the edge-tts websocket with
+configurable latency, jitter and streaming cadence. Model replies are
+analysis-shaped JSON (a {"results": [...]} batch when the user message is a
+JSON array of {"id", "text"} items), so the analysis path parses and stores
+them like real output.
+
+    cd backend
+    python -m benchmarks.fake_upstreams --port 8900 --latency-ms 400 --jitter-ms 150
+
+Point the app at it with
+    ALIYUN_BASE_URL=http://127.0.0.1:8900 GOOGLE_BASE_URL=http://127.0.0.1:8900
+    EDGE_TTS_WSS_URL="ws://127.0.0.1:8900/edge/v1?TrustedClientToken=stub"
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import uuid
+
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+
+SETTINGS = {
+    "latency_ms": 400.0,       # before the first byte
+    "jitter_ms": 150.0,        # +/- uniform
+    "chunks": 12,              # streamed chunks per reply
+    "chunk_interval_ms": 40.0,
+    "error_rate": 0.0,         # fraction of calls answered with HTTP 500
+    "audio_frames": 8,         # edge-tts binary frames per turn
+    "audio_frame_bytes": 4096,
+}
+
+app = FastAPI(title="Fake upstreams")
+
+
+async def _pause(ms: float):
+    jitter = SETTINGS["jitter_ms"] * (2 * random.random() - 1)
+    await asyncio.sleep(max(0.0, ms + jitter) / 1000)
+
+
+def _failing() -> bool:
+    return random.random() < SETTINGS["error_rate"]
+
+
+def _analysis(text: str) -> dict:
+    words = [w.strip(".,!?;:") for w in text.split() if len(w) > 3][:4]
+    return {
+        "translation": f"【译】{text[:80]}",
+        "knowledge": [{"key": w.lower(), "word": w, "ipa": f"/{w.lower()}/", "def": "释义",
+                       "clue": "A stub definition", "diff": 3, "context": text[:40]} for w in words],
+        "insight": {"tag": "Theme", "text": "桩服务生成的解读。"},
+        "xray": {"pattern": "主谓宾", "breakdown": "主句", "keyWords": [], "explanation": "桩服务生成的结构分析。"},
+        "companion": None,
+    }
+
+
+def _reply(user_query: str) -> str:
+    try:
+        items = json.loads(user_query)
+    except ValueError:
+        items = None
+    if isinstance(items, list):
+        return json.dumps({"results": [{"id": item.get("id"), **_analysis(str(item.get("text", "")))}
+                                       for item in items if isinstance(item, dict)]}, ensure_ascii=False)
+    return json.dumps(_analysis(user_query.split("\n\nVOCAB:")[0]), ensure_ascii=False)
+
+
+def _pieces(text: str):
+    n = max(1, min(SETTINGS["chunks"], len(text)))
+    size = -(-len(text) // n)
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+async def _sse(events):
+    await _pause(SETTINGS["latency_ms"])
+    for i, event in enumerate(events):
+        if i:
+            await _pause(SETTINGS["chunk_interval_ms"])
+        yield f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/v1/services/aigc/text-generation/generation")
+async def dashscope(request: Request):
+    body = await request.json()
+    text = _reply(body["input"]["messages"][-1]["content"])
+    if _failing():
+        await _pause(SETTINGS["latency_ms"])
+        return JSONResponse({"code": "InternalError", "message": "stub failure"}, status_code=500)
+    if request.headers.get("X-DashScope-SSE") == "enable":
+        events = [{"output": {"choices": [{"message": {"role": "assistant", "content": piece}}]}}
+                  for piece in _pieces(text)]
+        return StreamingResponse(_sse(events), media_type="text/event-stream")
+    await _pause(SETTINGS["latency_ms"])
+    return {"output": {"choices": [{"message": {"role": "assistant", "content": text}}]}}
+
+
+@app.post("/v1beta/models/{model_action}")
+async def gemini(model_action: str, request: Request):
+    body = await request.json()
+    prompt = body["contents"][0]["parts"][0]["text"]
+    text = _reply(prompt.rsplit("User Query: ", 1)[-1])
+    if _failing():
+        await _pause(SETTINGS["latency_ms"])
+        return JSONResponse({"error": {"code": 500, "message": "stub failure"}}, status_code=500)
+    if model_action.endswith(":streamGenerateContent"):
+        events = [{"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]}
+                  for piece in _pieces(text)]
+        return StreamingResponse(_sse(events), media_type="text/event-stream")
+    await _pause(SETTINGS["latency_ms"])
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"}}]}
+
+
+def _text_frame(request_id: str, path: str, body: dict) -> str:
+    return (f"X-RequestId:{request_id}\r\nContent-Type:application/json; charset=utf-8\r\n"
+            f"Path:{path}\r\n\r\n{json.dumps(body)}")
+
+
+def _audio_frame(request_id: str, data: bytes) -> bytes:
+    header = f"X-RequestId:{request_id}\r\nContent-Type:audio/mpeg\r\nPath:audio\r\n".encode()
+    return len(header).to_bytes(2, "big") + header + data
+
+
+@app.websocket("/edge/v1")
+async def edge_tts(websocket: WebSocket):
+    # Same framing as speech.platform.bing.com: text frames are headers, a
+    # blank line and a body; binary frames start with a 2-byte header length
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            if "Path:ssml" not in message:
+                continue  # speech.config
+            request_id = uuid.uuid4().hex
+            await _pause(SETTINGS["latency_ms"])
+            await websocket.send_text(_text_frame(request_id, "turn.start", {"context": {"serviceTag": "stub"}}))
+            for i in range(SETTINGS["audio_frames"]):
+                if i:
+                    await _pause(SETTINGS["chunk_interval_ms"])
+                await websocket.send_bytes(_audio_frame(request_id, random.randbytes(SETTINGS["audio_frame_bytes"])))
+            await websocket.send_text(_text_frame(request_id, "turn.end", {}))
+    except WebSocketDisconnect:
+        pass
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    for key, value in SETTINGS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    SETTINGS.update({key: getattr(args, key) for key in SETTINGS})
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,487 @@
+"""
+End-to-end load test against local fake upstreams.
+
+Starts benchmarks.fake_upstreams and the API (app.main:app under uvicorn) as
+subprocesses in a scratch directory, with the AI and TTS upstreams pointed at
+the stubs, then drives a reading workload with N concurrent users, one phase
+at a time:
+
+    import   POST /texts/import of a generated TXT book
+    scroll   GET /texts/{id}/sentences?chapter=N, PATCH /texts/{id}/progress every page
+    analyze  POST /sentences/analyze for a page of sentences
+    chat     POST /ai/chat/stream, read to [DONE] (time to first token and total)
+    tts      POST /tts
+
+Reports throughput and p50/p95/p99 latency per endpoint, plus event-loop lag
+per phase: a probe calls GET /health every few milliseconds and its latency
+over the idle latency is time the server's loop was busy elsewhere. Each
+probe is also attributed to the endpoints that had a request in flight while
+it ran, giving a lag p99 per endpoint (an estimate: requests overlap, so a
+slow probe counts against every endpoint that was running at the time).
+
+    cd backend
+    python -m benchmarks.loadtest --users 20 --seconds 30 --save-baseline local
+    python -m benchmarks.loadtest --users 20 --seconds 30 --compare local
+
+The API uses the SQLite backend with a scratch database file; to run the same
+workload on PostgreSQL with several server processes:
+
+    STORAGE_BACKEND=postgres DATABASE_URL=postgresql://localhost/loadtest \
+        python -m benchmarks.loadtest --users 50 --workers 4
+
+Baselines are JSON files in benchmarks/baselines/; --compare exits 1 when a
+p95 or the loop lag grew, or throughput fell, by more than --threshold.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmarks.translation_memory import make_sentence, make_vocab
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+PHASES = ["import", "scroll", "analyze", "chat", "tts"]
+PAGE = 8  # sentences per screen
+CHAT_SYSTEM_PROMPT = "You are a reading assistant. Explain the sentence briefly."
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_book(rng, vocab, chars: int) -> bytes:
+    parts, size, chapter = [], 0, 0
+    while size < chars:
+        chapter += 1
+        parts.append(f"Chapter {chapter}\n\n")
+        for _ in range(rng.randint(30, 60)):
+            paragraph = " ".join(make_sentence(rng, vocab) for _ in range(rng.randint(2, 6)))
+            parts.append(paragraph + "\n\n")
+            size += len(paragraph)
+    return "".join(parts).encode("utf-8")
+
+
+class Recorder:
+    def __init__(self):
+        self.latency = defaultdict(list)  # endpoint -> seconds
+        self.errors = defaultdict(int)
+        self.spans = {}                   # endpoint -> (first start, last end)
+        self.active = defaultdict(int)    # endpoint -> requests in flight
+        self.probes = defaultdict(list)   # endpoint -> probe latencies (seconds) while it was in flight
+
+    @contextlib.contextmanager
+    def running(self, endpoint: str):
+        self.active[endpoint] += 1
+        try:
+            yield
+        finally:
+            self.active[endpoint] -= 1
+
+    def in_flight(self) -> set:
+        return {endpoint for endpoint, n in self.active.items() if n}
+
+    def add_probe(self, endpoints: set, seconds: float):
+        for endpoint in endpoints:
+            self.probes[endpoint].append(seconds)
+
+    def add(self, endpoint: str, started: float, ok: bool = True, ended: float = None):
+        ended = ended or time.perf_counter()
+        if ok:
+            self.latency[endpoint].append(ended - started)
+        else:
+            self.errors[endpoint] += 1
+        first, _ = self.spans.get(endpoint, (started, ended))
+        self.spans[endpoint] = (min(first, started), ended)
+
+    async def request(self, client, endpoint: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            with self.running(endpoint):
+                response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self.add(endpoint, started, ok=False)
+            return None
+        self.add(endpoint, started, ok=response.status_code < 400)
+        return response if response.status_code < 400 else None
+
+    def summary(self, idle: float = 0.0) -> dict:
+        out = {}
+        for endpoint in sorted(set(self.latency) | set(self.errors)):
+            values = self.latency[endpoint]
+            first, last = self.spans[endpoint]
+            ms = lambda p: round(percentile(values, p) * 1000, 1) if values else None
+            lag = [max(0.0, s - idle) * 1000 for s in self.probes.get(endpoint, [])]
+            out[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "rps": round(len(values) / max(last - first, 1e-9), 2),
+                "p50_ms": ms(0.5), "p95_ms": ms(0.95), "p99_ms": ms(0.99),
+                "lag_probes": len(lag),
+                "lag_p99_ms": round(percentile(lag, 0.99), 1) if lag else None,
+            }
+        return out
+
+
+class User:
+    def __init__(self, client: httpx.AsyncClient, rec: Recorder, index: int, args):
+        self.client = client
+        self.rec = rec
+        self.index = index
+        self.args = args
+        self.text_id = None
+        self.chapters = 0
+        self.sentences = []  # (id, content) of the chapters fetched so far
+        self.chapter = 0
+        self.position = 0    # scroll cursor in self.sentences
+        self.analyzed = 0    # analyze cursor in self.sentences
+
+    def provider(self, n: int) -> str:
+        providers = self.args.providers
+        return providers[(self.index + n) % len(providers)]
+
+    async def register(self):
+        response = await self.client.post("/auth/register", json={
+            "email": f"load{self.index}-{random.getrandbits(32)}@example.com", "password": "load-test-password"})
+        response.raise_for_status()
+        self.client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+        for _ in range(self.args.recharges):
+            (await self.client.post("/auth/recharge")).raise_for_status()
+
+    async def import_book(self, book: bytes):
+        response = await self.rec.request(
+            self.client, "POST /texts/import", "POST", "/texts/import",
+            files={"file": (f"book{self.index}.txt", book, "text/plain")}, timeout=600)
+        if response is not None:
+            text = response.json()
+            self.text_id, self.chapters = text["id"], text["chapter_count"]
+
+    async def fetch_chapter(self) -> bool:
+        if self.chapter >= self.chapters:
+            return False
+        response = await self.rec.request(
+            self.client, "GET /texts/{id}/sentences?chapter", "GET",
+            f"/texts/{self.text_id}/sentences", params={"chapter": self.chapter})
+        self.chapter += 1
+        if response is not None:
+            self.sentences += [(s["id"], s["content"]) for s in response.json()]
+        return True
+
+    async def page(self, cursor: int):
+        while cursor + PAGE > len(self.sentences):
+            if not await self.fetch_chapter():
+                break
+        return self.sentences[cursor:cursor + PAGE]
+
+    async def scroll(self):
+        page = await self.page(self.position)
+        if not page:
+            self.position = 0
+            return
+        self.position += len(page)
+        await self.rec.request(self.client, "PATCH /texts/{id}/progress", "PATCH",
+                               f"/texts/{self.text_id}/progress", json={"current_paragraph_id": page[-1][0]})
+
+    async def analyze(self):
+        page = await self.page(self.analyzed)
+        if not page:
+            return
+        self.analyzed += len(page)
+        await self.rec.request(self.client, "POST /sentences/analyze", "POST", "/sentences/analyze",
+                               json={"sentence_ids": [sid for sid, _ in page], "provider": self.provider(self.analyzed)},
+                               timeout=120)
+
+    async def chat(self, n: int):
+        page = await self.page(n % max(1, len(self.sentences) - PAGE))
+        query = page[0][1] if page else "What does this sentence mean?"
+        endpoint = "POST /ai/chat/stream"
+        started = time.perf_counter()
+        first = None
+        ok = False
+        try:
+            with self.rec.running(endpoint):
+                async with self.client.stream("POST", "/ai/chat/stream", timeout=120, json={
+                    "system_prompt": CHAT_SYSTEM_PROMPT, "user_query": query, "provider": self.provider(n)}) as response:
+                    if response.status_code < 400:
+                        async for line in response.aiter_lines():
+                            if not line.startswith("data:"):
+                                continue
+                            data = line[5:].strip()
+                            if data == "[DONE]":
+                                ok = True
+                                break
+                            if data.startswith("[ERROR]"):
+                                break
+                            if first is None:
+                                first = time.perf_counter()
+        except httpx.HTTPError:
+            pass
+        if ok and first is not None:
+            self.rec.add(f"{endpoint} (ttft)", started, ended=first)
+        self.rec.add(endpoint, started, ok=ok)
+
+    async def tts(self, n: int):
+        page = await self.page(n % max(1, len(self.sentences) - PAGE))
+        text = " ".join(s for _, s in page[:2]) or "Hello there."
+        await self.rec.request(self.client, "POST /tts", "POST", "/tts",
+                               json={"text": text, "voice": "narrator"}, timeout=60)
+
+
+async def probe_loop(client: httpx.AsyncClient, samples: list, interval: float, stop: asyncio.Event,
+                     rec: Recorder = None):
+    """Probe latencies into samples; with rec, also per endpoint that was in flight during the probe"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        endpoints = rec.in_flight() if rec else set()
+        try:
+            await client.get("/health")
+            seconds = time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        else:
+            samples.append(seconds)
+            if rec:
+                rec.add_probe(endpoints | rec.in_flight(), seconds)
+        await asyncio.sleep(interval)
+
+
+async def run_phase(name: str, users, args, book: bytes, probe_client, idle: float, rec: Recorder) -> dict:
+    samples = []
+    stop = asyncio.Event()
+    probe = asyncio.create_task(probe_loop(probe_client, samples, args.probe_ms / 1000, stop, rec))
+    deadline = time.perf_counter() + args.seconds
+
+    async def drive(user: User):
+        if name == "import":
+            await user.import_book(book)
+            return
+        n = 0
+        while time.perf_counter() < deadline:
+            if name == "scroll":
+                await user.scroll()
+            elif name == "analyze":
+                await user.analyze()
+            elif name == "chat":
+                await user.chat(n)
+            elif name == "tts":
+                await user.tts(n)
+            n += 1
+            await asyncio.sleep(random.uniform(0.5, 1.5) * args.think_ms / 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(drive(u) for u in users if u.text_id is not None or name == "import"))
+    stop.set()
+    await probe
+    lag = [max(0.0, s - idle) * 1000 for s in samples]
+    return {
+        "seconds": round(time.perf_counter() - started, 1),
+        "probes": len(lag),
+        "p50_ms": round(percentile(lag, 0.5), 1) if lag else None,
+        "p99_ms": round(percentile(lag, 0.99), 1) if lag else None,
+        "max_ms": round(max(lag), 1) if lag else None,
+    }
+
+
+def start(cmd, cwd, env, log_path):
+    log = open(log_path, "wb")
+    return subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+
+async def wait_ready(url: str, proc, timeout: float = 120):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {proc.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.25)
+    raise RuntimeError(f"{url} did not come up in {timeout:.0f}s")
+
+
+async def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    stub_port, app_port = free_port(), free_port()
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [BACKEND_DIR, env.get("PYTHONPATH")]))
+    stub = start([sys.executable, "-m", "benchmarks.fake_upstreams", "--port", str(stub_port),
+                  "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+                  "--chunks", str(args.chunks), "--chunk-interval-ms", str(args.chunk_interval_ms),
+                  "--error-rate", str(args.error_rate)],
+                 BACKEND_DIR, env, os.path.join(workdir, "stub.log"))
+    env.update({
+        "ALIYUN_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "GOOGLE_BASE_URL": f"http://127.0.0.1:{stub_port}",
+        "ALIYUN_API_KEY": "stub",
+        "GOOGLE_API_KEY": "stub",
+        "EDGE_TTS_WSS_URL": f"ws://127.0.0.1:{stub_port}/edge/v1?TrustedClientToken=stub",
+        "AI_USER_RATE_PER_MINUTE": "100000",
+        "AI_USER_BURST": "100000",
+        "DATABASE_PATH": os.path.join(workdir, "loadtest.db"),
+    })
+    server = start([sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port),
+                    "--workers", str(args.workers), "--log-level", "warning"],
+                   workdir, env, os.path.join(workdir, "server.log"))
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        await wait_ready(f"http://127.0.0.1:{stub_port}/docs", stub)
+        await wait_ready(f"{base_url}/health", server)
+
+        rng = random.Random(args.seed)
+        book = make_book(rng, make_vocab(rng), args.book_kb * 1024)
+        limits = httpx.Limits(max_connections=args.users * 4)
+        clients = [httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) for _ in range(args.users)]
+        probe_client = httpx.AsyncClient(base_url=base_url)
+        try:
+            rec = Recorder()
+            users = [User(client, rec, i, args) for i, client in enumerate(clients)]
+            await asyncio.gather(*(u.register() for u in users))
+
+            idle = []
+            stop = asyncio.Event()
+            asyncio.get_running_loop().call_later(2.0, stop.set)
+            await probe_loop(probe_client, idle, args.probe_ms / 1000, stop)
+            idle_s = percentile(idle, 0.5) or 0.0
+
+            lag = {}
+            for name in args.phases:
+                lag[name] = await run_phase(name, users, args, book, probe_client, idle_s, rec)
+                print(f"  {name:<8} done in {lag[name]['seconds']}s", file=sys.stderr)
+            endpoints = rec.summary(idle_s)
+        finally:
+            for client in clients + [probe_client]:
+                await client.aclose()
+    finally:
+        for proc in (server, stub):
+            proc.terminate()
+            proc.wait(timeout=30)
+    return {
+        "config": {k: getattr(args, k) for k in ("users", "seconds", "think_ms", "book_kb", "providers",
+                                                 "latency_ms", "jitter_ms", "chunks", "chunk_interval_ms",
+                                                 "error_rate", "phases")},
+        "idle_probe_ms": round(idle_s * 1000, 2),
+        "endpoints": endpoints,
+        "loop_lag": lag,
+        "workdir": workdir,
+    }
+
+
+def print_report(result: dict):
+    print(f"\n{'endpoint':<38}{'count':>7}{'err':>5}{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'lag p99':>9}")
+    for endpoint, s in result["endpoints"].items():
+        fmt = lambda v: f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+        print(f"{endpoint:<38}{s['count']:>7}{s['errors']:>5}{s['rps']:>8.1f}"
+              f"{fmt(s['p50_ms'])}{fmt(s['p95_ms'])}{fmt(s['p99_ms'])}{fmt(s.get('lag_p99_ms'))}")
+    print(f"\nevent-loop lag (probe latency over idle {result['idle_probe_ms']} ms)")
+    print(f"{'phase':<10}{'probes':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for phase, s in result["loop_lag"].items():
+        fmt = lambda v: f"{v:>9.1f}" if v is not None else f"{'-':>9}"
+        print(f"{phase:<10}{s['probes']:>8}{fmt(s['p50_ms'])}{fmt(s['p99_ms'])}{fmt(s['max_ms'])}")
+    print(f"\nserver log and database: {result['workdir']}")
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> list:
+    """Human-readable regressions of result against baseline"""
+    found = []
+    if baseline.get("config") != result["config"]:
+        print("warning: baseline was recorded with a different configuration", file=sys.stderr)
+
+    def grew(label, new, old, floor=1.0):
+        # floor (ms) keeps noise on near-zero values from counting as a regression
+        if new is not None and old is not None and new > max(old, floor) * (1 + threshold):
+            found.append(f"{label}: {old} -> {new} ms")
+
+    for endpoint, old in baseline.get("endpoints", {}).items():
+        new = result["endpoints"].get(endpoint)
+        if new is None:
+            found.append(f"{endpoint}: no successful requests")
+            continue
+        grew(f"{endpoint} p95", new["p95_ms"], old["p95_ms"])
+        grew(f"{endpoint} loop lag p99", new.get("lag_p99_ms"), old.get("lag_p99_ms"), floor=5.0)
+        if new["rps"] < old["rps"] * (1 - threshold):
+            found.append(f"{endpoint} throughput: {old['rps']} -> {new['rps']} req/s")
+        if new["errors"] > old["errors"]:
+            found.append(f"{endpoint} errors: {old['errors']} -> {new['errors']}")
+    for phase, old in baseline.get("loop_lag", {}).items():
+        new = result["loop_lag"].get(phase)
+        if new:
+            grew(f"{phase} loop lag p99", new["p99_ms"], old["p99_ms"], floor=5.0)
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--seconds", type=float, default=20, help="duration of each timed phase")
+    parser.add_argument("--think-ms", type=float, default=300, help="mean pause between a user's requests")
+    parser.add_argument("--book-kb", type=int, default=2048, help="size of the imported TXT book")
+    parser.add_argument("--phases", default=",".join(PHASES))
+    parser.add_argument("--providers", default="aliyun", help="comma-separated, used round-robin")
+    parser.add_argument("--recharges", type=int, default=5, help="+1000 credits each per user")
+    parser.add_argument("--probe-ms", type=float, default=20, help="loop lag probe interval")
+    parser.add_argument("--latency-ms", type=float, default=400, help="upstream time to first byte")
+    parser.add_argument("--jitter-ms", type=float, default=150)
+    parser.add_argument("--chunks", type=int, default=12, help="chunks per streamed reply")
+    parser.add_argument("--chunk-interval-ms", type=float, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes (use with postgres)")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative change")
+    parser.add_argument("--json", action="store_true", help="print the raw result as JSON")
+    args = parser.parse_args()
+    args.phases = [p for p in args.phases.split(",") if p]
+    args.providers = [p for p in args.providers.split(",") if p]
+    unknown = set(args.phases) - set(PHASES)
+    if unknown:
+        parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+    if "import" not in args.phases:
+        parser.error("the import phase is required (the other phases read the imported book)")
+
+    result = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result)
+
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = os.path.join(BASELINE_DIR, f"{args.save_baseline}.json")
+        with open(path, "w") as f:
+            json.dump({k: v for k, v in result.items() if k != "workdir"}, f, indent=2)
+        print(f"baseline saved to {path}")
+    if args.compare:
+        with open(os.path.join(BASELINE_DIR, f"{args.compare}.json")) as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nno regressions over {args.threshold:.0%} against baseline {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+At-rest compression benchmark: database size and read latency.
+
+Builds the same synthetic library (chapter text plus per-sentence analysis
+JSON shaped like the model output) once per codec setting, compresses it
+through the background migration path, then measures the VACUUMed database
+size and the latency of reading one chapter's sentences (decode + json.loads,
+what GET /texts/{id}/sentences?chapter=N does) and one chapter's text.
+
+    cd backend
+    python -m benchmarks.storage_codec --sentences 200000
+"""
+
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+PATTERNS = ["which 定语从句", "so...that 结果状语从句", "It is...that 强调句", "现在分词作状语",
+            "if 虚拟语气", "not only...but also 并列结构", "with 复合结构", "倒装句"]
+TAGS = ["Theme", "Tone", "Irony", "Foreshadowing", "Character", "Setting", "Humor"]
+COMPANIONS = ["famous_quote", "literary_insight", "plot_turning_point", "character_insight",
+              "historical_context", "cultural_reference", "fun_fact", "reading_tip"]
+
+
+class Corpus:
+    def __init__(self, seed: int):
+        self.rng = random.Random(seed)
+        words = set()
+        while len(words) < 15000:
+            words.add("".join(self.rng.choice(string.ascii_lowercase) for _ in range(self.rng.randint(2, 11))))
+        self.vocab = sorted(words)
+        self.hanzi = [chr(0x4E00 + i) for i in self.rng.sample(range(20000), 2500)]
+        self.word_weights = self._zipf(len(self.vocab))
+        self.hanzi_weights = self._zipf(len(self.hanzi))
+
+    @staticmethod
+    def _zipf(n):
+        total, cum = 0.0, []
+        for rank in range(1, n + 1):
+            total += 1.0 / rank
+            cum.append(total)
+        return cum
+
+    def words(self, k):
+        return self.rng.choices(self.vocab, cum_weights=self.word_weights, k=k)
+
+    def chinese(self, k):
+        return "".join(self.rng.choices(self.hanzi, cum_weights=self.hanzi_weights, k=k)) + "。"
+
+    def sentence(self):
+        return " ".join(self.words(self.rng.randint(8, 30))).capitalize() + "."
+
+    def analysis(self, sentence):
+        rng = self.rng
+        words = sentence.rstrip(".").lower().split()
+        knowledge = []
+        for w in rng.sample(words, min(len(words), rng.randint(3, 7))):
+            knowledge.append({
+                "key": w, "word": w, "ipa": f"/{w[:6]}/", "def": self.chinese(rng.randint(2, 6)),
+                "clue": " ".join(self.words(rng.randint(1, 3))).capitalize(), "diff": rng.randint(1, 6),
+                "context": " ".join(self.words(3)),
+            })
+        return {
+            "knowledge": knowledge,
+            "insight": {"tag": rng.choice(TAGS), "text": self.chinese(rng.randint(20, 60))},
+            "xray": {
+                "pattern": rng.choice(PATTERNS),
+                "breakdown": "主句 + " + rng.choice(PATTERNS),
+                "keyWords": [{"word": w, "role": self.chinese(rng.randint(4, 10))} for w in rng.sample(words, 2)],
+                "explanation": self.chinese(rng.randint(20, 50)),
+            },
+            "companion": None if rng.random() < 0.6 else {"type": rng.choice(COMPANIONS),
+                                                          "text": self.chinese(rng.randint(10, 30))},
+        }
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def build(workdir, name, args, settings):
+    from app import codec, database
+    from app.config import STORAGE_CODEC_CONFIG
+    from app.services import chapters
+
+    STORAGE_CODEC_CONFIG.update(settings)
+    codec._dicts.clear()
+    codec._active.clear()
+    codec._local.__dict__.clear()
+    database.DATABASE_PATH = os.path.join(workdir, f"{name}.db")
+    database.init_database()
+
+    corpus = Corpus(args.seed)
+    per_chapter = args.sentences_per_chapter
+    with database.get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash) VALUES ('bench@example.com', 'x')")
+    sid = 0
+    text_id = None
+    # Written as plaintext, like rows from before the codec; migrate() compresses them
+    enabled = STORAGE_CODEC_CONFIG["enabled"]
+    STORAGE_CODEC_CONFIG["enabled"] = False
+    for chapter in range(args.sentences // per_chapter):
+        if chapter % args.chapters_per_book == 0:
+            with database.get_db() as conn:
+                text_id = conn.execute(
+                    "INSERT INTO texts (user_id, title, content, chapter_count) VALUES (1, 'bench', '', ?)",
+                    (args.chapters_per_book,)
+                ).lastrowid
+        sents = [corpus.sentence() for _ in range(per_chapter)]
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, "
+                "sentence_count) VALUES (?, ?, ?, ?, 0, 0, ?)",
+                (text_id, chapter % args.chapters_per_book, f"Chapter {chapter + 1}", " ".join(sents), per_chapter)
+            )
+            chapter_id = cursor.lastrowid
+            cursor.executemany(
+                "INSERT INTO sentences (id, text_id, chapter_id, sentence_index, content, translation, analysis_json) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(sid + i + 1, text_id, chapter_id, sid + i, s, corpus.chinese(len(s) // 4),
+                  json.dumps(corpus.analysis(s), ensure_ascii=False)) for i, s in enumerate(sents)]
+            )
+        sid += per_chapter
+    STORAGE_CODEC_CONFIG["enabled"] = enabled
+
+    started = time.perf_counter()
+    STORAGE_CODEC_CONFIG["migrate_pause"] = 0
+    codec.migrate()
+    migrate_s = time.perf_counter() - started
+    conn = database.get_db_connection()
+    conn.execute("VACUUM")
+    conn.close()
+    size = os.path.getsize(database.DATABASE_PATH)
+
+    # Read path: one chapter's sentences, decoded and parsed
+    conn = database.get_db_connection()
+    rng = random.Random(args.seed)
+    chapter_count = conn.execute("SELECT MAX(id) FROM chapters").fetchone()[0]
+    sentence_ms, chapter_ms = [], []
+    try:
+        for _ in range(args.reads):
+            chapter_id = rng.randint(1, chapter_count)
+            t = time.perf_counter()
+            rows = conn.execute(
+                "SELECT * FROM sentences WHERE chapter_id = ? ORDER BY sentence_index", (chapter_id,)
+            ).fetchall()
+            for r in rows:
+                json.loads(codec.decode(r["analysis_json"]))
+            sentence_ms.append((time.perf_counter() - t) * 1000)
+            t = time.perf_counter()
+            codec.decode(conn.execute("SELECT content FROM chapters WHERE id = ?", (chapter_id,)).fetchone()[0])
+            chapter_ms.append((time.perf_counter() - t) * 1000)
+    finally:
+        conn.close()
+    return size, migrate_s, sentence_ms, chapter_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=100000)
+    parser.add_argument("--sentences-per-chapter", type=int, default=250)
+    parser.add_argument("--chapters-per-book", type=int, default=40)
+    parser.add_argument("--reads", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=11)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="codec_bench_")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import codec
+
+    no_dict = {"dict_min_samples": 10 ** 12}
+    with_dict = {"dict_min_samples": 500}
+    variants = [
+        ("plaintext", {"enabled": False}),
+        ("zlib", {"enabled": True, "codec": "zlib", **no_dict}),
+        ("zlib+dict", {"enabled": True, "codec": "zlib", **with_dict}),
+    ]
+    if codec.zstandard is not None:
+        variants += [
+            ("zstd", {"enabled": True, "codec": "zstd", **no_dict}),
+            ("zstd+dict", {"enabled": True, "codec": "zstd", **with_dict}),
+        ]
+    else:
+        print("zstandard not installed: zstd variants skipped")
+
+    print(f"{args.sentences:,} sentences in chapters of {args.sentences_per_chapter}, scratch dir {workdir}\n")
+    print(f"{'codec':<11}{'db MiB':>8}{'ratio':>7}{'migrate s':>11}"
+          f"{'chapter sentences p50/p95 ms':>30}{'chapter text p50/p95 ms':>26}")
+    baseline = None
+    for name, settings in variants:
+        size, migrate_s, sentence_ms, chapter_ms = build(workdir, name, args, settings)
+        baseline = baseline or size
+        print(f"{name:<11}{size / 2**20:>8.1f}{baseline / size:>7.2f}{migrate_s:>11.1f}"
+              f"{percentile(sentence_ms, .5):>21.2f} / {percentile(sentence_ms, .95):<6.2f}"
+              f"{percentile(chapter_ms, .5):>17.3f} / {percentile(chapter_ms, .95):<6.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Translation memory benchmark: recall and lookup latency.
+
+Builds a synthetic corpus of analyzed sentences in a scratch database, then
+queries with near-duplicate variants (punctuation changes, OCR-style
+character noise, one-word edition changes) and with unrelated sentences.
+
+    cd backend
+    python -m benchmarks.translation_memory --sentences 1000000 --queries 2000
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+OCR_CONFUSIONS = [("m", "rn"), ("l", "1"), ("e", "c"), ("o", "0"), ("i", "l")]
+
+
+def make_vocab(rng, size=20000):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))))
+    return sorted(words)
+
+
+_zipf_weights = None
+
+
+def make_sentence(rng, vocab):
+    # Zipf (1/rank) word frequencies, like English prose
+    global _zipf_weights
+    if _zipf_weights is None:
+        total, _zipf_weights = 0.0, []
+        for rank in range(1, len(vocab) + 1):
+            total += 1.0 / rank
+            _zipf_weights.append(total)
+    words = rng.choices(vocab, cum_weights=_zipf_weights, k=rng.randint(8, 25))
+    return " ".join(words).capitalize() + "."
+
+
+def punctuation_variant(rng, s):
+    s = s.replace(".", "!") if rng.random() < 0.5 else s
+    return s.replace(" ", ", ", 1).replace(" ", "  ", 1)
+
+
+def ocr_variant(rng, s):
+    chars = list(s)
+    for _ in range(max(1, len(chars) // 40)):
+        a, b = rng.choice(OCR_CONFUSIONS)
+        idx = [i for i, c in enumerate(chars) if c == a]
+        if idx:
+            chars[rng.choice(idx)] = b
+    return "".join(chars)
+
+
+def edition_variant(rng, s, vocab):
+    words = s.split(" ")
+    words[rng.randrange(len(words))] = rng.choice(vocab)
+    return " ".join(words)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sentences", type=int, default=200000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="tm_bench_")
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from app import database
+    from app.services import translation_memory as tm
+
+    database.DATABASE_PATH = os.path.join(workdir, "bench.db")
+    database.init_database()
+    rng = random.Random(args.seed)
+    vocab = make_vocab(rng)
+
+    print(f"Building memory with {args.sentences:,} sentences in {workdir}")
+    corpus = []
+    started = time.perf_counter()
+    batch = 20000
+    with database.get_db() as conn:
+        conn.execute("INSERT INTO users (email, password_hash) VALUES ('bench@example.com', 'x')")
+        conn.execute("INSERT INTO texts (user_id, title, content) VALUES (1, 'bench', '')")
+    for start in range(0, args.sentences, batch):
+        rows = [make_sentence(rng, vocab) for _ in range(min(batch, args.sentences - start))]
+        with database.get_db() as conn:
+            cursor = conn.cursor()
+            ids = range(start + 1, start + 1 + len(rows))
+            cursor.executemany(
+                "INSERT INTO sentences (id, text_id, sentence_index, content, translation, analysis_json) "
+                "VALUES (?, 1, ?, ?, ?, '{}')",
+                [(sid, sid - 1, s, f"译文 {sid}") for sid, s in zip(ids, rows)]
+            )
+            tm.add_sentences(conn, list(zip(ids, rows)))
+        corpus.extend(zip(ids, rows))
+    build = time.perf_counter() - started
+    print(f"  indexed in {build:.1f}s ({args.sentences / build:,.0f} sentences/s), "
+          f"db size {os.path.getsize(database.DATABASE_PATH) / 2**20:.0f} MiB")
+
+    variants = {
+        "punctuation": lambda s: punctuation_variant(rng, s),
+        "ocr_noise": lambda s: ocr_variant(rng, s),
+        "edition": lambda s: edition_variant(rng, s, vocab),
+    }
+    conn = database.get_db_connection()
+    try:
+        print(f"\n{'variant':<14}{'recall':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+        for name, make in variants.items():
+            hits, latencies = 0, []
+            for sid, s in rng.sample(corpus, args.queries):
+                query = make(s)
+                t = time.perf_counter()
+                hit = tm.lookup(conn, query)
+                latencies.append((time.perf_counter() - t) * 1000)
+                hits += bool(hit and hit["source_id"] == sid)
+            print(f"{name:<14}{hits / args.queries:>8.3f}{percentile(latencies, .5):>9.3f}"
+                  f"{percentile(latencies, .95):>9.3f}{percentile(latencies, .99):>9.3f}")
+
+        false_hits, latencies = 0, []
+        for _ in range(args.queries):
+            query = make_sentence(rng, vocab)
+            t = time.perf_counter()
+            false_hits += tm.lookup(conn, query) is not None
+            latencies.append((time.perf_counter() - t) * 1000)
+        print(f"{'unrelated':<14}{'fp ' + format(false_hits / args.queries, '.3f'):>8}"
+              f"{percentile(latencies, .5):>9.3f}{percentile(latencies, .95):>9.3f}{percentile(latencies, .99):>9.3f}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
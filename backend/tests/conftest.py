@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Tests import the app as `app.…`, like the server run from backend/
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.database creates the default SQLite file on import; keep it out of backend/
+os.environ.setdefault("DATABASE_PATH", os.path.join(tempfile.mkdtemp(prefix="reading-tests-"), "test.db"))
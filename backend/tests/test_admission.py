@@ -0,0 +1,140 @@
+"""
+Admission control: the per-user token bucket, and FairGate's round-robin
+hand-off, queue bound, wait timeout and cancellation.
+"""
+
+import asyncio
+
+import pytest
+
+from app.services import admission
+from app.services.admission import AdmissionRejected, FairGate, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(admission.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_allows_burst_then_refills(clock):
+    bucket = TokenBucket(rate_per_sec=0.5, burst=3)
+    assert [bucket.take() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.take() == pytest.approx(2.0)  # one token every 2 s
+    clock.now += 1
+    assert bucket.take() == pytest.approx(1.0)
+    clock.now += 1
+    assert bucket.take() == 0.0
+    clock.now += 60
+    assert bucket.is_full() and bucket.tokens == 3  # never above the burst
+
+
+def test_check_rate_rejects_with_retry_after(clock, monkeypatch):
+    monkeypatch.setattr(admission, "_buckets", {})
+    monkeypatch.setitem(admission.ADMISSION_CONFIG, "user_rate_per_minute", 6)
+    monkeypatch.setitem(admission.ADMISSION_CONFIG, "user_burst", 2)
+    admission.check_rate(1)
+    admission.check_rate(1)
+    with pytest.raises(AdmissionRejected) as e:
+        admission.check_rate(1)
+    assert e.value.retry_after == 10
+    admission.check_rate(2)  # other users have their own bucket
+
+
+def test_check_rate_forgets_full_buckets(clock, monkeypatch):
+    monkeypatch.setattr(admission, "_buckets", {})
+    monkeypatch.setattr(admission, "MAX_TRACKED_BUCKETS", 3)
+    for user_id in range(3):
+        admission.check_rate(user_id)
+    clock.now += 3600  # all refilled
+    admission.check_rate(1000)
+    assert list(admission._buckets) == [1000]
+
+
+async def _settle():
+    """Let queued waiters run until they block again"""
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+async def _queued(gate: FairGate, user_id: int, order: list):
+    slot = await gate.acquire(user_id)
+    order.append(user_id)
+    return slot
+
+
+def test_gate_hands_slots_round_robin():
+    async def main():
+        gate = FairGate("test", capacity=1, max_queue=10, max_wait=5)
+        held = gate.try_acquire()
+        order = []
+        # User 1 queues three requests before user 2 and 3 queue one each
+        tasks = [asyncio.create_task(_queued(gate, user_id, order)) for user_id in (1, 1, 1, 2, 3)]
+        await asyncio.sleep(0)
+        assert gate.try_acquire() is None  # queued waiters come first
+        assert gate.snapshot()["queue_depth"] == 5 and gate.snapshot()["queued_users"] == 3
+
+        slot = held
+        for _ in tasks:
+            slot.release()
+            slot.release()  # idempotent: must not hand out a second slot
+            await _settle()
+            slot = next(t.result() for t in tasks if t.done() and not t.result().released)
+        assert order == [1, 2, 3, 1, 1]
+        slot.release()
+        assert gate.active == 0 and gate.waiting == 0
+    asyncio.run(main())
+
+
+def test_gate_rejects_when_queue_is_full():
+    async def main():
+        gate = FairGate("test", capacity=1, max_queue=1, max_wait=5)
+        held = gate.try_acquire()
+        waiter = asyncio.create_task(gate.acquire(1))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire(2)
+        assert gate.rejected == 1
+        held.release()
+        (await waiter).release()
+    asyncio.run(main())
+
+
+def test_gate_times_out_and_forgets_waiter():
+    async def main():
+        gate = FairGate("test", capacity=1, max_queue=5, max_wait=0.05)
+        held = gate.try_acquire()
+        with pytest.raises(AdmissionRejected) as e:
+            await gate.acquire(1)
+        assert e.value.retry_after >= 1
+        assert gate.waiting == 0 and not gate.queues
+        held.release()
+        assert gate.active == 0
+    asyncio.run(main())
+
+
+def test_gate_skips_cancelled_waiters():
+    async def main():
+        gate = FairGate("test", capacity=1, max_queue=5, max_wait=5)
+        held = gate.try_acquire()
+        gone = asyncio.create_task(gate.acquire(1))
+        stays = asyncio.create_task(gate.acquire(2))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await _settle()
+        assert gate.waiting == 1
+        held.release()
+        slot = await stays
+        assert gate.active == 1
+        slot.release()
+        assert gate.active == 0
+    asyncio.run(main())
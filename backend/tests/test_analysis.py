@@ -0,0 +1,149 @@
+"""
+The analysis batcher: packing pending sentences into calls, splitting a
+batch response back out by id (including ids echoed as strings), and
+retrying the items a batch dropped or mangled one at a time.
+"""
+
+import asyncio
+import json
+
+import pytest
+
+from app.config import ANALYSIS_BATCH_CONFIG
+from app.services import analysis
+from app.services.analysis import AnalysisBatcher
+from app.services.prompts import BATCH_ANALYSIS_SYSTEM
+
+PLAN = [("test", "model")]
+
+
+def _result(sentence_id, text):
+    return {"id": sentence_id, "translation": f"<{text}>", "knowledge": [], "insight": "i"}
+
+
+class FakeStorage:
+    def __init__(self):
+        self.saved = {}
+
+    async def save_analyses(self, results):
+        for sentence_id, _content, translation, analysis_json in results:
+            self.saved[sentence_id] = (translation, json.loads(analysis_json))
+
+
+@pytest.fixture
+def upstream(monkeypatch):
+    """Record each upstream call; reply with upstream.respond(system_prompt, query)"""
+    storage = FakeStorage()
+    monkeypatch.setattr(analysis, "get_storage", lambda: storage)
+    monkeypatch.setitem(ANALYSIS_BATCH_CONFIG, "linger", 0.01)
+
+    class Upstream:
+        calls = []
+        saved = storage.saved
+
+        @staticmethod
+        def respond(system_prompt, query):
+            if system_prompt == BATCH_ANALYSIS_SYSTEM:
+                return json.dumps({"results": [_result(item["id"], item["text"]) for item in json.loads(query)]})
+            return json.dumps(_result(None, query))
+
+    async def routed_call(plan, system_prompt, query, user_id=None, primary_slot=None):
+        primary_slot.release()
+        Upstream.calls.append((system_prompt, query))
+        return plan[0][0], {"content": Upstream.respond(system_prompt, query)}
+
+    monkeypatch.setattr(analysis, "routed_call", routed_call)
+    return Upstream
+
+
+def _analyze_all(batcher, sentences, priority=analysis.INTERACTIVE):
+    async def main():
+        return await asyncio.gather(*(batcher.analyze(i, text, PLAN, priority) for i, text in sentences),
+                                    return_exceptions=True)
+    return asyncio.run(main())
+
+
+def test_pack_respects_item_and_token_limits(monkeypatch):
+    monkeypatch.setitem(ANALYSIS_BATCH_CONFIG, "max_items", 3)
+    monkeypatch.setitem(ANALYSIS_BATCH_CONFIG, "max_batch_tokens", 100)
+    batcher = AnalysisBatcher()
+
+    def pending(i, chars):
+        return analysis._Pending(i, "x" * chars, None, analysis.INTERACTIVE, None)
+
+    short = [pending(i, 40) for i in range(7)]  # 11 tokens each
+    assert [len(b) for b in batcher._pack(short)] == [3, 3, 1]
+    mixed = [pending(0, 200), pending(1, 200), pending(2, 40), pending(3, 1000)]  # 51, 51, 11, 251
+    assert [[p.sentence_id for p in b] for b in batcher._pack(mixed)] == [[0], [1, 2], [3]]
+
+
+def test_batch_is_split_by_id(upstream):
+    batcher = AnalysisBatcher()
+    results = _analyze_all(batcher, [(1, "one"), (2, "two"), (3, "three")])
+    assert [r["translation"] for r in results] == ["<one>", "<two>", "<three>"]
+    assert len(upstream.calls) == 1 and batcher.stats["batched_calls"] == 1
+    assert upstream.saved[2] == ("<two>", results[1]["analysis"])
+    assert not batcher.is_inflight(1)
+
+
+def test_string_ids_and_dropped_items(upstream):
+    def respond(system_prompt, query):
+        if system_prompt != BATCH_ANALYSIS_SYSTEM:
+            return json.dumps(_result(None, f"retried {query}"))
+        items = json.loads(query)
+        # Ids come back as strings, one item is missing and one has no translation
+        return json.dumps({"results": [
+            _result(str(items[0]["id"]), items[0]["text"]),
+            {"id": items[1]["id"], "insight": "no translation"},
+            {"id": "not a number", "translation": "stray"},
+        ]})
+
+    upstream.respond = respond
+    batcher = AnalysisBatcher()
+    results = _analyze_all(batcher, [(1, "one"), (2, "two"), (3, "three")])
+    assert [r["translation"] for r in results] == ["<one>", "<retried two>", "<retried three>"]
+    assert batcher.stats["retries"] == 2 and batcher.stats["upstream_calls"] == 3
+    assert sorted(query for _, query in upstream.calls[1:]) == ["three", "two"]
+    assert set(upstream.saved) == {1, 2, 3}
+
+
+def test_unparseable_batch_retries_every_item(upstream):
+    upstream.respond = lambda system_prompt, query: \
+        "Sorry, I can't do that." if system_prompt == BATCH_ANALYSIS_SYSTEM else json.dumps(_result(None, query))
+    batcher = AnalysisBatcher()
+    results = _analyze_all(batcher, [(1, "one"), (2, "two")])
+    assert [r["translation"] for r in results] == ["<one>", "<two>"]
+    assert batcher.stats["retries"] == 2
+
+
+def test_failed_retry_fails_only_that_item(upstream):
+    def respond(system_prompt, query):
+        if system_prompt == BATCH_ANALYSIS_SYSTEM:
+            return json.dumps({"results": [_result(1, "one")]})
+        return "not json"
+
+    upstream.respond = respond
+    batcher = AnalysisBatcher()
+    first, second = _analyze_all(batcher, [(1, "one"), (2, "two")])
+    assert first["translation"] == "<one>"
+    assert isinstance(second, Exception)
+    assert batcher.stats["failures"] == 1 and set(upstream.saved) == {1}
+
+
+def test_duplicate_requests_share_one_item(upstream):
+    batcher = AnalysisBatcher()
+    results = _analyze_all(batcher, [(1, "one"), (1, "one")])
+    assert results[0] == results[1]
+    assert upstream.calls == [(analysis.ANALYSIS_SYSTEM, "one")]
+    assert batcher.stats["deduplicated"] == 1
+
+
+def test_empty_vocab_drops_model_vocabulary(upstream):
+    upstream.respond = lambda system_prompt, query: json.dumps(
+        {"translation": "t", "knowledge": [{"word": "extra"}]})
+    batcher = AnalysisBatcher()
+
+    async def main():
+        return await batcher.analyze(1, "one", PLAN, vocab=[])
+    assert asyncio.run(main())["analysis"]["knowledge"] == []
+    assert upstream.calls[0][0] == analysis.ANALYSIS_VOCAB_SYSTEM
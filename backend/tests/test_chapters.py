@@ -0,0 +1,175 @@
+"""
+Chapter detection and the SQLite chapter storage: splitting and merging
+edge cases, and moving legacy texts.content rows into chapters without
+losing their sentences' ids or analyses.
+"""
+
+import json
+
+import pytest
+
+from app import codec, database
+from app.config import CHAPTER_CONFIG
+from app.database import get_db
+from app.services import chapters
+
+
+def _body(words: int) -> str:
+    return " ".join(["word"] * words)
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "test.db"))
+    database.init_database()
+    with get_db() as conn:
+        return conn.execute("INSERT INTO users (email, password_hash) VALUES ('a@example.com', 'x')").lastrowid
+
+
+def _covers(content: str, spans) -> bool:
+    return spans[0][1] == 0 and spans[-1][2] == len(content) and \
+        all(a[2] == b[1] for a, b in zip(spans, spans[1:]))
+
+
+def test_split_empty_text():
+    assert chapters.split_chapters("") == [("Chapter 1", 0, 0)]
+
+
+def test_split_on_headings_without_gaps():
+    content = f"Chapter 1\n\n{_body(200)}\n\nChapter 2\n\n{_body(200)}\n"
+    spans = chapters.split_chapters(content)
+    assert [title for title, _, _ in spans] == ["Chapter 1", "Chapter 2"]
+    assert _covers(content, spans)
+
+
+def test_contents_page_merges_forward():
+    # A table of contents is a run of headings with no body between them
+    content = f"Chapter 1\nChapter 2\n\nChapter 1\n\n{_body(200)}\n\nChapter 2\n\n{_body(200)}"
+    spans = chapters.split_chapters(content)
+    assert len(spans) == 2
+    assert spans[0][1] == 0 and content[spans[0][1]:spans[0][2]].count("Chapter 1") == 2
+    assert _covers(content, spans)
+
+
+def test_short_last_chapter_merges_back():
+    content = f"Chapter 1\n\n{_body(200)}\n\nChapter 2\n\nThe end."
+    spans = chapters.split_chapters(content)
+    assert spans == [("Chapter 1", 0, len(content))]
+
+
+def test_long_text_splits_at_paragraph_breaks(monkeypatch):
+    monkeypatch.setitem(CHAPTER_CONFIG, "max_chapter_chars", 1000)
+    paragraphs = [_body(30) for _ in range(20)]  # ~150 chars each
+    content = "\n\n".join(paragraphs)
+    spans = chapters.split_chapters(content)
+    assert len(spans) > 1 and _covers(content, spans)
+    assert [title for title, _, _ in spans[:2]] == ["Part 1", "Part 2"]
+    for _, start, end in spans:
+        assert end - start <= 1000
+        assert content[start:end].startswith("word")  # never cut inside a paragraph
+
+
+def test_long_titled_chapter_is_numbered(monkeypatch):
+    monkeypatch.setitem(CHAPTER_CONFIG, "max_chapter_chars", 1000)
+    content = "Chapter 1\n\n" + "\n\n".join(_body(30) for _ in range(20))
+    titles = [title for title, _, _ in chapters.split_chapters(content)]
+    assert titles[:3] == ["Chapter 1", "Chapter 1 (2)", "Chapter 1 (3)"]
+
+
+def test_chunk_chapters_folds_short_pieces():
+    pieces = [("Cover", "Title page"), ("One", _body(200)), ("Two", _body(200)), (None, "Fin.")]
+    result = list(chapters.chunk_chapters(pieces))
+    assert [title for title, _ in result] == ["One", "Two"]
+    assert result[0][1].startswith("Title page\n\n")
+    assert result[1][1].endswith("\n\nFin.")
+
+
+def test_chunk_chapters_numbers_repeated_titles(monkeypatch):
+    monkeypatch.setitem(CHAPTER_CONFIG, "max_chapter_chars", 1000)
+    body = "\n\n".join(_body(30) for _ in range(10))
+    titles = [title for title, _ in chapters.chunk_chapters([("Book", body), ("Book", body)])]
+    assert titles[0] == "Book" and titles[1] == "Book (2)" and len(set(titles)) == len(titles)
+
+
+def test_store_no_chapters_keeps_one_empty_chapter(db):
+    with get_db() as conn:
+        text_id = conn.execute("INSERT INTO texts (user_id, title, content) VALUES (?, 't', '')", (db,)).lastrowid
+        assert chapters.store_chapters(conn.cursor(), text_id, []) == 0
+        rows = conn.execute("SELECT chapter_index, title, char_count FROM chapters WHERE text_id = ?",
+                            (text_id,)).fetchall()
+        assert [tuple(r) for r in rows] == [(0, "Chapter 1", 0)]
+        assert conn.execute("SELECT chapter_count FROM texts WHERE id = ?", (text_id,)).fetchone()[0] == 1
+
+
+def _legacy_text(user_id: int, content: str, sentences) -> int:
+    """A text as stored before chapters: content inline, chapter_count NULL"""
+    with get_db() as conn:
+        text_id = conn.execute("INSERT INTO texts (user_id, title, content) VALUES (?, 'Old', ?)",
+                               (user_id, content)).lastrowid
+        conn.executemany(
+            "INSERT INTO sentences (text_id, sentence_index, content, translation, analysis_json) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(text_id, i, s, t, a) for i, (s, t, a) in enumerate(sentences)]
+        )
+    return text_id
+
+
+def test_migrate_legacy_text_keeps_analyses(db):
+    first, second = _body(200), _body(200).replace("word", "other")
+    content = f"Chapter 1\n\nIt began. {first}\n\nChapter 2\n\nIt ended. {second}"
+    analysis = json.dumps({"keywords": [{"word": "began"}], "insight": "x" * 200})
+    text_id = _legacy_text(db, content, [
+        ("Chapter 1", None, None),
+        ("It began.", "Es begann.", analysis),
+        (first, None, None),
+        ("Chapter 2", None, None),
+        ("It ended.", "Es endete.", None),
+        (second, None, None),
+    ])
+    with get_db() as conn:
+        before = {r["id"]: r["content"] for r in conn.execute("SELECT id, content FROM sentences")}
+
+    chapters.migrate_legacy_texts()
+
+    with get_db() as conn:
+        text = conn.execute("SELECT * FROM texts WHERE id = ?", (text_id,)).fetchone()
+        assert (text["content"], text["chapter_count"], text["char_count"]) == ("", 2, len(content))
+        stored = conn.execute(
+            "SELECT chapter_index, content, sentence_start, sentence_count FROM chapters "
+            "WHERE text_id = ? ORDER BY chapter_index", (text_id,)
+        ).fetchall()
+        assert "".join(codec.decode(c["content"]) for c in stored) == content
+        assert [(c["sentence_start"], c["sentence_count"]) for c in stored] == [(0, 3), (3, 3)]
+        rows = conn.execute('''
+            SELECT s.id, s.content, s.translation, s.analysis_json, c.chapter_index
+            FROM sentences s JOIN chapters c ON c.id = s.chapter_id ORDER BY s.sentence_index
+        ''').fetchall()
+    assert {r["id"]: r["content"] for r in rows} == before
+    assert [r["chapter_index"] for r in rows] == [0, 0, 0, 1, 1, 1]
+    assert (rows[1]["translation"], codec.decode(rows[1]["analysis_json"])) == ("Es begann.", analysis)
+    assert rows[4]["translation"] == "Es endete."
+
+    chapters.migrate_legacy_texts()  # nothing left to do
+    with get_db() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM chapters WHERE text_id = ?", (text_id,)).fetchone()[0] == 2
+
+
+def test_migrate_skips_partial_imports(db):
+    with get_db() as conn:
+        # Left by an import that crashed before the importing flag existed
+        partial = conn.execute("INSERT INTO texts (user_id, title, content) VALUES (?, 'Partial', '')",
+                               (db,)).lastrowid
+        conn.execute("INSERT INTO chapters (text_id, chapter_index, title, content, char_count, sentence_start, "
+                     "sentence_count) VALUES (?, 0, 'Chapter 1', 'x', 1, 0, 0)", (partial,))
+        importing = conn.execute("INSERT INTO texts (user_id, title, content, chapter_count, importing) "
+                                 "VALUES (?, 'Importing', '', 0, 1)", (db,)).lastrowid
+    legacy = _legacy_text(db, "A short old text.", [("A short old text.", None, None)])
+
+    chapters.migrate_legacy_texts()
+    with get_db() as conn:
+        counts = dict(conn.execute("SELECT text_id, COUNT(*) FROM chapters GROUP BY text_id").fetchall())
+    assert counts == {partial: 1, legacy: 1}
+
+    assert chapters.discard_interrupted_imports() == 1
+    with get_db() as conn:
+        assert conn.execute("SELECT 1 FROM texts WHERE id = ?", (importing,)).fetchone() is None
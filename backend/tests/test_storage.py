@@ -0,0 +1,223 @@
+"""
+The Storage contract, run against each backend: SQLite on a temporary file,
+and PostgreSQL when DATABASE_URL points at a scratch database (its tables
+are emptied before every test).
+"""
+
+import asyncio
+import io
+import json
+import os
+
+import pytest
+
+from app import database
+from app.config import RETRIEVAL_CONFIG
+from app.services import bundles, lexicon, nlp, retrieval, translation_memory
+from app.storage.base import InsufficientCredits
+
+BOOK = [
+    ("Chapter 1", "The ship left the harbour at dawn. Nobody on board knew where it was going."),
+    ("Chapter 2", "Three days later the storm came. The captain ordered everyone below deck."),
+]
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def storage(request, tmp_path, monkeypatch):
+    if nlp.nlp is None:
+        nlp.init_spacy()  # as at server startup, so chapters split into sentences
+    if request.param == "sqlite":
+        from app.storage.sqlite import SQLiteStorage
+        monkeypatch.setattr(database, "DATABASE_PATH", str(tmp_path / "test.db"))
+        database.init_database()
+        backend = SQLiteStorage()
+    else:
+        dsn = os.getenv("DATABASE_URL")
+        if not dsn:
+            pytest.skip("DATABASE_URL is not set")
+        from app.storage.postgres import PostgresStorage
+        backend = PostgresStorage(dsn, 1, 2, 30)
+    monkeypatch.setattr("app.storage._storage", backend)
+    monkeypatch.setitem(RETRIEVAL_CONFIG, "index_dir", str(tmp_path / "retrieval_index"))
+    return backend
+
+
+def run(storage, scenario):
+    """Run scenario(storage) on a fresh event loop with the storage open and empty"""
+    async def main():
+        await storage.open()
+        try:
+            if storage.name == "postgres":
+                async with storage._pool.acquire() as conn:
+                    await conn.execute("TRUNCATE users, texts, chapters, sentences, tm_signatures, tm_bands "
+                                       "RESTART IDENTITY CASCADE")
+            return await scenario(storage)
+        finally:
+            await storage.close()
+    return asyncio.run(main())
+
+
+async def _user(storage, email="reader@example.com") -> int:
+    return (await storage.create_user(email, "hash"))["id"]
+
+
+async def _book(storage, user_id: int) -> int:
+    text_id, count = await storage.create_text(user_id, "Voyage", iter(BOOK))
+    assert count == 4
+    return text_id
+
+
+def test_users_and_credits(storage):
+    async def scenario(s):
+        user = await s.create_user("a@example.com", "hash")
+        assert await s.create_user("a@example.com", "other") is None
+        assert (await s.get_user_by_email("a@example.com"))["id"] == user["id"]
+        assert (await s.add_credits(user["id"], 5))["credits"] == 105
+        assert await s.deduct_credits(user["id"], 100) == 5
+        with pytest.raises(InsufficientCredits):
+            await s.deduct_credits(user["id"], 6)
+        assert await s.deduct_credits(user["id"], 6, partial=True) == 0
+        assert await s.deduct_credits(user["id"] + 1, 1) is None
+    run(storage, scenario)
+
+
+def test_texts_and_chapters(storage):
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        assert [t["id"] for t in await s.list_texts(user_id)] == [text_id]
+        assert not await s.owns_text(text_id, user_id + 1)
+
+        chapters = await s.list_chapters(text_id)
+        assert [(c["chapter_index"], c["sentence_start"], c["sentence_count"]) for c in chapters] == \
+            [(0, 0, 2), (1, 2, 2)]
+        assert (await s.get_chapter(text_id, 1))["content"] == BOOK[1][1]
+
+        second = await s.list_sentences(text_id, 1)
+        await s.update_progress(text_id, {"current_paragraph_id": second[0]["id"]})
+        assert (await s.get_text(text_id, user_id))["current_chapter"] == 1
+
+        assert await s.delete_text(text_id, user_id)
+        assert await s.get_text(text_id, user_id) is None
+    run(storage, scenario)
+
+
+def test_failed_import_leaves_nothing(storage):
+    def chapters():
+        yield BOOK[0]
+        raise ValueError("corrupt file")
+
+    async def scenario(s):
+        user_id = await _user(s)
+        with pytest.raises(ValueError):
+            await s.create_text(user_id, "Broken", chapters())
+        assert await s.list_texts(user_id) == []
+    run(storage, scenario)
+
+
+def test_sentence_updates(storage):
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        ids = [r["id"] for r in await s.list_sentences(text_id)]
+
+        assert set(await s.update_sentences(text_id, [(ids[0], "t0", None), (ids[1], None, '{"a": 1}')])) >= \
+            {ids[0], ids[1]}
+        assert await s.update_sentences(text_id + 1, [(ids[0], "x", None)]) == []
+        assert await s.update_sentence(ids[2], user_id + 1, translation="x") is None
+        row = await s.update_sentence(ids[2], user_id, translation="t2")
+        assert row["translation"] == "t2" and row["analysis_json"] is None
+
+        pending = await s.next_unanalyzed(text_id, ids[0], 10)
+        assert [r["id"] for r in pending] == ids[1:]
+        await s.save_analyses([(ids[1], "c", "t1", '{"b": 2}')])
+        owned = await s.get_owned_sentences(ids[:2], user_id)
+        assert owned[ids[0]]["translation"] == "t0"
+        assert json.loads(owned[ids[1]]["analysis_json"]) == {"b": 2}
+        assert owned[ids[1]]["vocab_level"] == "B1"
+    run(storage, scenario)
+
+
+def test_sentence_batches_and_vocab(storage):
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        batches = [b async for b in s.sentence_batches(text_id, 3)]
+        assert [len(b) for b in batches] == [3, 1]
+        rows = [r for b in batches for r in b]
+        assert [r["sentence_index"] for r in rows] == [0, 1, 2, 3]
+
+        await s.set_vocab([(rows[0]["id"], '[{"word": "harbour"}]', 4)])
+        first = (await s.list_sentences(text_id, 0))[0]
+        assert (first["vocab_json"], first["vocab_max"]) == ('[{"word": "harbour"}]', 4)
+
+        await s.save_analyses([(rows[3]["id"], rows[3]["content"], "t", "{}")])
+        assert [r["id"] async for b in s.sentence_batches(None, 10, analyzed=True) for r in b] == [rows[3]["id"]]
+        assert list(await s.get_text_sentences(text_id, [rows[1]["id"], 10 ** 9])) == [rows[1]["id"]]
+    run(storage, scenario)
+
+
+def test_translation_memory_reuse(storage):
+    source = "The ship left the harbour at dawn with all of its crew."
+    duplicate = "The ship left the harbour at dawn, with all its crew!"
+
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id, _ = await s.create_text(user_id, "Memory", iter([("Chapter 1", f"{source}\n\n{duplicate}")]))
+        first, second = await s.list_sentences(text_id)
+        await s.save_analyses([(first["id"], first["content"], "translated", '{"k": 1}')])
+
+        left = await translation_memory.reuse_from_memory([{"id": second["id"], "content": second["content"]}])
+        assert left == []
+        reused = (await s.get_owned_sentences([second["id"]], user_id))[second["id"]]
+        assert (reused["translation"], reused["analysis_json"]) == ("translated", '{"k": 1}')
+
+        other = {"id": second["id"], "content": "Completely different words about a quiet garden party."}
+        assert await translation_memory.reuse_from_memory([other]) == [other]
+        assert await translation_memory.index_text(text_id) == 2
+    run(storage, scenario)
+
+
+def test_bundle_roundtrip(storage):
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        rows = await s.list_sentences(text_id)
+        await s.save_analyses([(rows[1]["id"], rows[1]["content"], "t1", '{"x": 1}')])
+        await s.update_progress(text_id, {"current_paragraph_id": rows[2]["id"]})
+
+        data = b"".join([chunk async for chunk in bundles.export_bundle(text_id, user_id, compress=True)])
+        copy_id = await bundles.import_bundle(user_id, io.BytesIO(data))
+        copy = await s.get_text(copy_id, user_id)
+        assert (copy["title"], copy["chapter_count"], copy["current_chapter"]) == ("Voyage", 2, 1)
+        copied = await s.list_sentences(copy_id)
+        assert [r["content"] for r in copied] == [r["content"] for r in rows]
+        assert (copied[1]["translation"], copied[1]["analysis_json"]) == ("t1", '{"x": 1}')
+
+        truncated = io.BytesIO(b"\n".join(bundles.gzip.decompress(data).split(b"\n")[:-2]))
+        with pytest.raises(bundles.BundleError):
+            await bundles.import_bundle(user_id, truncated)
+        assert len(await s.list_texts(user_id)) == 2
+    run(storage, scenario)
+
+
+def test_retrieval(storage):
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        hits = await retrieval.retrieve_context(text_id, "the captain ordered", 2)
+        assert "The captain ordered everyone below deck." in [h["content"] for h in hits]
+        assert [h["sentence_index"] for h in hits] == sorted(h["sentence_index"] for h in hits)
+    run(storage, scenario)
+
+
+def test_lexicon_annotation(storage, monkeypatch):
+    monkeypatch.setattr(lexicon, "load", lambda: True)
+    monkeypatch.setattr(lexicon, "annotate", lambda sentences: [([], 0) for _ in sentences])
+
+    async def scenario(s):
+        user_id = await _user(s)
+        text_id = await _book(s, user_id)
+        assert await lexicon.annotate_text(text_id) == 4
+        assert {r["vocab_max"] for r in await s.list_sentences(text_id)} == {0}
+    run(storage, scenario)
@@ -0,0 +1,98 @@
+"""
+Replay recorded Gemini streamGenerateContent?alt=sse bodies through
+stream_google, split into two network chunks at every byte offset (inside
+multi-byte UTF-8 sequences and CRLF pairs included) and one byte at a time.
+"""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from app.services import ai
+
+
+def _event(text: str, finish: bool = False) -> dict:
+    candidate = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if finish:
+        candidate["finishReason"] = "STOP"
+    return {"candidates": [candidate], "modelVersion": "gemini-2.5-flash-lite"}
+
+
+CHUNKS = ["The quick brown fox ", "jumps over — «the» lazy dog. ", "这是中文，带表情 😀。", "},{ and \"quotes\"\n"]
+RECORDED = "".join(
+    f"data: {json.dumps(_event(text, finish=i == len(CHUNKS) - 1), ensure_ascii=False)}\r\n\r\n"
+    for i, text in enumerate(CHUNKS)
+).encode("utf-8")
+EXPECTED = "".join(CHUNKS)
+
+RECORDED_ERROR = (
+    f"data: {json.dumps(_event('Partial answer '))}\r\n\r\n"
+    'data: {"error": {"code": 503, "message": "The model is overloaded.", "status": "UNAVAILABLE"}}\r\n\r\n'
+).encode("utf-8")
+
+
+_AsyncClient = httpx.AsyncClient
+
+
+class _Body(httpx.AsyncByteStream):
+    def __init__(self, pieces):
+        self.pieces = pieces
+
+    async def __aiter__(self):
+        for piece in self.pieces:
+            yield piece
+
+
+def _replay(monkeypatch, pieces, status_code: int = 200):
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert "alt=sse" in str(request.url)
+        return httpx.Response(status_code, headers={"Content-Type": "text/event-stream"}, stream=_Body(pieces))
+
+    monkeypatch.setattr(ai.httpx, "AsyncClient",
+                        lambda **kwargs: _AsyncClient(transport=httpx.MockTransport(handler), **kwargs))
+
+
+async def _collect() -> list:
+    return [text async for text in ai.stream_google("key", "system", "query")]
+
+
+def _splits(body: bytes):
+    for offset in range(len(body) + 1):
+        yield [body[:offset], body[offset:]]
+    yield [body[i:i + 1] for i in range(len(body))]
+
+
+def test_recording_covers_tricky_boundaries():
+    # The splits below only mean something if the body has these to cut through
+    assert b"\r\n" in RECORDED
+    assert any(b >= 0xF0 for b in RECORDED)  # a 4-byte UTF-8 sequence
+
+
+def test_every_chunk_split_yields_same_text(monkeypatch):
+    for pieces in _splits(RECORDED):
+        _replay(monkeypatch, pieces)
+        texts = asyncio.run(_collect())
+        assert "".join(texts) == EXPECTED, f"split at {len(pieces[0])}"
+        assert len(texts) == len(CHUNKS)
+
+
+def test_error_payload_raises_at_every_split(monkeypatch):
+    for pieces in _splits(RECORDED_ERROR):
+        _replay(monkeypatch, pieces)
+        received = []
+
+        async def consume():
+            async for text in ai.stream_google("key", "system", "query"):
+                received.append(text)
+
+        with pytest.raises(Exception, match="The model is overloaded"):
+            asyncio.run(consume())
+        assert received == ["Partial answer "]
+
+
+def test_http_error_status_raises(monkeypatch):
+    _replay(monkeypatch, [b'{"error": {"message": "API key not valid"}}'], status_code=400)
+    with pytest.raises(Exception, match="API key not valid"):
+        asyncio.run(_collect())
@@ -0,0 +1,123 @@
+"""
+Resumable streams: replay after a Last-Event-ID, the trimmed ring buffer,
+terminal events, and dropping finished streams once their TTL passes.
+"""
+
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import STREAM_RESUME_CONFIG
+from app.services import streams
+from app.services.streams import StreamGone
+
+
+@pytest.fixture(autouse=True)
+def sessions(monkeypatch):
+    monkeypatch.setattr(streams, "_sessions", {})
+    return streams._sessions
+
+
+async def _collect(session, last_event_id=0):
+    return [event async for event in session.follow(last_event_id)]
+
+
+def _produce(chunks, gate=None, error=None):
+    async def produce():
+        for i, chunk in enumerate(chunks):
+            if gate is not None and i == len(chunks) // 2:
+                await gate.wait()
+            yield chunk
+        if error:
+            raise error
+    return produce
+
+
+def test_replay_after_last_event_id():
+    async def main():
+        finished = []
+        session = streams.start_stream(1, _produce(["a", "b", "c"]), lambda: finished.append(True))
+        await session.task
+        assert finished == [True]
+        assert await _collect(session) == [(1, "a"), (2, "b"), (3, "c"), (4, "[DONE]")]
+        assert await _collect(session, 2) == [(3, "c"), (4, "[DONE]")]
+        assert await _collect(session, 4) == []
+    asyncio.run(main())
+
+
+def test_reconnect_mid_stream_gets_missed_then_live_events():
+    async def main():
+        gate = asyncio.Event()
+        session = streams.start_stream(1, _produce(["a", "b", "c", "d"], gate))
+        await asyncio.sleep(0)
+        assert session.events == [(1, "a"), (2, "b")] and not session.done
+
+        # The client saw event 1, dropped, and reconnects while the upstream is still going
+        follower = asyncio.create_task(_collect(session, 1))
+        await asyncio.sleep(0)
+        gate.set()
+        assert await follower == [(2, "b"), (3, "c"), (4, "d"), (5, "[DONE]")]
+    asyncio.run(main())
+
+
+def test_trimmed_events_cannot_be_replayed(monkeypatch):
+    monkeypatch.setitem(STREAM_RESUME_CONFIG, "buffer_events", 2)
+
+    async def main():
+        session = streams.start_stream(1, _produce([str(i) for i in range(5)]))
+        await session.task
+        # The 5th event overflowed 2 * 2 and trimmed back to 2, then [DONE] arrived
+        assert session.base_id == 4 and [e for e, _ in session.events] == [4, 5, 6]
+        assert await _collect(session, 3) == [(4, "3"), (5, "4"), (6, "[DONE]")]
+        with pytest.raises(StreamGone):
+            await _collect(session, 2)
+    asyncio.run(main())
+
+
+def test_upstream_error_is_the_last_event():
+    async def main():
+        session = streams.start_stream(1, _produce(["a"], error=RuntimeError("quota exceeded")))
+        await session.task
+        assert await _collect(session) == [(1, "a"), (2, "[ERROR]quota exceeded")]
+    asyncio.run(main())
+
+
+def test_finished_streams_expire_after_ttl(monkeypatch, sessions):
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(streams, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    ttl = STREAM_RESUME_CONFIG["ttl"]
+
+    async def main():
+        session = streams.start_stream(1, _produce(["a"]))
+        assert streams.get_stream(session.id, 2) is None  # someone else's stream
+        await session.task
+
+        clock.now += ttl
+        assert streams.get_stream(session.id, 1) is session
+        clock.now += 1
+        assert streams.get_stream(session.id, 1) is None
+        assert session.id not in sessions
+
+        # Expired streams are also swept when the next one starts
+        old = streams.start_stream(1, _produce(["a"]))
+        await old.task
+        clock.now += ttl + 1
+        new = streams.start_stream(1, _produce(["b"]))
+        await new.task
+        assert list(sessions) == [new.id]
+    asyncio.run(main())
+
+
+def test_session_cap_drops_oldest_finished(monkeypatch, sessions):
+    monkeypatch.setitem(STREAM_RESUME_CONFIG, "max_sessions", 2)
+
+    async def main():
+        first = streams.start_stream(1, _produce(["a"]))
+        await first.task
+        second = streams.start_stream(1, _produce(["b"]))
+        await second.task
+        third = streams.start_stream(1, _produce(["c"]))
+        await third.task
+        assert list(sessions) == [second.id, third.id]
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+"""
+Translation memory: MinHash signatures and LSH band keys, and the
+similarity threshold that decides whether a stored analysis is reused.
+"""
+
+import numpy as np
+
+from app.config import TRANSLATION_MEMORY_CONFIG
+from app.services import translation_memory as tm
+
+SOURCE = "The ship left the harbour at dawn with all of its crew."
+
+
+def _candidate(sentence_id: int, sig: np.ndarray) -> dict:
+    return {"sentence_id": sentence_id, "signature": sig.tobytes(),
+            "translation": f"t{sentence_id}", "analysis_json": "{}"}
+
+
+def _differing(sig: np.ndarray, positions: int) -> np.ndarray:
+    """A copy of sig that disagrees in its first positions entries"""
+    other = sig.copy()
+    other[:positions] += 1
+    return other
+
+
+def test_signature_ignores_case_and_punctuation():
+    sig = tm.signature(SOURCE)
+    assert sig.dtype == np.uint32 and sig.shape == (tm.NUM_PERM,)
+    variant = tm.signature("THE SHIP LEFT -- the harbour, at dawn; with all of its crew!!")
+    assert tm.similarity(sig, variant) == 1.0
+    assert tm.band_keys(sig) == tm.band_keys(variant)
+    assert tm.signature("Too short.") is None
+
+
+def test_near_duplicates_share_a_band_and_strangers_do_not():
+    sig = tm.signature(SOURCE)
+    near = tm.signature("The ship left the harbour at dawn, with all its crew!")
+    far = tm.signature("Completely different words about a quiet garden party.")
+    assert tm.similarity(sig, near) >= TRANSLATION_MEMORY_CONFIG["reuse_threshold"]
+    assert set(tm.band_keys(sig)) & set(tm.band_keys(near))
+    assert tm.similarity(sig, far) < 0.2
+    assert not set(tm.band_keys(sig)) & set(tm.band_keys(far))
+
+
+def test_default_reuse_threshold():
+    sig = tm.signature(SOURCE)
+    threshold = TRANSLATION_MEMORY_CONFIG["reuse_threshold"]
+    reusable = int(tm.NUM_PERM * (1 - threshold))  # most entries that may differ
+    assert tm.best_match(sig, [_candidate(1, _differing(sig, reusable))])["similarity"] >= threshold
+    assert tm.best_match(sig, [_candidate(1, _differing(sig, reusable + 1))]) is None
+
+
+def test_reuse_threshold_is_inclusive(monkeypatch):
+    monkeypatch.setitem(TRANSLATION_MEMORY_CONFIG, "reuse_threshold", 0.75)
+    sig = tm.signature(SOURCE)
+    at = _differing(sig, tm.NUM_PERM // 4)            # exactly 0.75
+    below = _differing(sig, tm.NUM_PERM // 4 + 1)
+    assert tm.similarity(sig, at) == 0.75
+
+    hit = tm.best_match(sig, [_candidate(1, at)])
+    assert (hit["source_id"], hit["similarity"], hit["translation"]) == (1, 0.75, "t1")
+    assert tm.best_match(sig, [_candidate(2, below)]) is None
+
+
+def test_best_match_prefers_the_closest_and_skips_itself():
+    sig = tm.signature(SOURCE)
+    candidates = [_candidate(1, _differing(sig, 8)), _candidate(2, sig), _candidate(3, _differing(sig, 2))]
+    assert tm.best_match(sig, candidates)["source_id"] == 2
+    assert tm.best_match(sig, candidates, exclude_id=2)["source_id"] == 3
+    assert tm.best_match(sig, []) is None
+
+
+def test_memory_rows(monkeypatch):
+    sig_rows, band_rows = tm.memory_rows([(1, SOURCE), (2, "Too short."), (1, SOURCE)])
+    assert [sentence_id for sentence_id, _ in sig_rows] == [1]
+    assert np.array_equal(np.frombuffer(sig_rows[0][1], dtype=np.uint32), tm.signature(SOURCE))
+    assert band_rows == [(key, 1) for key in tm.band_keys(tm.signature(SOURCE))]
+
+    monkeypatch.setitem(TRANSLATION_MEMORY_CONFIG, "enabled", False)
+    assert tm.memory_rows([(1, SOURCE)]) == ([], [])
@@ -1,7 +1,6 @@
 import { useState, useRef, useEffect } from 'react';
 import { useApp } from '../../context/AppContext';
 import { useAuth } from '../../context/AuthContext';
-import { api } from '../../services/api';
 import { marked } from 'marked';
 import { PROMPTS } from '../../services/prompts';
 
@@ -73,11 +72,21 @@ export default function Paragraph({ id, data, isActive }) {
                     const textToAnalyze = currentData.text;
 
                     console.log(`[Paragraph ${id}] Analyzing content...`);
-                    const result = await aiService.analyzeSentence(textToAnalyze);
+
+                    // Stored sentences are analyzed (batched + persisted) by the backend
+                    const isStored = token && typeof id === 'number';
+                    let result;
+                    if (isStored) {
+                        const [row] = await aiService.analyzeStoredSentences([id]);
+                        if (!row?.analysis) throw new Error('No analysis returned');
+                        result = { translation: row.translation, ...row.analysis };
+                    } else {
+                        result = await aiService.analyzeSentence(textToAnalyze);
+                    }
 
                     console.log(`[Paragraph ${id}] Analysis success.`);
 
-                    // 1. Update Context
+                    // Update Context (persistence happens server-side for stored sentences)
                     updateBookData(id, {
                         knowledge: result.knowledge || [],
                         insight: result.insight || { tag: 'Analysis', text: 'No insight' },
@@ -86,23 +95,6 @@ export default function Paragraph({ id, data, isActive }) {
                         companion: result.companion || null
                     });
 
-                    // 2. Persist to Backend
-                    if (token && typeof id === 'number') {
-                        try {
-                            await api.updateSentence(token, id, {
-                                translation: result.translation,
-                                analysis: {
-                                    knowledge: result.knowledge || [],
-                                    insight: result.insight,
-                                    xray: result.xray,
-                                    companion: result.companion || null
-                                }
-                            });
-                        } catch (e) {
-                            console.error(`[Paragraph ${id}] Failed to persist analysis:`, e);
-                        }
-                    }
-
                 } catch (err) {
                     console.error(`[Paragraph ${id}] Analysis failed:`, err);
                 } finally {
@@ -2,7 +2,7 @@ import { useRef, useEffect, useCallback, useMemo } from 'react';
 import { useApp } from '../../context/AppContext';
 import Paragraph from './Paragraph';
 
-export default function ReaderPanel({ paragraphs, title }) {
+export default function ReaderPanel({ paragraphs, title, chapters = [], chapterIndex = null, onChapterChange }) {
     const { activeId, setActiveId, mode } = useApp();
     const panelRef = useRef(null);
     const markerRef = useRef(null);
@@ -31,6 +31,15 @@ export default function ReaderPanel({ paragraphs, title }) {
         }
     }, [paragraphs, activeId]);
 
+    // Start a newly loaded chapter from the top
+    const shownChapter = useRef(chapterIndex);
+    useEffect(() => {
+        if (shownChapter.current !== chapterIndex && panelRef.current) {
+            panelRef.current.scrollTo({ top: 0, behavior: 'auto' });
+        }
+        shownChapter.current = chapterIndex;
+    }, [chapterIndex, paragraphs]);
+
     // Update marker position function
     const updateMarkerPosition = useCallback(() => {
         if (!activeId || !markerRef.current || !panelRef.current) return;
@@ -138,6 +147,19 @@ export default function ReaderPanel({ paragraphs, title }) {
                     <div className="book-title">Pride and Prejudice</div>
                 )}
 
+                {chapters.length > 1 && (
+                    <div className="chapter-nav">
+                        <select
+                            value={chapterIndex ?? 0}
+                            onChange={(e) => onChapterChange?.(Number(e.target.value))}
+                        >
+                            {chapters.map(c => (
+                                <option key={c.index} value={c.index}>{c.title || `Part ${c.index + 1}`}</option>
+                            ))}
+                        </select>
+                    </div>
+                )}
+
                 {paragraphs.map((para, index) => (
                     <Paragraph
                         key={para.id || `p-${index}`}
@@ -147,6 +169,14 @@ export default function ReaderPanel({ paragraphs, title }) {
                     />
                 ))}
 
+                {chapters.length > 1 && chapterIndex < chapters.length - 1 && (
+                    <div className="chapter-nav">
+                        <button onClick={() => onChapterChange?.(chapterIndex + 1)}>
+                            下一章 ›
+                        </button>
+                    </div>
+                )}
+
                 {/* Bottom spacer for scroll padding */}
                 <div style={{ height: '60vh' }}></div>
             </div>
@@ -13,7 +13,7 @@ export default function LibraryPage() {
     const [importContent, setImportContent] = useState('');
     const [importing, setImporting] = useState(false);
     const [recharging, setRecharging] = useState(false);
-    const [importType, setImportType] = useState('text'); // 'text' or 'pdf'
+    const [importType, setImportType] = useState('text'); // 'text' or 'file'
     const [importFile, setImportFile] = useState(null);
     const navigate = useNavigate();
 
@@ -37,16 +37,22 @@ export default function LibraryPage() {
                 alert('请填写标题和内容');
                 return;
             }
-        } else if (importType === 'pdf') {
+        } else if (importType === 'file') {
             if (!importFile) {
-                alert('请选择 PDF 文件');
+                alert('请选择文件');
                 return;
             }
         }
 
         setImporting(true);
         try {
-            if (importType === 'pdf') {
+            if (importType === 'file' && /\.(ndjson|gz)$/i.test(importFile.name)) {
+                // Bundle exported from this or another instance
+                await api.importBundle(token, importFile);
+            } else if (importType === 'file' && /\.(epub|txt)$/i.test(importFile.name)) {
+                // Books are parsed and stored chapter by chapter on the server
+                await api.importBook(token, importFile);
+            } else if (importType === 'file') {
                 // Upload PDF first to get text
                 const result = await api.uploadPdf(token, importFile);
                 if (result.success) {
@@ -80,6 +86,21 @@ export default function LibraryPage() {
         }
     };
 
+    const handleExport = async (e, text) => {
+        e.stopPropagation();
+        try {
+            const blob = await api.exportText(token, text.id);
+            const url = URL.createObjectURL(blob);
+            const link = document.createElement('a');
+            link.href = url;
+            link.download = `${text.title}.ndjson.gz`;
+            link.click();
+            URL.revokeObjectURL(url);
+        } catch (err) {
+            alert("导出失败: " + err.message);
+        }
+    };
+
     const handleDelete = async (e, textId) => {
         e.stopPropagation();
         if (!confirm('确定要删除这篇文章吗？')) return;
@@ -618,13 +639,22 @@ export default function LibraryPage() {
                                                 更新于 {new Date(text.updated_at).toLocaleDateString('zh-CN')}
                                             </div>
                                         </div>
-                                        <button
-                                            className="delete-btn"
-                                            onClick={(e) => handleDelete(e, text.id)}
-                                            title="删除"
-                                        >
-                                            🗑️
-                                        </button>
+                                        <div style={{ display: 'flex', flexShrink: 0 }}>
+                                            <button
+                                                className="delete-btn"
+                                                onClick={(e) => handleExport(e, text)}
+                                                title="导出"
+                                            >
+                                                📦
+                                            </button>
+                                            <button
+                                                className="delete-btn"
+                                                onClick={(e) => handleDelete(e, text.id)}
+                                                title="删除"
+                                            >
+                                                🗑️
+                                            </button>
+                                        </div>
                                     </div>
                                     <div className="text-card-body">
                                         <p className="text-card-preview">{text.content}</p>
@@ -697,10 +727,10 @@ export default function LibraryPage() {
                                         ✏️ 文本粘贴
                                     </button>
                                     <button
-                                        className={`import-tab ${importType === 'pdf' ? 'active' : ''}`}
-                                        onClick={() => setImportType('pdf')}
+                                        className={`import-tab ${importType === 'file' ? 'active' : ''}`}
+                                        onClick={() => setImportType('file')}
                                     >
-                                        📄 PDF 上传
+                                        📄 文件上传
                                     </button>
                                 </div>
 
@@ -752,7 +782,7 @@ export default function LibraryPage() {
                                         <input
                                             type="file"
                                             className="file-input"
-                                            accept=".pdf"
+                                            accept=".pdf,.epub,.txt,.ndjson,.gz"
                                             onChange={(e) => setImportFile(e.target.files[0])}
                                         />
                                         <div style={{ pointerEvents: 'none' }}>
@@ -769,10 +799,10 @@ export default function LibraryPage() {
                                             ) : (
                                                 <div>
                                                     <div style={{ fontWeight: 600, color: '#1e293b' }}>
-                                                        点击或拖拽 PDF 文件到这里
+                                                        点击或拖拽 EPUB / TXT / PDF 文件到这里
                                                     </div>
                                                     <div style={{ color: '#94a3b8', fontSize: '0.9rem', marginTop: 4 }}>
-                                                        支持文字版 PDF (最大 10MB)
+                                                        EPUB、TXT 最大 100MB，文字版 PDF 最大 10MB，也可导入导出的 .ndjson.gz 文件
                                                     </div>
                                                 </div>
                                             )}
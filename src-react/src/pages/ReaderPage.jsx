@@ -9,6 +9,30 @@ import CopilotPanel from '../components/CopilotPanel/CopilotPanel';
 import ImportModal from '../components/ImportModal/ImportModal';
 import { demoParagraphs, demoBookData } from '../data/demoData';
 
+// Map backend sentences to reader paragraphs, populating context with their analysis
+const toParagraphs = (sentences, updateBookData) => sentences.map(p => {
+    const analysis = p.analysis || {};
+    updateBookData(p.id, {
+        text: p.content,  // Add text for CopilotPanel preview
+        knowledge: analysis.knowledge || [],
+        insight: analysis.insight || { tag: '分析', text: '暂无解析' },
+        translation: p.translation || '暂无翻译',
+        xray: analysis.xray || null,
+        companion: analysis.companion || null
+    });
+
+    return {
+        id: p.id,
+        text: p.content,
+        sentence_index: p.sentence_index,
+        knowledge: analysis.knowledge || [],
+        insight: analysis.insight,
+        translation: p.translation,
+        xray: analysis.xray,
+        companion: analysis.companion || null
+    };
+});
+
 export default function ReaderPage() {
     const { textId } = useParams();
     const { token } = useAuth();
@@ -17,6 +41,9 @@ export default function ReaderPage() {
     const [loading, setLoading] = useState(true);
     const [importModalOpen, setImportModalOpen] = useState(false);
     const [textTitle, setTextTitle] = useState('');
+    // Long books are read one chapter at a time
+    const [chapters, setChapters] = useState([]);
+    const [chapterIndex, setChapterIndex] = useState(null);
 
     // Config Sync Debounce
     const syncTimeoutRef = useRef(null);
@@ -48,34 +75,14 @@ export default function ReaderPage() {
                     if (text.vocab_level) changeVocabLevel(text.vocab_level);
                     if (text.current_paragraph_id) setActiveId(text.current_paragraph_id);
 
-                    // 2. Get Sentences (Flat list)
-                    const paras = await api.getSentences(token, textId);
-
-                    const mappedParas = paras.map(p => {
-                        // Populate Context with latest data
-                        const analysis = p.analysis || {};
-                        updateBookData(p.id, {
-                            text: p.content,  // Add text for CopilotPanel preview
-                            knowledge: analysis.knowledge || [],
-                            insight: analysis.insight || { tag: '分析', text: '暂无解析' },
-                            translation: p.translation || '暂无翻译',
-                            xray: analysis.xray || null,
-                            companion: analysis.companion || null
-                        });
-
-                        return {
-                            id: p.id,
-                            text: p.content,
-                            sentence_index: p.sentence_index,
-                            knowledge: analysis.knowledge || [],
-                            insight: analysis.insight,
-                            translation: p.translation,
-                            xray: analysis.xray,
-                            companion: analysis.companion || null
-                        };
-                    });
+                    // 2. Get Sentences (only the chapter being read for multi-chapter books)
+                    const chapterList = text.chapter_count > 1 ? await api.getChapters(token, textId) : [];
+                    const current = chapterList.length ? (text.current_chapter ?? 0) : null;
+                    setChapters(chapterList);
+                    setChapterIndex(current);
 
-                    setParagraphs(mappedParas);
+                    const paras = await api.getSentences(token, textId, current);
+                    setParagraphs(toParagraphs(paras, updateBookData));
                 } catch (err) {
                     console.error('Failed to load text:', err);
                     loadDemoContent();
@@ -120,6 +127,18 @@ export default function ReaderPage() {
         return () => clearTimeout(syncTimeoutRef.current);
     }, [mode, level, vocabLevel, activeId, textId, token]);
 
+    const handleChapterChange = async (index) => {
+        if (index === chapterIndex || index < 0 || index >= chapters.length) return;
+        try {
+            const paras = await api.getSentences(token, textId, index);
+            setChapterIndex(index);
+            setParagraphs(toParagraphs(paras, updateBookData));
+            if (paras.length > 0) setActiveId(paras[0].id);
+        } catch (err) {
+            console.error('Failed to load chapter:', err);
+        }
+    };
+
     const handleImport = async (newParagraphs) => {
         const formatted = newParagraphs.map((p, index) => {
             const id = `import-p${index}`;
@@ -217,7 +236,13 @@ export default function ReaderPage() {
             <FloatingControls onImport={() => setImportModalOpen(true)} />
 
             <div className="app-container" id="appContainer">
-                <ReaderPanel paragraphs={paragraphs} title={textTitle} />
+                <ReaderPanel
+                    paragraphs={paragraphs}
+                    title={textTitle}
+                    chapters={chapters}
+                    chapterIndex={chapterIndex}
+                    onChapterChange={handleChapterChange}
+                />
                 <CopilotPanel onReanalyze={handleReanalyze} />
             </div>
 
@@ -1,7 +1,9 @@
 import { AI_CONFIG } from './config.js';
 import { PROMPTS } from './prompts.js';
 
-const API_BASE_URL = 'http://localhost:8000';
+// Empty when the backend serves this build itself (same origin)
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL ?? 'http://localhost:8000';
+const MAX_STREAM_RESUMES = 3;
 
 /**
  * Unified AI Service - uses backend proxy with streaming support
@@ -47,10 +49,43 @@ class AIService {
             throw new Error(err.detail || 'AI request failed');
         }
 
+        // The backend buffers numbered events per stream, so a dropped
+        // connection can be resumed without a new upstream call or credit.
+        const streamId = response.headers.get('X-Stream-Id');
+        const state = { fullText: '', lastEventId: 0, finished: false };
+
+        let attempt = 0;
+        let current = response;
+        while (true) {
+            try {
+                await this._readStream(current, state, onChunk);
+                break;
+            } catch (e) {
+                if (e.isStreamError || !streamId || attempt >= MAX_STREAM_RESUMES) throw e;
+                attempt += 1;
+                console.warn(`[AIService] Stream dropped, resuming ${streamId} after event ${state.lastEventId}`);
+                await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+                current = await fetch(`${API_BASE_URL}/ai/chat/stream/${streamId}`, {
+                    headers: { ...headers, 'Last-Event-ID': String(state.lastEventId) }
+                });
+                if (!current.ok) throw e;
+            }
+        }
+
+        return state.fullText;
+    }
+
+    /**
+     * Read SSE events from a stream response into state.
+     * Throws errors marked isStreamError for [ERROR] events (not resumable).
+     */
+    async _readStream(response, state, onChunk) {
         const reader = response.body.getReader();
         const decoder = new TextDecoder();
-        let fullText = '';
         let buffer = '';
+        // An event's id only counts once its data has been applied (at the blank line
+        // ending the event), so a drop in between resumes from the previous event
+        let pendingId = null;
 
         while (true) {
             const { done, value } = await reader.read();
@@ -62,27 +97,43 @@ class AIService {
             const lines = buffer.split('\n');
             buffer = lines.pop() || ''; // Keep incomplete line in buffer
 
-            for (const line of lines) {
+            for (const rawLine of lines) {
+                const line = rawLine.replace(/\r$/, '');
+                if (line === '') {
+                    if (pendingId !== null) state.lastEventId = pendingId;
+                    pendingId = null;
+                    continue;
+                }
+                if (line.startsWith('id: ')) {
+                    pendingId = parseInt(line.slice(4), 10) || pendingId;
+                    continue;
+                }
                 if (line.startsWith('data: ')) {
                     const data = line.slice(6);
 
                     if (data === '[DONE]') {
+                        state.finished = true;
                         continue;
                     }
 
                     if (data.startsWith('[ERROR]')) {
-                        throw new Error(data.slice(7));
+                        const err = new Error(data.slice(7));
+                        err.isStreamError = true;
+                        throw err;
                     }
 
-                    fullText += data;
+                    state.fullText += data;
                     if (onChunk) {
-                        onChunk(data, fullText);
+                        onChunk(data, state.fullText);
                     }
                 }
             }
         }
 
-        return fullText;
+        // Connection closed before the terminal event: treat as a drop
+        if (!state.finished) {
+            throw new Error('Stream ended unexpectedly');
+        }
     }
 
     /**
@@ -155,6 +206,34 @@ class AIService {
 
     /* splitText removed - replaced by backend Spacy Sentencizer */
 
+    /**
+     * Analyze stored sentences on the backend. The server packs concurrent
+     * requests into shared LLM calls and persists the results itself.
+     * @param {number[]} sentenceIds
+     * @returns {Promise<Object[]>} Sentence rows with translation/analysis
+     */
+    async analyzeStoredSentences(sentenceIds) {
+        const token = this.getToken();
+        const response = await fetch(`${API_BASE_URL}/sentences/analyze`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${token}`
+            },
+            body: JSON.stringify({
+                sentence_ids: sentenceIds,
+                provider: this.config.provider,
+                api_key: this.config[this.config.provider]?.apiKey || null
+            })
+        });
+
+        if (!response.ok) {
+            const err = await response.json();
+            throw new Error(err.detail || 'AI analysis failed');
+        }
+        return response.json();
+    }
+
     /**
      * Analyze a single sentence/paragraph (content analysis).
      */
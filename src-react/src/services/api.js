@@ -1,4 +1,5 @@
-const API_BASE_URL = 'http://localhost:8000';
+// Empty when the backend serves this build itself (same origin)
+const API_BASE_URL = import.meta.env.VITE_API_BASE_URL ?? 'http://localhost:8000';
 
 export const api = {
     async login(email, password) {
@@ -65,6 +66,14 @@ export const api = {
         return true;
     },
 
+    async exportText(token, textId) {
+        const response = await fetch(`${API_BASE_URL}/texts/${textId}/export?compress=true`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) throw new Error('Failed to export text');
+        return response.blob();
+    },
+
     async getTextById(token, textId) {
         const response = await fetch(`${API_BASE_URL}/texts/${textId}`, {
             headers: { 'Authorization': `Bearer ${token}` }
@@ -86,14 +95,24 @@ export const api = {
         return response.json();
     },
 
-    async getSentences(token, textId) {
-        const response = await fetch(`${API_BASE_URL}/texts/${textId}/sentences`, {
+    // chapter (optional): only load that chapter's sentences
+    async getSentences(token, textId, chapter = null) {
+        const query = chapter === null ? '' : `?chapter=${chapter}`;
+        const response = await fetch(`${API_BASE_URL}/texts/${textId}/sentences${query}`, {
             headers: { 'Authorization': `Bearer ${token}` }
         });
         if (!response.ok) throw new Error('Failed to fetch sentences');
         return response.json();
     },
 
+    async getChapters(token, textId) {
+        const response = await fetch(`${API_BASE_URL}/texts/${textId}/chapters`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+        if (!response.ok) throw new Error('Failed to fetch chapters');
+        return response.json();
+    },
+
     /* Split functionality removed in favor of Spacy backend import
     async splitParagraph(token, paraId, sentences) { ... } 
     */
@@ -111,6 +130,20 @@ export const api = {
         return response.json();
     },
 
+    // items: [{ id, translation?, analysis? }] - persisted in one request/transaction
+    async updateSentences(token, textId, items) {
+        const response = await fetch(`${API_BASE_URL}/texts/${textId}/sentences`, {
+            method: 'PUT',
+            headers: {
+                'Content-Type': 'application/json',
+                'Authorization': `Bearer ${token}`
+            },
+            body: JSON.stringify({ items }),
+        });
+        if (!response.ok) throw new Error('Failed to update sentences');
+        return response.json();
+    },
+
     async updateProgress(token, textId, data) {
         const response = await fetch(`${API_BASE_URL}/texts/${textId}/progress`, {
             method: 'PATCH',
@@ -141,6 +174,40 @@ export const api = {
         return response.json();
     },
 
+    async importBook(token, file) {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await fetch(`${API_BASE_URL}/texts/import`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` },
+            body: formData
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Import failed');
+        }
+        return response.json();
+    },
+
+    async importBundle(token, file) {
+        const formData = new FormData();
+        formData.append('file', file);
+
+        const response = await fetch(`${API_BASE_URL}/texts/import-bundle`, {
+            method: 'POST',
+            headers: { 'Authorization': `Bearer ${token}` },
+            body: formData
+        });
+
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.detail || 'Bundle import failed');
+        }
+        return response.json();
+    },
+
     async uploadPdf(token, file) {
         const formData = new FormData();
         formData.append('file', file);